@@ -0,0 +1,59 @@
+from typing import Dict, Optional
+
+import attr
+from brewmonitor.accessor.utils import max_plot_points
+from brewmonitor.storage import access
+from brewmonitor.storage.cache import DataVersion
+from brewmonitor.storage.tables import BaseTable
+from brewmonitor.utils import etag_for
+from flask import request
+from flask_login import current_user
+
+
+# The ETags of the accessor responses, for not_modified() and with_etag().
+
+
+def plot_etag(window: Dict, project_id: int = None, sensor_id: int = None) -> str:
+    """
+    ETag of the plot of a project or a sensor, from the version of their datapoints in
+    the window (see Datapoint.get_version), the sensor names of the traces and what the
+    request asks for.
+    """
+    version = access.get_datapoint_version(project_id, sensor_id, window.get('since'), window.get('until'))
+    names = [(a.sensor_id, a.sensor_name) for a in access.get_sensor_assignments()]
+    return etag_for(version, names, max_plot_points(), request.query_string)
+
+
+def export_etag(version: DataVersion) -> str:
+    """
+    ETag of an export of a project or a sensor. The summary version covers all their
+    datapoints, so a change outside of the window also changes it, but checking the
+    window itself would mean reading the datapoints.
+    """
+    return etag_for(version, request.full_path)
+
+
+# Left out of the rows: the secrets, the ETags are public, and what ProjectData and
+# SensorData load besides the row.
+_not_in_etag = {'secret', 'sensors', 'projects', 'data_points'}
+
+
+def _in_etag(field: attr.Attribute, _) -> bool:
+    return field.name not in _not_in_etag
+
+
+def view_etag(version: DataVersion, *rows: Optional[BaseTable]) -> str:
+    """
+    ETag of the page of a project or a sensor. Besides the datapoints the pages show rows,
+    the project or sensor and what it's attached to, the names of the other sensors and
+    projects, and what the user may do. Only cheap queries, it's checked on every hit.
+    """
+    rows = [None if row is None else attr.astuple(row, filter=_in_etag) for row in rows]
+    return etag_for(
+        version,
+        request.full_path,
+        current_user.get_id(),
+        rows,
+        access.get_sensor_assignments(),
+        access.get_project_names(),
+    )
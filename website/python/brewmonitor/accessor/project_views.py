@@ -1,10 +1,15 @@
+from datetime import timedelta
+from functools import partial
 from http import HTTPStatus
+from typing import Dict, List
 
 from brewmonitor.accessor._app import accessor_bp
-from brewmonitor.accessor.utils import build_view_data
+from brewmonitor.accessor.caching import export_etag, plot_etag, view_etag
+from brewmonitor.accessor.utils import datatable_page, get_resolution, get_window, is_compact, rollup_plot, window_query
 from brewmonitor.storage import access
-from brewmonitor.utils import export_data
-from flask import abort, redirect, request, url_for
+from brewmonitor.storage.tables import Datapoint, Project, Rollup
+from brewmonitor.utils import json_response, not_modified, stream_export, with_etag
+from flask import abort, make_response, redirect, request, url_for
 from flask_login import current_user, login_required
 from flask_mako import render_template
 
@@ -19,17 +24,43 @@ def all_projects():
     )
 
 
+def _management_items(project: Project) -> List[Dict]:
+    """The sensors that can be attached to the project."""
+    management_items = []
+    for assignment in access.get_sensor_assignments():
+        if assignment.sensor_id != project.active_sensor:
+            if assignment.project_id is not None:
+                label = f'Move {assignment.sensor_name} from {assignment.project_name}'
+            else:
+                label = f'Attach {assignment.sensor_name}'
+            management_items.append({
+                'value': assignment.sensor_id,
+                'label': label,
+            })
+    return management_items
+
+
 @accessor_bp.route('/project/<project_id>/', methods=['GET'])
 def get_project(project_id):
 
-    project = access.get_project_data(project_id)
+    version = access.get_project_data_version(project_id)
+    if version is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    project = access.get_project(project_id)
+    linked_sensor = None if project.active_sensor is None else access.get_sensor(project.active_sensor)
+    etag = view_etag(version, project, linked_sensor)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    # The datapoints are only read by the table and get_project_plot.
+    project = access.get_project_data(project_id, with_datapoints=False, **get_window())
     if project is None:
         abort(HTTPStatus.NOT_FOUND)
 
     prev_link_sensors = []
-    linked_sensor = None
     if project.active_sensor is not None:
-        linked_sensor = access.get_sensor(project.active_sensor)
         for s in project.sensors.values():
             if s.id != project.active_sensor:
                 prev_link_sensors.append(s)
@@ -38,27 +69,20 @@ def get_project(project_id):
 
     export_data_links = [
         {
-            'link': url_for('accessor.get_project_data', project_id=project.id, out_format=_format.lower()),
+            'link': url_for(
+                'accessor.get_project_data',
+                project_id=project.id,
+                out_format=_format.lower(),
+                **window_query(),
+            ),
             'label': _format,
             'btn_class': 'btn-primary',
             'target': '_blank',
         }
-        for _format in ['CSV', 'JSON']
+        for _format in ['CSV', 'JSON', 'NDJSON']
     ]
 
-    management_items = []
-    for sensor in access.get_sensors():
-        if sensor.id != project.active_sensor:
-            _, active_project = access.get_active_project_for_sensor(sensor.id)
-
-            if active_project:
-                label = f'Move {sensor.name} from {active_project.name}'
-            else:
-                label = f'Attach {sensor.name}'
-            management_items.append({
-                'value': sensor.id,
-                'label': label,
-            })
+    management_items = _management_items(project)
 
     management_link = None
     if current_user.is_authenticated:
@@ -66,14 +90,18 @@ def get_project(project_id):
 
     delete_next = url_for('accessor.get_project', project_id=project_id, _anchor=f'{project.id}_table')
 
-    datatable, plot = build_view_data(
-        'project',
-        data_points=project.data_points,
-        sensor_info=project.sensors,
-        delete_next=delete_next,
+    # Only the first page, the table gets the others from get_project_datatable.
+    datatable = datatable_page(delete_next, compact=True, project_id=project.id)
+    datatable_url = url_for(
+        'accessor.get_project_datatable',
+        project_id=project.id,
+        payload='compact',
+        **window_query(),
     )
 
-    return render_template(
+    plot_url = url_for('accessor.get_project_plot', project_id=project.id, payload='compact', **window_query())
+
+    page = render_template(
         'accessor/view_project.html.mako',
         elem_obj=project,
         elem_name=project.name,
@@ -81,22 +109,80 @@ def get_project(project_id):
         elem_links=prev_link_sensors,
         data_links=export_data_links,
         datatable=datatable,
-        plot=plot,
+        datatable_url=datatable_url,
+        plot_url=plot_url,
         linked_elem=linked_sensor,
         management_link=management_link,
         management_items=management_items or None,
         allow_delete_datapoints=current_user.is_authenticated,
     )
+    return with_etag(make_response(page), etag)
+
+
+@accessor_bp.route('/project/<project_id>/plot', methods=['GET'])
+def get_project_plot(project_id):
+
+    project = access.get_project(project_id)
+    if project is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    # Cheap check first, the dashboards left open keep asking for it.
+    window = get_window()
+    etag = plot_etag(window, project_id=project.id)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    # Only the sensors, the datapoints are read if the resolution is raw.
+    project = access.get_project_data(project.id, with_datapoints=False, **window)
+    plot = rollup_plot(
+        'project',
+        access.get_datapoint_span(project_id=project.id, **window),
+        project.sensors,
+        partial(access.get_datapoint_series, project_id=project.id, **window),
+        partial(access.get_project_rollups, project.id),
+    )
+    return with_etag(json_response(plot), etag)
+
+
+@accessor_bp.route('/project/<project_id>/datatable', methods=['GET'])
+def get_project_datatable(project_id):
+
+    project = access.get_project(project_id)
+    if project is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    delete_next = url_for('accessor.get_project', project_id=project.id, _anchor=f'{project.id}_table')
+    return json_response(datatable_page(delete_next, compact=is_compact(), project_id=project.id))
 
 
 @accessor_bp.route('/project/<project_id>/datapoints/<out_format>', methods=['GET'])
 def get_project_data(project_id, out_format):
 
-    project = access.get_project_data(project_id)
+    project = access.get_project(project_id)
     if project is None:
         abort(HTTPStatus.NOT_FOUND)
 
-    return export_data(f'project_{project.id}.{out_format}', str(out_format).lower(), project.data_points)
+    # Streamed from the db rather than loaded, the exports can be the whole history.
+    window = get_window()
+    _format = str(out_format).lower()
+    resolution = get_resolution(default='raw')
+
+    # The summary tables tell whether the datapoints changed, without reading them.
+    version = access.get_project_data_version(project.id)
+    etag = export_etag(version)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    span = None if resolution == 'raw' else access.get_datapoint_span(project_id=project.id, **window)
+    if span is None:
+        data_points = access.stream_datapoints(project_id=project.id, **window)
+        response = stream_export(f'project_{project.id}.{out_format}', _format, data_points, Datapoint)
+    else:
+        rollups = access.get_project_rollups(project.id, resolution, span[0], span[1] + timedelta(seconds=1))
+        response = stream_export(f'project_{project.id}_{resolution}.{out_format}', _format, rollups, Rollup)
+    return with_etag(response, etag)
 
 
 @accessor_bp.route('/project/add', methods=['POST'])
@@ -114,14 +200,16 @@ def change_project_sensor(project_id):
     sensor_id = request.form.get('sensor_id', 'null')  # If null we only detach the sensor
     next_ = request.args.get('next') or url_for('accessor.get_project', project_id=project_id)
 
-    project = access.get_project_data(project_id)
+    project = access.get_project(project_id)
     if project is None:
         abort(HTTPStatus.NOT_FOUND)
 
     if sensor_id == 'null':
         sensor_id = None
     else:
-        sensor = access.get_sensor(int(sensor_id))
+        # An int like the sensor_cache keys, for update_project_sensor to invalidate it.
+        sensor_id = int(sensor_id)
+        sensor = access.get_sensor(sensor_id)
         if sensor is None:
             abort(HTTPStatus.NOT_FOUND)
 
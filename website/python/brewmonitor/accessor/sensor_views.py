@@ -1,10 +1,14 @@
+from datetime import timedelta
+from functools import partial
 from http import HTTPStatus
 
 from brewmonitor.accessor._app import accessor_bp
-from brewmonitor.accessor.utils import build_view_data
+from brewmonitor.accessor.caching import export_etag, plot_etag, view_etag
+from brewmonitor.accessor.utils import datatable_page, get_resolution, get_window, is_compact, rollup_plot, window_query
 from brewmonitor.storage import access
-from brewmonitor.utils import export_data
-from flask import redirect, request, url_for
+from brewmonitor.storage.tables import Datapoint, Rollup
+from brewmonitor.utils import json_response, not_modified, stream_export, with_etag
+from flask import make_response, redirect, request, url_for
 from flask_login import current_user, login_required
 from flask_mako import render_template
 from werkzeug.exceptions import abort
@@ -23,11 +27,20 @@ def all_sensors():
 @accessor_bp.route('/sensor/<sensor_id>/', methods=['GET'])
 def get_sensor(sensor_id):
 
-    sensor = access.get_sensor_data(sensor_id)
-    if sensor is None:
+    version = access.get_sensor_data_version(sensor_id)
+    if version is None:
         abort(HTTPStatus.NOT_FOUND)
 
-    _, linked_project = access.get_active_project_for_sensor(sensor_id)
+    sensor, linked_project = access.get_active_project_for_sensor(sensor_id)
+    etag = view_etag(version, sensor, linked_project)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    # The datapoints are only read by the table and get_sensor_plot.
+    sensor = access.get_sensor_data(sensor_id, with_datapoints=False, **get_window())
+    if sensor is None:
+        abort(HTTPStatus.NOT_FOUND)
 
     prev_link_projects = sensor.projects
     management_link = None
@@ -42,24 +55,28 @@ def get_sensor(sensor_id):
 
     data_links = [
         {
-            'link': url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format=_format.lower()),
+            'link': url_for(
+                'accessor.get_sensor_data',
+                sensor_id=sensor.id,
+                out_format=_format.lower(),
+                **window_query(),
+            ),
             'label': _format,
             'btn_class': 'btn-primary',
             'target': '_blank',
         }
-        for _format in ['CSV', 'JSON']
+        for _format in ['CSV', 'JSON', 'NDJSON']
     ]
 
     delete_next = url_for('accessor.get_sensor', sensor_id=sensor_id, _anchor=f'{sensor.id}_table')
 
-    datatable, plot = build_view_data(
-        'sensor',
-        data_points=sensor.data_points,
-        sensor_info={sensor.id: sensor},
-        delete_next=delete_next,
-    )
+    # Only the first page, the table gets the others from get_sensor_datatable.
+    datatable = datatable_page(delete_next, compact=True, sensor_id=sensor.id)
+    datatable_url = url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, payload='compact', **window_query())
 
-    return render_template(
+    plot_url = url_for('accessor.get_sensor_plot', sensor_id=sensor.id, payload='compact', **window_query())
+
+    page = render_template(
         'accessor/view_sensor.html.mako',
         elem_obj=sensor,
         elem_name=sensor.name,
@@ -67,21 +84,78 @@ def get_sensor(sensor_id):
         elem_links=prev_link_projects.values(),
         data_links=data_links,
         datatable=datatable,
-        plot=plot,
+        datatable_url=datatable_url,
+        plot_url=plot_url,
         linked_elem=linked_project,
         management_link=management_link,
         allow_delete_datapoints=current_user.is_authenticated,
     )
+    return with_etag(make_response(page), etag)
+
+
+@accessor_bp.route('/sensor/<sensor_id>/plot', methods=['GET'])
+def get_sensor_plot(sensor_id):
+
+    sensor = access.get_sensor(sensor_id)
+    if sensor is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    # Cheap check first, the dashboards left open keep asking for it.
+    window = get_window()
+    etag = plot_etag(window, sensor_id=sensor.id)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    # The datapoints are only read if the resolution is raw.
+    plot = rollup_plot(
+        'sensor',
+        access.get_datapoint_span(sensor_id=sensor.id, **window),
+        {sensor.id: sensor},
+        partial(access.get_datapoint_series, sensor_id=sensor.id, **window),
+        partial(access.get_sensor_rollups, sensor.id),
+    )
+    return with_etag(json_response(plot), etag)
+
+
+@accessor_bp.route('/sensor/<sensor_id>/datatable', methods=['GET'])
+def get_sensor_datatable(sensor_id):
+
+    sensor = access.get_sensor(sensor_id)
+    if sensor is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    delete_next = url_for('accessor.get_sensor', sensor_id=sensor.id, _anchor=f'{sensor.id}_table')
+    return json_response(datatable_page(delete_next, compact=is_compact(), sensor_id=sensor.id))
 
 
 @accessor_bp.route('/sensor/<sensor_id>/datapoints/<out_format>', methods=['GET'])
 def get_sensor_data(sensor_id, out_format):
 
-    sensor = access.get_sensor_data(sensor_id)
+    sensor = access.get_sensor(sensor_id)
     if sensor is None:
         abort(HTTPStatus.NOT_FOUND)
 
-    return export_data(f'sensor_{sensor.id}.{out_format}', str(out_format).lower(), sensor.data_points)
+    # Streamed from the db rather than loaded, the exports can be the whole history.
+    window = get_window()
+    _format = str(out_format).lower()
+    resolution = get_resolution(default='raw')
+
+    # The summary tables tell whether the datapoints changed, without reading them.
+    version = access.get_sensor_data_version(sensor.id)
+    etag = export_etag(version)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    span = None if resolution == 'raw' else access.get_datapoint_span(sensor_id=sensor.id, **window)
+    if span is None:
+        data_points = access.stream_datapoints(sensor_id=sensor.id, **window)
+        response = stream_export(f'sensor_{sensor.id}.{out_format}', _format, data_points, Datapoint)
+    else:
+        rollups = access.get_sensor_rollups(sensor.id, resolution, span[0], span[1] + timedelta(seconds=1))
+        response = stream_export(f'sensor_{sensor.id}_{resolution}.{out_format}', _format, rollups, Rollup)
+    return with_etag(response, etag)
 
 
 @accessor_bp.route('/sensor/add', methods=['POST'])
@@ -1,12 +1,24 @@
 import dataclasses
-from typing import Dict, List, Tuple
+import math
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
-from brewmonitor.storage.tables import Datapoint, Sensor
-from flask import url_for
+from brewmonitor.configuration import config
+from brewmonitor.storage import access
+from brewmonitor.storage.tables import Datapoint, DatapointSeries, Rollup, Sensor, from_epoch
+from flask import abort, has_app_context, request, url_for
 
 
 # A dictionary that contains the Plotly trace fields.
 TraceDict = Dict
+# What the view helpers accept, a DatapointSeries is used as it is.
+DataPoints = Union[DatapointSeries, Iterable[Datapoint]]
+
+# The sensors send a datapoint every 10 minutes (SLEEP_TIME in hardware/config.h).
+RAW_INTERVAL = 600
+# Above that many points per sensor a chart is slow to draw and unreadable anyway.
+MAX_PLOT_POINTS = 2000
 
 
 @dataclasses.dataclass
@@ -27,19 +39,274 @@ class SensorTraces:
         self.traces[trace]['x'].append(x)
         self.traces[trace]['y'].append(y)
 
+    def add_points(self, trace: str, x: List, y: List):
+        self.traces[trace]['x'] += x
+        self.traces[trace]['y'] += y
+
+
+def max_plot_points() -> int:
+    """'max plot points' of the config, MAX_PLOT_POINTS if not set or outside the app."""
+    if has_app_context():
+        return config().max_plot_points or MAX_PLOT_POINTS
+    return MAX_PLOT_POINTS
+
+
+# First and last timestamps of the datapoints, see Datapoint.get_span.
+Span = Optional[Tuple[datetime, datetime]]
+
+
+def resolution_for_span(first_last: Span) -> str:
+    """
+    The finest resolution that keeps the chart under max_plot_points() per sensor, from
+    the span of the datapoints so without reading them.
+    """
+    if first_last is None:
+        return 'raw'
+
+    span = (first_last[1] - first_last[0]).total_seconds()
+    resolution = 'raw'
+    interval = RAW_INTERVAL
+    for name, period in sorted(Rollup.periods.items(), key=lambda p: p[1]):
+        if span / interval <= max_plot_points():
+            break
+        resolution = name
+        interval = period
+    return resolution
+
+
+def get_resolution(span: Span = None, default: str = None) -> str:
+    """
+    Resolution asked for in the 'resolution' query parameter, aborts with a 400 if it's
+    not one we know. When absent returns default or picks one from the span of the data.
+    """
+    resolution = request.args.get('resolution', default)
+    if resolution is None:
+        return resolution_for_span(span)
+    if resolution != 'raw' and resolution not in Rollup.periods:
+        abort(HTTPStatus.BAD_REQUEST)
+    return resolution
+
+
+# Query parameters selecting which datapoints to show, see Datapoint.get_all.
+window_args = ('since', 'until', 'limit', 'after_id')
+
+
+# SQLite integers are 64 bits, past that binding a parameter raises OverflowError.
+SQL_INT_MIN = -2 ** 63
+SQL_INT_MAX = 2 ** 63 - 1
+
+
+def parse_int(value: str) -> int:
+    """An integer which SQLite can store, raises ValueError otherwise."""
+    number = int(value)
+    if not SQL_INT_MIN <= number <= SQL_INT_MAX:
+        raise ValueError(f'{value} is out of range')
+    return number
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Seconds since Epoch or ISO 8601, naive ones are UTC like the stored timestamps."""
+    try:
+        seconds = int(value)
+    except ValueError:
+        seconds = None
+    try:
+        if seconds is not None:
+            return from_epoch(seconds)
+        when = datetime.fromisoformat(value)
+        if when.tzinfo is not None:
+            when = when.astimezone(timezone.utc).replace(tzinfo=None)
+        return when
+    except (OverflowError, OSError) as e:
+        # Further than what datetime or the platform can represent.
+        raise ValueError(f'{value} is out of range') from e
+
+
+def get_window() -> Dict:
+    """
+    The since, until, limit and after_id query parameters, as arguments for
+    Datapoint.get_all. Aborts with a 400 if one is invalid.
+    """
+    window = {}
+    try:
+        for name in ('since', 'until'):
+            if name in request.args:
+                window[name] = parse_timestamp(request.args[name])
+        for name in ('limit', 'after_id'):
+            if name in request.args:
+                window[name] = parse_int(request.args[name])
+    except ValueError:
+        abort(HTTPStatus.BAD_REQUEST)
+
+    if window.get('limit', 1) < 1:
+        abort(HTTPStatus.BAD_REQUEST)
+    return window
+
+
+def window_query() -> Dict[str, str]:
+    """The window query parameters of the request, to keep them in the links."""
+    return {name: request.args[name] for name in window_args if name in request.args}
+
+
+def build_datatable(data_points: DataPoints, delete_next: str = None) -> List:
+    # Straight from the columns, without making Datapoint objects.
+    series = DatapointSeries.of(data_points)
+    datatable = []
+    for i, when in enumerate(series.datetimes()):
+        dt = Datapoint.datatable_entry(when, series.angle[i], series.temperature[i], series.battery[i])
+        if delete_next:
+            dt['delete_link'] = url_for('accessor.remove_datapoint', datapoint_id=series.id[i], next=delete_next)
+        datatable.append(dt)
+    return datatable
+
+
+# Payloads of the datatable and plot endpoints: 'rows' has the values formatted by the
+# server, 'compact' has numeric columns which the pages format themselves.
+payload_formats = ('rows', 'compact')
+
+# Stands for the datapoint id in the delete_url of the compact datatables.
+DATAPOINT_ID_PLACEHOLDER = '__id__'
+
+
+def is_compact() -> bool:
+    """Whether the payload query parameter is compact, aborts with a 400 if unknown."""
+    payload = request.args.get('payload', 'rows')
+    if payload not in payload_formats:
+        abort(HTTPStatus.BAD_REQUEST)
+    return payload == 'compact'
 
-def build_view_data(
+
+def compact_datatable(data_points: DataPoints, delete_next: str = None) -> Dict:
+    """
+    build_datatable() as numeric columns, the timestamps in seconds since Epoch, and one
+    delete_url for all the rows, with DATAPOINT_ID_PLACEHOLDER for their id.
+    """
+    datatable = {
+        'columns': DatapointSeries.of(data_points).as_columns(('id', 'timestamp', 'angle', 'temperature', 'battery')),
+    }
+    if delete_next:
+        datatable['delete_url'] = url_for(
+            'accessor.remove_datapoint',
+            datapoint_id=DATAPOINT_ID_PLACEHOLDER,
+            next=delete_next,
+        )
+    return datatable
+
+
+# Rows in the first page of the datapoint tables, DataTables' default pageLength.
+DATATABLE_PAGE_LENGTH = 10
+# Longest page sent to the datapoint tables, also what "All" (length=-1) gets.
+MAX_DATATABLE_LENGTH = 1000
+
+
+def get_datatable_args() -> Dict:
+    """
+    The paging and ordering of a DataTables serverSide request, as arguments for
+    Datapoint.get_page. Only the timestamp column can be ordered. Aborts with a 400 if
+    one is invalid.
+    """
+    try:
+        draw = int(request.args.get('draw', 0))
+        offset = parse_int(request.args.get('start', 0))
+        length = parse_int(request.args.get('length', DATATABLE_PAGE_LENGTH))
+    except ValueError:
+        abort(HTTPStatus.BAD_REQUEST)
+
+    if offset < 0 or length < -1 or length == 0:
+        abort(HTTPStatus.BAD_REQUEST)
+    if length == -1 or length > MAX_DATATABLE_LENGTH:
+        length = MAX_DATATABLE_LENGTH
+
+    direction = request.args.get('order[0][dir]', 'desc')
+    if direction not in ('asc', 'desc'):
+        abort(HTTPStatus.BAD_REQUEST)
+
+    return {
+        'draw': draw,
+        'offset': offset,
+        'length': length,
+        'descending': direction == 'desc',
+    }
+
+
+def datatable_page(delete_next: str = None, compact: bool = False, **owner) -> Dict:
+    """
+    The DataTables serverSide response for the datapoints of owner (project_id or
+    sensor_id). The page comes from the paging arguments of the request, the first
+    one without them, and only covers the datapoints of the window, the ones of the
+    chart. When compact the rows are in the columns of compact_datatable() rather than
+    in data.
+    """
+    args = get_datatable_args()
+    draw = args.pop('draw')
+    total, page = access.get_datapoint_page(window=get_window(), **owner, **args)
+    response = {
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': total,
+    }
+    if compact:
+        response.update(compact_datatable(page, delete_next))
+    else:
+        response['data'] = build_datatable(page, delete_next)
+    return response
+
+
+def lttb(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets downsampling, the indexes of the threshold points
+    that keep the shape of the (x, y) curve. x has to be sorted. The first and last
+    points are always kept, then from each bucket the point making the largest triangle
+    with the previously kept one and the mean of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    bucket_size = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, n)
+
+        mean_x = math.fsum(x[end:next_end]) / (next_end - end)
+        mean_y = math.fsum(y[end:next_end]) / (next_end - end)
+        ax, ay = x[a], y[a]
+        # Twice the area of the triangle, only compared.
+        a = max(
+            range(start, end),
+            key=lambda i: abs((ax - mean_x) * (y[i] - ay) - (ax - x[i]) * (mean_y - ay)),
+        )
+        kept.append(a)
+
+    kept.append(n - 1)
+    return kept
+
+
+def _plot_value(value: float) -> Optional[float]:
+    # NaN isn't JSON. The charts don't need more digits, and the payload is smaller.
+    return None if math.isnan(value) else round(value, 2)
+
+
+def build_plot(
     elem_name: str,
-    data_points: List[Datapoint],
+    data_points: DataPoints,
     sensor_info: Dict[int, Sensor] = None,
-    delete_next: str = None,
-) -> Tuple[List, Dict]:
-    datatable = []
+    max_points: int = None,
+    compact: bool = False,
+) -> Dict:
+    """
+    The plotly data of the data points, one temperature and one angle trace per sensor.
+    Traces with more than max_points points (max_plot_points() by default) are
+    downsampled with lttb(). When compact x is in seconds since Epoch and y has the
+    values rather than their text.
+    """
     if sensor_info is None:
         sensor_info = {}
-
-    # Data by sensor.
-    sensor_data: Dict[str, SensorTraces] = {}
+    if max_points is None:
+        max_points = max_plot_points()
 
     # Plotly structure, ready to give to JS library.
     plot = {
@@ -62,29 +329,68 @@ def build_view_data(
         },
     }
 
-    for entry in data_points:
-        dt = entry.as_datatable()
-        if delete_next:
-            dt['delete_link'] = url_for('accessor.remove_datapoint', datapoint_id=entry.id, next=delete_next)
-        datatable.append(dt)
+    # Rows by sensor.
+    series = DatapointSeries.of(data_points)
+    sensor_rows: Dict[int, List[int]] = {}
+    for i, sensor_id in enumerate(series.sensor_id):
+        sensor_rows.setdefault(sensor_id, []).append(i)
+
+    for sensor_id in sorted(sensor_rows.keys()):
+        rows = sensor_rows[sensor_id]
+        sensor = sensor_info.get(sensor_id)
+        if sensor is None:
+            sensor_name = f'sensor {sensor_id}'
+        else:
+            sensor_name = sensor.name
+        st = SensorTraces(sensor_name)
+        st.add_trace('temperature', 'y')
+        st.add_trace('angle', 'y2')
+
+        timestamps = [series.timestamp[i] for i in rows]
+        for trace, column, format_value in (
+            ('temperature', series.temperature, Datapoint.format_temperature),
+            ('angle', series.angle, Datapoint.format_angle),
+        ):
+            values = [column[i] for i in rows]
+            kept = lttb(timestamps, values, max_points)
+            if compact:
+                st.add_points(trace, [timestamps[k] for k in kept], [_plot_value(values[k]) for k in kept])
+                continue
+            # Only the kept points are formatted.
+            for k in kept:
+                st.add_point(trace, Datapoint.format_timestamp(from_epoch(timestamps[k])), format_value(values[k]))
+
+        plot['data'] += list(st.traces.values())
 
-        st = sensor_data.get(entry.sensor_id)
-        if st is None:
-            sensor = sensor_info.get(entry.sensor_id)
-            if sensor is None:
-                sensor_name = f'sensor {entry.sensor_id}'
-            else:
-                sensor_name = sensor.name
-            st = SensorTraces(sensor_name)
-            st.add_trace('temperature', 'y')
-            st.add_trace('angle', 'y2')
-            sensor_data[entry.sensor_id] = st
-
-        when = entry.timestamp_as_str()
-        st.add_point('temperature', when, entry.temperature_as_str())
-        st.add_point('angle', when, entry.angle_as_str())
-
-    for s in sorted(sensor_data.keys()):
-        plot['data'] += list(sensor_data[s].traces.values())
-
-    return datatable, plot
+    if compact:
+        # The page multiplies x by 1000, plotly reads numbers on date axes as ms.
+        plot['layout']['xaxis']['type'] = 'date'
+        plot['layout']['yaxis']['hoverformat'] = '.1f'
+        plot['layout']['yaxis2']['hoverformat'] = '.1f'
+
+    return plot
+
+
+def rollup_plot(
+    elem_name: str,
+    span: Span,
+    sensor_info: Dict[int, Sensor],
+    get_datapoints: Callable[[], DataPoints],
+    get_rollups: Callable[..., List[Rollup]],
+) -> Dict:
+    """
+    build_plot() of the datapoints of span, or of their rollups when the resolution of
+    the request isn't raw. Only what is plotted is read: get_datapoints() reads the
+    datapoints, get_rollups(resolution, since, until) the rollups. The payload is
+    compact when the request asks for it, see is_compact().
+    """
+    compact = is_compact()
+    resolution = get_resolution(span)
+    if span is None:
+        data_points = []
+    elif resolution == 'raw':
+        data_points = get_datapoints()
+    else:
+        rollups = get_rollups(resolution, span[0], span[1] + timedelta(seconds=1))
+        data_points = [r.as_datapoint() for r in rollups]
+    return build_plot(elem_name, data_points, sensor_info, compact=compact)
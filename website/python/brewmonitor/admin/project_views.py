@@ -1,11 +1,10 @@
 from http import HTTPStatus
 
 from brewmonitor.admin._app import admin_bp
-from brewmonitor.configuration import config
 from brewmonitor.decorators import admin_required
 from brewmonitor.storage import access
 from brewmonitor.storage.tables import Project, User
-from flask import request, url_for
+from flask import g, request, url_for
 from flask_mako import render_template
 from werkzeug.exceptions import abort
 from werkzeug.utils import redirect
@@ -14,7 +13,7 @@ from werkzeug.utils import redirect
 @admin_bp.route('/projects')
 @admin_required
 def all_projects():
-    with config().db_connection() as db_conn:
+    with access.db_session() as db_conn:
         users = User.get_all(db_conn)
         projects = Project.get_all(db_conn)
     return render_template('admin_projects.html.mako', projects=projects, users=users)
@@ -24,7 +23,9 @@ def all_projects():
 @admin_bp.route('/project/<project_id>/delete', methods=['GET'])
 @admin_required
 def delete_project(project_id):
-    project = access.get_project_data(project_id)
+    # A GET which writes.
+    g.db_write = True
+    project = access.get_project(project_id)
     if project is None:
         abort(HTTPStatus.NOT_FOUND)
 
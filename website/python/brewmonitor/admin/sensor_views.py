@@ -1,11 +1,10 @@
 from http import HTTPStatus
 
 from brewmonitor.admin._app import admin_bp
-from brewmonitor.configuration import config
 from brewmonitor.decorators import admin_required
 from brewmonitor.storage import access
 from brewmonitor.storage.tables import Sensor, User
-from flask import request, url_for
+from flask import g, request, url_for
 from flask_mako import render_template
 from werkzeug.exceptions import abort
 from werkzeug.utils import redirect
@@ -14,7 +13,7 @@ from werkzeug.utils import redirect
 @admin_bp.route('/sensors')
 @admin_required
 def all_sensors():
-    with config().db_connection() as db_conn:
+    with access.db_session() as db_conn:
         users = User.get_all(db_conn)
         sensors = Sensor.get_all(db_conn)
     return render_template('admin_sensors.html.mako', sensors=sensors, users=users)
@@ -23,6 +22,8 @@ def all_sensors():
 @admin_bp.route('/sensor/<sensor_id>/delete')
 @admin_required
 def delete_sensor(sensor_id):
+    # A GET which writes.
+    g.db_write = True
     sensor = access.get_sensor(sensor_id)
     if sensor is None:
         abort(HTTPStatus.NOT_FOUND)
@@ -3,7 +3,7 @@ from http import HTTPStatus
 from brewmonitor.admin._app import admin_bp
 from brewmonitor.decorators import admin_required
 from brewmonitor.storage import access
-from flask import request, url_for
+from flask import g, request, url_for
 from flask_mako import render_template
 from werkzeug.exceptions import abort
 from werkzeug.utils import redirect
@@ -30,6 +30,8 @@ def add_user():
 @admin_bp.route('/user/<user_id>/delete', methods=['GET'])
 @admin_required
 def delete_user(user_id):
+    # A GET which writes.
+    g.db_write = True
     user = access.get_user(user_id)
     if user is None:
         abort(HTTPStatus.NOT_FOUND)
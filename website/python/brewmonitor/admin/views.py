@@ -5,9 +5,28 @@ import brewmonitor.admin.sensor_views  # noqa
 # noinspection PyUnresolvedReferences
 import brewmonitor.admin.user_views  # noqa
 from brewmonitor.admin._app import admin_bp
+from brewmonitor.configuration import config
+from brewmonitor.decorators import admin_required
+from brewmonitor.storage.cache import sensor_cache, user_cache
+from brewmonitor.storage.ingest import ingest_queue
+from brewmonitor.storage.passwords import password_hasher
+from brewmonitor.utils import json_response
 from flask import redirect, url_for
 
 
 @admin_bp.route('/', methods=['GET'])
 def index():
     return redirect(url_for('home.index'))
+
+
+@admin_bp.route('/metrics', methods=['GET'])
+@admin_required
+def metrics():
+    queue = ingest_queue()
+    return json_response({
+        'db_pool': config().db_pool.stats(),
+        'ingest_queue': queue.metrics() if queue is not None else None,
+        'sensor_cache': sensor_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'passwords': password_hasher.metrics(),
+    })
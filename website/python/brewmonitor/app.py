@@ -1,10 +1,14 @@
+import atexit
 import os
 
 from brewmonitor.accessor.views import accessor_bp
 from brewmonitor.admin.views import admin_bp
 from brewmonitor.configuration import Configuration
 from brewmonitor.schema import initialise_db
-from brewmonitor.storage.tables import User
+from brewmonitor.storage import access
+from brewmonitor.storage.cache import sensor_cache, user_cache
+from brewmonitor.storage.ingest import IngestQueue
+from brewmonitor.storage.passwords import password_hasher
 from brewmonitor.storage.views import storage_bp
 from brewmonitor.views import home_bp
 from flask import Flask
@@ -28,17 +32,50 @@ def make_app(secret_key):
 
     initialise_db(config)
 
+    sensor_cache.configure(
+        max_size=config.sensor_cache.get('max size', 1024),
+        ttl=config.sensor_cache.get('ttl', 300),
+    )
+    user_cache.configure(
+        max_size=config.user_cache.get('max size', 256),
+        ttl=config.user_cache.get('ttl', 60),
+    )
+    password_hasher.configure(
+        rounds=config.passwords.get('rounds', 12),
+        max_workers=config.passwords.get('max workers', 2),
+        max_pending=config.passwords.get('max pending', 16),
+    )
+
+    if config.ingest_queue is not None:
+        ingest_queue = IngestQueue(
+            config,
+            max_batch_size=config.ingest_queue.get('max batch size', 500),
+            max_latency=config.ingest_queue.get('max latency', 0.5),
+            max_depth=config.ingest_queue.get('max depth', 10000),
+            put_timeout=config.ingest_queue.get('put timeout', 1.0),
+            max_retries=config.ingest_queue.get('max retries', 3),
+            retry_delay=config.ingest_queue.get('retry delay', 1.0),
+            logger=brewmonitor.logger,
+        )
+        ingest_queue.start()
+        # Commit what is pending when the server stops.
+        atexit.register(ingest_queue.stop)
+        brewmonitor.config['brewmonitor ingest queue'] = ingest_queue
+
     brewmonitor.register_blueprint(home_bp)
     brewmonitor.register_blueprint(accessor_bp)
     brewmonitor.register_blueprint(storage_bp)
     brewmonitor.register_blueprint(admin_bp)
 
+    # Ends the transaction shared by the access calls of the request.
+    brewmonitor.teardown_request(access.end_session)
+
     login_manager = LoginManager()
     login_manager.login_view = 'home.index'
     login_manager.init_app(brewmonitor)
 
     @login_manager.user_loader
     def load_user(id: str):
-        return User.find(config.db_connection(), int(id))
+        return access.get_login_user(id)
 
     return brewmonitor
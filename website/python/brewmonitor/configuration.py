@@ -1,5 +1,8 @@
+import os
+import re
 import sqlite3
-from typing import Dict
+import threading
+from typing import Dict, Optional, Union
 
 import yaml
 from flask import current_app
@@ -7,11 +10,89 @@ from flask import current_app
 
 SQLConnection = sqlite3.Connection
 
+PragmaValue = Union[str, int]
+
+# Applied to every new connection, can be overridden with 'sqlite pragmas' in the config.
+default_pragmas = {
+    # Wait for the lock rather than failing straight away when another worker writes.
+    'busy_timeout': 5000,
+    # Readers don't block the writer and the other way round.
+    'journal_mode': 'wal',
+    # Safe with WAL, only the last transactions can be lost on power failure.
+    'synchronous': 'normal',
+    # In KiB when negative.
+    'cache_size': -16000,
+    'mmap_size': 64 * 1024 * 1024,
+    # The cascades are done by the tables, see Sensor.delete and Project.delete.
+    'foreign_keys': 'off',
+}
+
+_pragma_name = re.compile(r'^[a-z_]+$')
+_pragma_value = re.compile(r'^-?\w+$')
+
+
+class ConnectionPool:
+    """
+    Keeps one connection per thread (and process, for forking servers) so the many
+    db_connection() calls of a request reuse the same one.
+    The connections are never closed by the callers, they are closed when their
+    thread ends or with close().
+    """
+
+    def __init__(self, sqlite_file: str, pragmas: Dict[str, PragmaValue]):
+        pragmas = dict(pragmas)
+        for name, value in pragmas.items():
+            if isinstance(value, bool):
+                # YAML reads on/off as booleans.
+                value = pragmas[name] = 'on' if value else 'off'
+            if not _pragma_name.match(name) or not _pragma_value.match(str(value)):
+                raise ValueError(f'Invalid pragma {name}={value}')
+
+        self.sqlite_file = sqlite_file
+        self.pragmas = pragmas
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    def connection(self) -> SQLConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            self.hits += 1
+            return conn
+
+        self.misses += 1
+        conn = self.connect()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def connect(self) -> SQLConnection:
+        """A new connection outside of the pool, the caller has to close it."""
+        conn = sqlite3.connect(self.sqlite_file)
+        for name, value in self.pragmas.items():
+            conn.execute(f'pragma {name}={value};')
+        return conn
+
+    def close(self):
+        """Close the connection of the current thread, the next call opens a new one."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            if self._local.pid == os.getpid():
+                conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
 
 class Configuration:
 
     def __init__(self, raw_config: Dict):
         self._raw_config = raw_config
+        self._pool = None
 
     @classmethod
     def load(cls, filename: str) -> 'Configuration':
@@ -21,8 +102,45 @@ class Configuration:
     def sqlite_file(self) -> str:
         return self._raw_config.get('sqlite file', '/var/run/brewmonitor/database.db')
 
+    @property
+    def sqlite_pragmas(self) -> Dict[str, PragmaValue]:
+        pragmas = dict(default_pragmas)
+        pragmas.update(self._raw_config.get('sqlite pragmas') or {})
+        return pragmas
+
+    @property
+    def db_pool(self) -> ConnectionPool:
+        if self._pool is None:
+            self._pool = ConnectionPool(self.sqlite_file, self.sqlite_pragmas)
+        return self._pool
+
     def db_connection(self) -> SQLConnection:
-        return sqlite3.connect(self.sqlite_file)
+        return self.db_pool.connection()
+
+    @property
+    def ingest_queue(self) -> Optional[Dict]:
+        """Settings of the add_data write-behind queue, None to insert straight away."""
+        return self._raw_config.get('ingest queue')
+
+    @property
+    def sensor_cache(self) -> Dict:
+        """Limits of the cache of sensor credentials used by add_data."""
+        return self._raw_config.get('sensor cache') or {}
+
+    @property
+    def user_cache(self) -> Dict:
+        """Limits of the cache of the logged in users."""
+        return self._raw_config.get('user cache') or {}
+
+    @property
+    def passwords(self) -> Dict:
+        """bcrypt cost of the password hashes and limits of the logins hashing at once."""
+        return self._raw_config.get('passwords') or {}
+
+    @property
+    def max_plot_points(self) -> Optional[int]:
+        """Above that many points per trace the charts are downsampled."""
+        return self._raw_config.get('max plot points')
 
     @property
     def flask_configuration(self) -> Dict:
@@ -1,9 +1,11 @@
-from typing import Type
+from typing import Tuple
 
-from brewmonitor.configuration import Configuration
-from brewmonitor.storage.tables import BaseTable, Datapoint, Project, Sensor, User
+from brewmonitor.configuration import Configuration, SQLConnection
+from brewmonitor.storage.migrations import Migration, apply_migrations, current_version, latest_version
+from brewmonitor.storage.tables import Datapoint, Project, Sensor, User
 
 
+# The tables of the classes, created by the migrations.
 tables = (
     User,
     Sensor,
@@ -12,14 +14,413 @@ tables = (
 )
 
 
+def _initial_schema(conn: SQLConnection):
+    # Existing databases pre-date the migrations, hence the "if not exists".
+    # The tables as they were released, not Table.create_table_req(): a column or an index
+    # added to a table class later needs a migration of its own to reach existing dbs.
+    conn.execute(
+        """
+        create table if not exists User (
+            id integer primary key autoincrement,
+            username text not null,
+            is_admin bool,
+            password text not null
+        );
+        """,
+    )
+    conn.execute(
+        """
+        create table if not exists Sensor (
+            id integer primary key autoincrement,
+            name text not null,
+            secret text not null,
+            owner integer not null,
+            max_battery real,
+            min_battery real,
+            battery float,
+            foreign key(owner) references User(id)
+        );
+        """,
+    )
+    conn.execute(
+        """
+        create table if not exists Project (
+            id integer primary key autoincrement,
+            name text not null,
+            owner integer not null,
+            active_sensor integer,
+            foreign key(owner) references User(id),
+            foreign key(active_sensor) references Sensor(id)
+        );
+        """,
+    )
+    conn.execute('create index if not exists Project_active_sensor_idx on Project (active_sensor);')
+    conn.execute(
+        """
+        create table if not exists Datapoint (
+            sensor_id integer not null,
+            project_id integer,
+            timestamp integer not null,
+            angle real,
+            temperature real,
+            battery real,
+            id integer primary key autoincrement,
+            foreign key(sensor_id) references Sensor(id),
+            foreign key(project_id) references Project(id)
+        );
+        """,
+    )
+    conn.execute('create index if not exists Datapoint_project_id_timestamp_idx on Datapoint (project_id, timestamp);')
+    conn.execute('create index if not exists Datapoint_sensor_id_timestamp_idx on Datapoint (sensor_id, timestamp);')
+
+
+def _summary_tables(conn: SQLConnection):
+    # Latest state of each sensor and project, read instead of sub-queries over Datapoint.
+    # Maintained by triggers so every way of writing Datapoint keeps them up to date.
+    # max_datapoint_id is not lowered on deletion: with datapoint_count it changes on
+    # every insertion or deletion.
+    conn.execute(
+        """
+        create table SensorSummary (
+            sensor_id integer primary key,
+            datapoint_count integer not null default 0,
+            max_datapoint_id integer,
+            last_active integer,
+            last_battery real
+        );
+        """,
+    )
+    conn.execute(
+        """
+        create table ProjectSummary (
+            project_id integer primary key,
+            datapoint_count integer not null default 0,
+            max_datapoint_id integer,
+            first_active integer,
+            first_angle real,
+            last_active integer,
+            last_angle real,
+            last_temperature real
+        );
+        """,
+    )
+
+    # On insert only compare with the current values.
+    # Ties on timestamp keep the first inserted as first and the last inserted as last,
+    # like the (project_id, timestamp) and (sensor_id, timestamp) indexes do.
+    conn.execute(
+        """
+        create trigger Datapoint_summary_insert after insert on Datapoint
+        begin
+            insert or ignore into SensorSummary (sensor_id) values (NEW.sensor_id);
+            update SensorSummary set
+                datapoint_count = datapoint_count + 1,
+                max_datapoint_id = max(coalesce(max_datapoint_id, NEW.id), NEW.id),
+                last_battery = case when last_active is null or NEW.timestamp >= last_active
+                    then NEW.battery else last_battery end,
+                last_active = case when last_active is null or NEW.timestamp >= last_active
+                    then NEW.timestamp else last_active end
+            where sensor_id = NEW.sensor_id;
+
+            insert or ignore into ProjectSummary (project_id)
+            select NEW.project_id where NEW.project_id is not null;
+            update ProjectSummary set
+                datapoint_count = datapoint_count + 1,
+                max_datapoint_id = max(coalesce(max_datapoint_id, NEW.id), NEW.id),
+                first_angle = case when first_active is null or NEW.timestamp < first_active
+                    then NEW.angle else first_angle end,
+                first_active = case when first_active is null or NEW.timestamp < first_active
+                    then NEW.timestamp else first_active end,
+                last_angle = case when last_active is null or NEW.timestamp >= last_active
+                    then NEW.angle else last_angle end,
+                last_temperature = case when last_active is null or NEW.timestamp >= last_active
+                    then NEW.temperature else last_temperature end,
+                last_active = case when last_active is null or NEW.timestamp >= last_active
+                    then NEW.timestamp else last_active end
+            where project_id = NEW.project_id;
+        end;
+        """,
+    )
+    # On delete only search the indexes again if the deleted entry was the first or last.
+    conn.execute(
+        """
+        create trigger Datapoint_summary_delete after delete on Datapoint
+        begin
+            update SensorSummary set
+                datapoint_count = datapoint_count - 1,
+                last_battery = case when OLD.timestamp >= last_active then (
+                    select battery from Datapoint where sensor_id = OLD.sensor_id order by timestamp desc limit 1
+                ) else last_battery end,
+                last_active = case when OLD.timestamp >= last_active then (
+                    select timestamp from Datapoint where sensor_id = OLD.sensor_id order by timestamp desc limit 1
+                ) else last_active end
+            where sensor_id = OLD.sensor_id;
+
+            update ProjectSummary set
+                datapoint_count = datapoint_count - 1,
+                first_angle = case when OLD.timestamp <= first_active then (
+                    select angle from Datapoint where project_id = OLD.project_id order by timestamp asc limit 1
+                ) else first_angle end,
+                first_active = case when OLD.timestamp <= first_active then (
+                    select timestamp from Datapoint where project_id = OLD.project_id order by timestamp asc limit 1
+                ) else first_active end,
+                last_angle = case when OLD.timestamp >= last_active then (
+                    select angle from Datapoint where project_id = OLD.project_id order by timestamp desc limit 1
+                ) else last_angle end,
+                last_temperature = case when OLD.timestamp >= last_active then (
+                    select temperature from Datapoint where project_id = OLD.project_id order by timestamp desc limit 1
+                ) else last_temperature end,
+                last_active = case when OLD.timestamp >= last_active then (
+                    select timestamp from Datapoint where project_id = OLD.project_id order by timestamp desc limit 1
+                ) else last_active end
+            where project_id = OLD.project_id;
+        end;
+        """,
+    )
+    conn.execute(
+        """
+        create trigger Sensor_summary_delete after delete on Sensor
+        begin
+            delete from SensorSummary where sensor_id = OLD.id;
+        end;
+        """,
+    )
+    conn.execute(
+        """
+        create trigger Project_summary_delete after delete on Project
+        begin
+            delete from ProjectSummary where project_id = OLD.id;
+        end;
+        """,
+    )
+    rebuild_summary_tables(conn)
+
+
+def rebuild_summary_tables(conn: SQLConnection):
+    """Re-compute the summary tables from Datapoint."""
+    conn.execute('delete from SensorSummary;')
+    conn.execute(
+        """
+        insert into SensorSummary (sensor_id, datapoint_count, max_datapoint_id, last_active, last_battery)
+        select
+            s.sensor_id,
+            count(*),
+            max(s.id),
+            (select timestamp from Datapoint where sensor_id = s.sensor_id order by timestamp desc limit 1),
+            (select battery from Datapoint where sensor_id = s.sensor_id order by timestamp desc limit 1)
+        from Datapoint s
+        group by s.sensor_id;
+        """,
+    )
+    conn.execute('delete from ProjectSummary;')
+    conn.execute(
+        """
+        insert into ProjectSummary (
+            project_id, datapoint_count, max_datapoint_id,
+            first_active, first_angle, last_active, last_angle, last_temperature
+        )
+        select
+            p.project_id,
+            count(*),
+            max(p.id),
+            (select timestamp from Datapoint where project_id = p.project_id order by timestamp asc limit 1),
+            (select angle from Datapoint where project_id = p.project_id order by timestamp asc limit 1),
+            (select timestamp from Datapoint where project_id = p.project_id order by timestamp desc limit 1),
+            (select angle from Datapoint where project_id = p.project_id order by timestamp desc limit 1),
+            (select temperature from Datapoint where project_id = p.project_id order by timestamp desc limit 1)
+        from Datapoint p
+        where p.project_id is not null
+        group by p.project_id;
+        """,
+    )
+
+
+def _epoch_timestamps(conn: SQLConnection):
+    # Timestamps used to be written with datetime(?) and stored as text.
+    # strftime('%s') reads them as UTC which is what tables.from_epoch() expects.
+    for table, column in (
+        ('Datapoint', 'timestamp'),
+        ('SensorSummary', 'last_active'),
+        ('ProjectSummary', 'first_active'),
+        ('ProjectSummary', 'last_active'),
+    ):
+        conn.execute(
+            f"""
+            update {table} set {column} = cast(strftime('%s', {column}) as integer)
+            where typeof({column}) = 'text';
+            """,
+        )
+
+
+# Hourly and daily rollups, in seconds.
+_rollup_periods = (3600, 86400)
+_rollup_values = ('angle', 'temperature', 'battery')
+# The Datapoint columns each rollup table is grouped by.
+_rollup_keys = {
+    'SensorRollup': ('sensor_id',),
+    'ProjectRollup': ('project_id', 'sensor_id'),
+}
+
+
+def _rollup_tables(conn: SQLConnection):
+    # Min, max, sum (for the mean) and last value of each bucket of each period.
+    # Maintained by triggers like the summary tables.
+    value_columns = ', '.join(
+        f'{v}_min real, {v}_max real, {v}_sum real, {v}_last real'
+        for v in _rollup_values
+    )
+    conn.execute(
+        f"""
+        create table SensorRollup (
+            period integer not null,
+            sensor_id integer not null,
+            bucket integer not null,
+            datapoint_count integer not null default 0,
+            last_timestamp integer,
+            {value_columns},
+            primary key (period, sensor_id, bucket)
+        ) without rowid;
+        """,
+    )
+    conn.execute(
+        f"""
+        create table ProjectRollup (
+            period integer not null,
+            project_id integer not null,
+            sensor_id integer not null,
+            bucket integer not null,
+            datapoint_count integer not null default 0,
+            last_timestamp integer,
+            {value_columns},
+            primary key (period, project_id, bucket, sensor_id)
+        ) without rowid;
+        """,
+    )
+
+    for table, keys in _rollup_keys.items():
+        insert_statements = []
+        delete_statements = []
+        for period in _rollup_periods:
+            insert_statements.append(_rollup_insert_req(table, keys, period))
+            delete_statements.append(_rollup_delete_req(table, keys, period))
+
+        conn.execute(
+            f"""
+            create trigger Datapoint_{table}_insert after insert on Datapoint
+            begin
+                {"".join(insert_statements)}
+            end;
+            """,
+        )
+        # Deleting is rare, recompute the whole bucket from the Datapoint indexes.
+        # Datapoint.delete_all drops the buckets first, this only runs for single deletes.
+        conn.execute(
+            f"""
+            create trigger Datapoint_{table}_delete after delete on Datapoint
+            begin
+                {"".join(delete_statements)}
+            end;
+            """,
+        )
+
+    rebuild_rollup_tables(conn)
+
+
+def _rollup_insert_req(table: str, keys: Tuple[str, ...], period: int) -> str:
+    bucket = f'NEW.timestamp - NEW.timestamp % {period}'
+    is_last = 'last_timestamp is null or NEW.timestamp >= last_timestamp'
+    updates = ['datapoint_count = datapoint_count + 1']
+    for v in _rollup_values:
+        updates += [
+            f'{v}_min = min(coalesce({v}_min, NEW.{v}), NEW.{v})',
+            f'{v}_max = max(coalesce({v}_max, NEW.{v}), NEW.{v})',
+            f'{v}_sum = coalesce({v}_sum, 0) + NEW.{v}',
+            f'{v}_last = case when {is_last} then NEW.{v} else {v}_last end',
+        ]
+    updates.append(f'last_timestamp = case when {is_last} then NEW.timestamp else last_timestamp end')
+
+    return f"""
+        insert or ignore into {table} (period, {", ".join(keys)}, bucket)
+        select {period}, {", ".join(f"NEW.{k}" for k in keys)}, {bucket}
+        where {" and ".join(f"NEW.{k} is not null" for k in keys)};
+        update {table} set {", ".join(updates)}
+        where period = {period} and {" and ".join(f"{k} = NEW.{k}" for k in keys)} and bucket = {bucket};
+    """
+
+
+def _rollup_delete_req(table: str, keys: Tuple[str, ...], period: int) -> str:
+    in_bucket = (
+        f'{" and ".join(f"{k} = OLD.{k}" for k in keys)}'
+        f' and timestamp >= {table}.bucket and timestamp < {table}.bucket + {period}'
+    )
+    aggregates = ', '.join(f'min({v}), max({v}), sum({v})' for v in _rollup_values)
+    aggregate_columns = ', '.join(f'{v}_min, {v}_max, {v}_sum' for v in _rollup_values)
+    where = (
+        f'period = {period} and {" and ".join(f"{k} = OLD.{k}" for k in keys)}'
+        f' and bucket = OLD.timestamp - OLD.timestamp % {period}'
+    )
+
+    return f"""
+        update {table} set
+            (datapoint_count, {aggregate_columns}) = (
+                select count(*), {aggregates} from Datapoint where {in_bucket}
+            ),
+            (last_timestamp, {", ".join(f"{v}_last" for v in _rollup_values)}) = (
+                select timestamp, {", ".join(_rollup_values)} from Datapoint where {in_bucket}
+                order by timestamp desc limit 1
+            )
+        where {where};
+        delete from {table} where {where} and datapoint_count = 0;
+    """
+
+
+def rebuild_rollup_tables(conn: SQLConnection):
+    """Re-compute the rollup tables from Datapoint."""
+    aggregates = ', '.join(f'min({v}), max({v}), sum({v})' for v in _rollup_values)
+    aggregate_columns = ', '.join(f'{v}_min, {v}_max, {v}_sum' for v in _rollup_values)
+
+    for table, keys in _rollup_keys.items():
+        conn.execute(f'delete from {table};')
+        for period in _rollup_periods:
+            conn.execute(
+                f"""
+                insert into {table} (period, {", ".join(keys)}, bucket, datapoint_count, {aggregate_columns})
+                select {period}, {", ".join(keys)}, timestamp - timestamp % {period} as b, count(*), {aggregates}
+                from Datapoint
+                where {" and ".join(f"{k} is not null" for k in keys)}
+                group by {", ".join(keys)}, b;
+                """,
+            )
+        conn.execute(
+            f"""
+            update {table} set
+                (last_timestamp, {", ".join(f"{v}_last" for v in _rollup_values)}) = (
+                    select timestamp, {", ".join(_rollup_values)} from Datapoint
+                    where {" and ".join(f"{k} = {table}.{k}" for k in keys)}
+                        and timestamp >= {table}.bucket and timestamp < {table}.bucket + {table}.period
+                    order by timestamp desc limit 1
+                );
+            """,
+        )
+
+
+# Append only, never edit a migration that was released.
+migrations = (
+    Migration(1, 'Initial schema', _initial_schema),
+    Migration(2, 'Sensor and Project summary tables', _summary_tables),
+    Migration(3, 'Store timestamps as seconds since Epoch', _epoch_timestamps),
+    Migration(4, 'Hourly and daily rollup tables', _rollup_tables),
+)
+
+
 def initialise_db(config: Configuration):
 
     if config.sqlite_file:
         open(config.sqlite_file, 'a+').close()  # Ensure the file exists
 
     with config.db_connection() as conn:
-        for Table in tables:  # type: Type[BaseTable]
-            r = Table.create_table_req()
-            conn.execute(r)
+        # Fast path: nothing to do when the db is up to date.
+        if current_version(conn) >= latest_version(migrations):
+            return
 
-        conn.commit()
+        apply_migrations(conn, migrations)
@@ -0,0 +1,111 @@
+import math
+from datetime import date, datetime
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Dict, List, Sequence, Set, Type
+
+import attr
+from brewmonitor import json
+
+
+# JSON of the exports, the same text as brewmonitor.json.dumps(). The json C encoder is
+# fast but calls back into Python for each datetime, so the values are encoded a column
+# at a time instead: the lists of dicts with the same keys, or of attr.s objects, are
+# split in one list per key, and each list of values of one type goes through one map().
+# The lists without dates still go to the C encoder.
+
+
+def _encode_float(value: float) -> str:
+    if math.isfinite(value):
+        return float.__repr__(value)
+    if value != value:
+        return 'NaN'
+    return 'Infinity' if value > 0 else '-Infinity'
+
+
+def _encode_isoformat(value: date) -> str:
+    # AdditionalEncoder.
+    return '"' + value.isoformat() + '"'
+
+
+# By exact type, the sub classes go through json.dumps().
+_scalar_encoders: Dict[type, Callable[[Any], str]] = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _encode_float,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null',
+    datetime: _encode_isoformat,
+    date: _encode_isoformat,
+}
+
+
+# What the C encoder does on its own, without AdditionalEncoder.default().
+_native_types = {str, int, float, bool, type(None)}
+_encode_native = json.AdditionalEncoder().encode
+
+
+def _dumps(obj: Any) -> str:
+    # brewmonitor.json.dumps(obj), with the lists encoded by column.
+    obj_type = type(obj)
+    if obj_type is list or obj_type is tuple:
+        types = set(map(type, obj))
+        if types <= _native_types:
+            return _encode_native(obj)
+        return '[' + ', '.join(encode_column(obj, types)) + ']'
+    if obj_type is dict and all(type(key) is str for key in obj):
+        items = [encode_basestring_ascii(key) + ': ' + _dumps(value) for key, value in obj.items()]
+        return '{' + ', '.join(items) + '}'
+    encoder = _scalar_encoders.get(obj_type)
+    if encoder is not None:
+        return encoder(obj)
+    return json.dumps(obj)
+
+
+def encode_column(values: Sequence, types: Set[type] = None) -> List[str]:
+    """The JSON of each value, types is set(map(type, values)) when already known."""
+    if types is None:
+        types = set(map(type, values))
+    if len(types) == 1:
+        value_type = types.pop()
+        if value_type is float and all(map(math.isfinite, values)):
+            return list(map(float.__repr__, values))
+        if value_type is datetime:
+            # The timestamps, the slowest values of the default encoder.
+            return ['"%s"' % text for text in map(datetime.isoformat, values)]
+        if value_type is dict:
+            return _encode_dicts(values)
+        if value_type in _scalar_encoders:
+            return list(map(_scalar_encoders[value_type], values))
+    elif types <= _scalar_encoders.keys():
+        # E.g. floats with some None.
+        return [_scalar_encoders[type(value)](value) for value in values]
+    return list(map(_dumps, values))
+
+
+def _row_template(keys: Sequence[str]) -> str:
+    return '{' + ', '.join(encode_basestring_ascii(key).replace('%', '%%') + ': %s' for key in keys) + '}'
+
+
+def _encode_dicts(dicts: Sequence[Dict]) -> List[str]:
+    keys = tuple(dicts[0])
+    if len(set(map(tuple, dicts))) != 1 or not all(type(key) is str for key in keys):
+        return list(map(_dumps, dicts))
+    if not keys:
+        return ['{}'] * len(dicts)
+    columns = [encode_column(list(map(itemgetter(key), dicts))) for key in keys]
+    template = _row_template(keys)
+    return [template % row for row in zip(*columns)]
+
+
+def encode_objects(objs: Sequence, cls: Type) -> List[str]:
+    """
+    brewmonitor.json.dumps(attr.asdict(obj)) of each object of the attr.s class cls. Its
+    fields have to hold JSON values or dates, like the tables.
+    """
+    names = [field.name for field in attr.fields(cls)]
+    if not names:
+        return ['{}'] * len(objs)
+    columns = [encode_column(list(map(attrgetter(name), objs))) for name in names]
+    template = _row_template(names)
+    return [template % row for row in zip(*columns)]
@@ -1,37 +1,117 @@
-from typing import AnyStr, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AnyStr, Dict, Hashable, Iterator, List, Optional, Tuple
 
 import attr
-from brewmonitor.configuration import SQLConnection, config
-from brewmonitor.storage.tables import Datapoint, Project, Sensor, User
-from flask import current_app
+from brewmonitor.configuration import ConnectionPool, SQLConnection, config
+from brewmonitor.storage.cache import DataVersion, SensorCredentials, TTLCache, sensor_cache, user_cache
+from brewmonitor.storage.passwords import password_hasher
+from brewmonitor.storage.tables import Datapoint, DatapointSeries, Project, Rollup, Sensor, SensorAssignment, User
+from flask import current_app, g, has_request_context, request
+
+
+# Requests that should not write, they only need a snapshot of the db.
+read_only_methods = ('GET', 'HEAD', 'OPTIONS')
+
+
+@contextmanager
+def db_session() -> Iterator[SQLConnection]:
+    """
+    Connection for the access functions.
+    During a request all the calls share one transaction that end_session() commits, or
+    rolls back on error, once the request is done. Read only requests get a deferred
+    transaction so the whole page reads the same snapshot, the others take the write
+    lock straight away, unless the view set g.db_read_only. The GET views that write
+    set g.db_write: a deferred transaction that read first can't take the write lock
+    once another one committed. Outside of a request each call commits on its own.
+    """
+    if not has_request_context():
+        with config().db_connection() as db_conn:
+            yield db_conn
+        return
+
+    db_conn = g.get('db_session')
+    if db_conn is None:
+        db_conn = config().db_connection()
+        if db_conn.in_transaction:
+            # Left open by whoever used the connection before us, which didn't mean to
+            # commit it or it would have.
+            db_conn.rollback()
+        read_only = request.method in read_only_methods or g.get('db_read_only', False)
+        if g.get('db_write', False):
+            read_only = False
+        db_conn.execute('begin deferred;' if read_only else 'begin immediate;')
+        g.db_session = db_conn
+    yield db_conn
+
+
+def end_session(exception: Optional[BaseException] = None):
+    """Request teardown, ends the transaction of db_session()."""
+    db_conn = g.pop('db_session', None)
+    stale = g.pop('stale_cache_keys', [])
+    try:
+        if db_conn is None or not db_conn.in_transaction:
+            return
+
+        if exception is None:
+            db_conn.commit()
+        else:
+            db_conn.rollback()
+    finally:
+        for cache, key in stale:
+            cache.invalidate(key)
+
+
+def invalidate_after_commit(cache: TTLCache, *keys: Optional[Hashable]):
+    """
+    Remove the keys from the cache once the changes are committed, before that another
+    request could read the old values and cache them again. During a request that's
+    done by end_session(), the None keys are ignored.
+    """
+    keys = [key for key in keys if key is not None]
+    if has_request_context() and g.get('db_session') is not None:
+        g.setdefault('stale_cache_keys', []).extend((cache, key) for key in keys)
+        return
+    for key in keys:
+        cache.invalidate(key)
+
+
+def _since_until(window: Dict) -> Dict:
+    return {name: window[name] for name in ('since', 'until') if name in window}
 
 
 @attr.s
 class ProjectData(Project):
     sensors = attr.ib(type=dict, default=attr.Factory(dict))  # type: Dict[int, Sensor]
-    data_points = attr.ib(type=list, default=attr.Factory(list))  # type: List[Datapoint]
+    data_points = attr.ib(type=DatapointSeries, factory=DatapointSeries)
 
     @classmethod
-    def get_data(cls, db_conn: SQLConnection, project_id: int) -> Optional['ProjectData']:
+    def get_data(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int,
+        with_datapoints: bool = True,
+        **window,
+    ) -> Optional['ProjectData']:
+        """
+        window: since, until, limit and after_id, see Datapoint.get_all.
+        Without the datapoints only the sensors between since and until are loaded.
+        """
         project_data = cls.find(db_conn, project_id=project_id)
         if not project_data:
             return
 
-        sensor_ids = set()
-        for row in Datapoint.get_all(db_conn, project_id):
-            project_data.data_points.append(row)
-            sensor_ids.add(row.sensor_id)
+        if with_datapoints:
+            project_data.data_points = Datapoint.get_series(db_conn, project_id, **window)
+            sensor_ids = project_data.data_points.sensor_ids()
+        else:
+            sensor_ids = Datapoint.distinct_ids(db_conn, 'sensor_id', project_id, **_since_until(window))
 
-        # TODO(tr) do a sensor_id in []
         # TODO(tr) ensure the active sensor is first?
         current_app.logger.debug(f'All sensors are: {str(sensor_ids)}')
-        for s_id in sensor_ids:
-            sensor = Sensor.find(db_conn, s_id)
-            if sensor is not None:
-                project_data.sensors[s_id] = sensor
-                current_app.logger.debug(f'Found sensor_id={s_id}({type(s_id)}) is {str(sensor)}')
-            else:
-                current_app.logger.debug(f'Unknown sensor_id={s_id}')
+        project_data.sensors = Sensor.find_many(db_conn, sensor_ids)
+        for s_id in sensor_ids - project_data.sensors.keys():
+            current_app.logger.debug(f'Unknown sensor_id={s_id}')
 
         return project_data
 
@@ -39,47 +119,73 @@ class ProjectData(Project):
 @attr.s
 class SensorData(Sensor):
     projects = attr.ib(type=dict, factory=dict)  # type: Dict[int, Project]
-    data_points = attr.ib(type=list, factory=list)  # type: List[Datapoint]
+    data_points = attr.ib(type=DatapointSeries, factory=DatapointSeries)
 
     @classmethod
-    def get_data(cls, db_conn: SQLConnection, sensor_id: int) -> Optional['SensorData']:
+    def get_data(
+        cls,
+        db_conn: SQLConnection,
+        sensor_id: int,
+        with_datapoints: bool = True,
+        **window,
+    ) -> Optional['SensorData']:
+        """
+        window: since, until, limit and after_id, see Datapoint.get_all.
+        Without the datapoints only the projects between since and until are loaded.
+        """
         sensor_data = cls.find(db_conn, sensor_id)
         if not sensor_data:
             return
 
-        project_ids = set()
-        for row in Datapoint.get_all(db_conn, sensor_id=sensor_id):
-            sensor_data.data_points.append(row)
-            if row.project_id is not None:
-                project_ids.add(row.project_id)
+        if with_datapoints:
+            sensor_data.data_points = Datapoint.get_series(db_conn, sensor_id=sensor_id, **window)
+            project_ids = sensor_data.data_points.project_ids()
+        else:
+            project_ids = Datapoint.distinct_ids(db_conn, 'project_id', sensor_id=sensor_id, **_since_until(window))
 
-        # TODO(tr) Do a proper select id in []
-        for p_id in project_ids:
-            project = Project.find(db_conn, project_id=p_id)
-            if project is not None:
-                sensor_data.projects[p_id] = project
+        sensor_data.projects = Project.find_many(db_conn, project_ids)
 
         return sensor_data
 
 
 def get_projects() -> List[Project]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Project.get_all(db_conn)
 
 
+def get_project_names() -> List[Tuple[int, str]]:
+    with db_session() as db_conn:
+        return Project.get_names(db_conn)
+
+
+def get_project(project_id: int) -> Optional[Project]:
+    with db_session() as db_conn:
+        return Project.find(db_conn, project_id=project_id)
+
+
+def get_project_data_version(project_id: int) -> Optional[DataVersion]:
+    with db_session() as db_conn:
+        return Project.get_data_version(db_conn, project_id)
+
+
 def get_sensors() -> List[Sensor]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Sensor.get_all(db_conn)
 
 
 def get_sensor(sensor_id: int) -> Optional[Sensor]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Sensor.find(db_conn, sensor_id)
 
 
+def get_sensor_data_version(sensor_id: int) -> Optional[DataVersion]:
+    with db_session() as db_conn:
+        return Sensor.get_data_version(db_conn, sensor_id)
+
+
 def edit_sensor(sensor: Sensor, name: str, secret: str, owner: User, max_battery: int, min_battery: int):
-    with config().db_connection() as db_conn:
-        return sensor.edit(
+    with db_session() as db_conn:
+        sensor.edit(
             db_conn,
             name=name,
             secret=secret,
@@ -87,83 +193,233 @@ def edit_sensor(sensor: Sensor, name: str, secret: str, owner: User, max_battery
             max_battery=float(max_battery),
             min_battery=float(min_battery),
         )
+    invalidate_after_commit(sensor_cache, sensor.id)
 
 
 def remove_sensor(sensor: Sensor):
-    with config().db_connection() as db_conn:
-        return sensor.delete(db_conn)
+    with db_session() as db_conn:
+        sensor.delete(db_conn)
+    invalidate_after_commit(sensor_cache, sensor.id)
 
 
 def get_active_project_for_sensor(sensor_id: int) -> Tuple[Optional[Sensor], Optional[Project]]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Sensor.find(db_conn, sensor_id), ProjectData.by_active_sensor(db_conn, sensor_id)
 
 
+def get_sensor_assignments() -> List[SensorAssignment]:
+    with db_session() as db_conn:
+        return Sensor.get_assignments(db_conn)
+
+
+def get_sensor_credentials(sensor_id: int) -> Optional[SensorCredentials]:
+    """Secret and active project of the sensor, from sensor_cache when possible."""
+    try:
+        sensor_id = int(sensor_id)
+    except (TypeError, ValueError):
+        return None
+
+    credentials = sensor_cache.get(sensor_id)
+    if credentials is None:
+        with db_session() as db_conn:
+            credentials = Sensor.credentials(db_conn, sensor_id)
+        if credentials is not None:
+            sensor_cache.set(sensor_id, credentials)
+    return credentials
+
+
 def insert_datapoints(datapoints: List[Datapoint]):
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         Datapoint.create_many(db_conn, datapoints)
 
 
 def edit_project(project: Project, name: str, owner: User):
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         project.edit(db_conn, name, owner)
 
 
 def remove_project(project: Project):
-    with config().db_connection() as db_conn:
-        return project.delete(db_conn)
+    with db_session() as db_conn:
+        project.delete(db_conn)
+    invalidate_after_commit(sensor_cache, project.active_sensor)
+
+
+def get_project_data(project_id: int, with_datapoints: bool = True, **window) -> Optional[ProjectData]:
+    with db_session() as db_conn:
+        return ProjectData.get_data(db_conn, project_id, with_datapoints, **window)
+
+
+def get_sensor_data(sensor_id: int, with_datapoints: bool = True, **window) -> Optional[SensorData]:
+    with db_session() as db_conn:
+        return SensorData.get_data(db_conn, sensor_id, with_datapoints, **window)
+
+
+def stream_datapoints(project_id: int = None, sensor_id: int = None, **window) -> Iterator[Datapoint]:
+    """
+    Datapoint.iter_all() for the streamed exports. They are sent after the request
+    teardown so this reads from a connection of its own, opened on the first next() and
+    closed once done.
+    """
+    # Iterated outside of the app context.
+    return _stream_datapoints(config().db_pool, project_id, sensor_id, window)
+
+
+def _stream_datapoints(pool: ConnectionPool, project_id: int, sensor_id: int, window: Dict) -> Iterator[Datapoint]:
+    db_conn = pool.connect()
+    try:
+        # One snapshot for the whole export.
+        db_conn.execute('begin deferred;')
+        yield from Datapoint.iter_all(db_conn, project_id, sensor_id, **window)
+    finally:
+        db_conn.close()
+
+
+def get_datapoint_page(
+    project_id: int = None,
+    sensor_id: int = None,
+    window: Dict = None,
+    **page,
+) -> Tuple[int, DatapointSeries]:
+    """How many datapoints are in the window, as for get_datapoint_series, and a page."""
+    window = window or {}
+    with db_session() as db_conn:
+        return (
+            Datapoint.count(db_conn, project_id, sensor_id, **window),
+            Datapoint.get_page(db_conn, project_id, sensor_id, **page, **window),
+        )
+
+
+def get_datapoint_series(project_id: int = None, sensor_id: int = None, **window) -> DatapointSeries:
+    with db_session() as db_conn:
+        return Datapoint.get_series(db_conn, project_id, sensor_id, **window)
 
 
-def get_project_data(project_id: int) -> Optional[ProjectData]:
-    with config().db_connection() as db_conn:
-        return ProjectData.get_data(db_conn, project_id)
+def get_datapoint_version(
+    project_id: int = None,
+    sensor_id: int = None,
+    since: datetime = None,
+    until: datetime = None,
+) -> Tuple[int, Optional[int]]:
+    with db_session() as db_conn:
+        return Datapoint.get_version(db_conn, project_id, sensor_id, since, until)
 
 
-def get_sensor_data(sensor_id: int) -> Optional[SensorData]:
-    with config().db_connection() as db_conn:
-        return SensorData.get_data(db_conn, sensor_id)
+def get_datapoint_span(
+    project_id: int = None,
+    sensor_id: int = None,
+    **window,
+) -> Optional[Tuple[datetime, datetime]]:
+    with db_session() as db_conn:
+        return Datapoint.get_span(db_conn, project_id, sensor_id, **window)
+
+
+def get_project_rollups(
+    project_id: int,
+    resolution: str,
+    since: datetime = None,
+    until: datetime = None,
+) -> List[Rollup]:
+    with db_session() as db_conn:
+        return Rollup.get_all(db_conn, Rollup.periods[resolution], project_id=project_id, since=since, until=until)
+
+
+def get_sensor_rollups(
+    sensor_id: int,
+    resolution: str,
+    since: datetime = None,
+    until: datetime = None,
+) -> List[Rollup]:
+    with db_session() as db_conn:
+        return Rollup.get_all(db_conn, Rollup.periods[resolution], sensor_id=sensor_id, since=since, until=until)
 
 
 def insert_project(name: AnyStr, owner: User) -> Project:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Project.create(db_conn, name, owner)
 
 
 def insert_sensor(name: AnyStr, secret: AnyStr, owner: User) -> Sensor:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Sensor.create(db_conn, name, secret, owner)
 
 
 def update_project_sensor(project: Project, sensor_id: Optional[int] = None) -> None:
-    with config().db_connection() as db_conn:
+    previous_sensor = project.active_sensor
+    with db_session() as db_conn:
         project.attach_sensor(db_conn, sensor_id)
+    invalidate_after_commit(sensor_cache, previous_sensor, sensor_id)
 
 
 def get_datapoint(datapoint_id: int) -> Optional[Datapoint]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return Datapoint.find(db_conn, datapoint_id=datapoint_id)
 
 
 def remove_datapoint(datapoint: Datapoint):
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         datapoint.delete(db_conn)
 
 
 def get_users() -> List[User]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return User.get_all(db_conn)
 
 
 def get_user(user_id: int) -> Optional[User]:
-    with config().db_connection() as db_conn:
+    with db_session() as db_conn:
         return User.find(db_conn, user_id)
 
 
+def get_login_user(user_id: int) -> Optional[User]:
+    """User of the session, from user_cache when possible."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    user = user_cache.get(user_id)
+    if user is None:
+        # Not through db_session(): loading the user of a POST must not start its write
+        # transaction, the view may hash a password first (see insert_user).
+        user = User.find(config().db_connection(), user_id)
+        if user is not None:
+            user_cache.set(user_id, user)
+    return user
+
+
 def insert_user(username: str, password: str, is_admin: bool) -> User:
-    with config().db_connection() as db_conn:
-        return User.create(db_conn, username, password, is_admin)
+    # Hashed before the write lock is taken.
+    hashed_password = password_hasher.hash(password)
+    with db_session() as db_conn:
+        user = User.create(db_conn, username, password, is_admin, hashed_password)
+    invalidate_after_commit(user_cache, user.id)
+    return user
+
+
+def verify_user(username: str, password: str) -> Optional[User]:
+    """
+    The user if the password is right. bcrypt is slow on purpose so it never runs in a
+    transaction: the hash is read and checked on a connection of its own, outside of the
+    request session, and only a rehash writes, in a short transaction once it's done.
+    """
+    db_conn = config().db_pool.connect()
+    try:
+        credentials = User.get_credentials(db_conn, username)
+        if credentials is None or not password_hasher.check(password, credentials[1]):
+            return None
+
+        user, hashed_password = credentials
+        if password_hasher.needs_rehash(hashed_password):
+            # Made before the cost was raised, the password is only known now.
+            rehashed = password_hasher.hash(password)
+            with db_conn:
+                User.set_password_hash(db_conn, user.id, rehashed, hashed_password)
+        return user
+    finally:
+        db_conn.close()
 
 
 def remove_user(user: User):
-    with config().db_connection() as db_conn:
-        return user.delete(db_conn)
+    with db_session() as db_conn:
+        user.delete(db_conn)
+    invalidate_after_commit(user_cache, user.id)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import attr
+
+
+class TTLCache:
+    """
+    Thread safe mapping with a bounded size, the least recently used entries are evicted
+    first and the entries expire ttl seconds after they were set.
+    """
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self._entries = OrderedDict()  # key: (expiry, value)
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.configure(max_size, ttl)
+
+    def configure(self, max_size: int, ttl: float):
+        """Change the limits, also empties the cache."""
+        if max_size < 1 or ttl < 0:
+            raise ValueError(f'Invalid cache limits max_size={max_size} ttl={ttl}')
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+@attr.s(frozen=True)
+class SensorCredentials:
+    """What add_data needs to know about a sensor."""
+    sensor_id = attr.ib(type=int)
+    secret = attr.ib(type=str)
+    project_id = attr.ib(type=Optional[int])
+
+    def verify_identity(self, request_secret: str) -> bool:
+        return self.secret == request_secret
+
+
+@attr.s(frozen=True)
+class DataVersion:
+    """
+    What the summary tables know of the datapoints of a sensor or project. It changes on
+    every insertion or deletion so it validates what is made from them, see
+    Sensor.get_data_version and Project.get_data_version.
+    """
+    datapoint_count = attr.ib(type=int, default=0)
+    max_datapoint_id = attr.ib(type=Optional[int], default=None)
+    last_active = attr.ib(type=Optional[datetime], default=None)
+
+
+# SensorCredentials by sensor id, for the ingest path.
+# The access functions invalidate it once a change to a sensor or its active project is
+# committed, the TTL bounds how long the other processes of the server can see stale
+# entries.
+sensor_cache = TTLCache(max_size=1024, ttl=300)
+
+# User by id, for the user_loader of the logged in requests.
+# access.insert_user and access.remove_user invalidate it, a user deleted by another
+# process of the server stays logged in there until the entry expires.
+user_cache = TTLCache(max_size=256, ttl=60)
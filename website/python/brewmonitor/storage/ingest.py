@@ -0,0 +1,207 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from brewmonitor.configuration import Configuration
+from brewmonitor.storage.tables import Datapoint
+from flask import current_app
+
+
+# Errors of one datapoint, the others of the batch can still be inserted. The others,
+# like the db being locked, fail the whole batch.
+_datapoint_errors = (sqlite3.IntegrityError, sqlite3.InterfaceError, ValueError, TypeError, OverflowError)
+
+
+class IngestQueueFull(RuntimeError):
+    """No room for the datapoints before the timeout."""
+
+
+class IngestQueue:
+    """
+    Write-behind buffer for the datapoints sent by the sensors.
+    add_data() only queues them, a background thread inserts what is pending with one
+    create_many() and one commit per batch. A batch is committed when it reaches
+    max_batch_size or max_latency seconds after its first datapoint was queued.
+    A batch failing on the db as a whole, e.g. locked, is tried again up to max_retries
+    times, retry_delay seconds apart and more each time.
+    """
+
+    def __init__(
+        self,
+        config: Configuration,
+        max_batch_size: int = 500,
+        max_latency: float = 0.5,
+        max_depth: int = 10000,
+        put_timeout: float = 1.0,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._put_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+        # Updated by the requests, under _put_lock.
+        self.rejected = 0
+
+        # Metrics, only updated by the flusher thread.
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_commit_latency = 0.0
+        self.max_commit_latency = 0.0
+        self.total_commit_latency = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError('The ingest queue was already started.')
+        self._thread = threading.Thread(target=self._run, name='brewmonitor-ingest', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop accepting datapoints and wait for the pending ones to be committed."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def put(self, datapoints: List[Datapoint]):
+        """
+        Queue all the datapoints or none of them. Waits up to put_timeout seconds for
+        room in the queue, then raises IngestQueueFull.
+        """
+        if self._stopping.is_set() or self._thread is None:
+            raise RuntimeError('The ingest queue is not running.')
+
+        deadline = time.monotonic() + self.put_timeout
+        if not self._put_lock.acquire(timeout=self.put_timeout):
+            raise IngestQueueFull('Too many requests are waiting for the ingest queue.')
+        try:
+            # Only the requests put and the flusher only takes, so once there is room for
+            # all of them it stays until they are queued.
+            while self._queue.maxsize - self._queue.qsize() < len(datapoints):
+                if time.monotonic() >= deadline or len(datapoints) > self._queue.maxsize:
+                    self.rejected += len(datapoints)
+                    raise IngestQueueFull(f'No room for {len(datapoints)} datapoints, {self.depth} are pending.')
+                time.sleep(0.01)
+            for d in datapoints:
+                self._queue.put_nowait(d)
+        finally:
+            self._put_lock.release()
+
+    def flush(self):
+        """Wait until everything queued so far was committed (or failed)."""
+        self._queue.join()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def metrics(self) -> Dict:
+        return {
+            'depth': self.depth,
+            'batches': self.batches,
+            'committed': self.committed,
+            'failed': self.failed,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'last_commit_latency': self.last_commit_latency,
+            'max_commit_latency': self.max_commit_latency,
+            'mean_commit_latency': self.total_commit_latency / self.batches if self.batches else 0.0,
+        }
+
+    def _next_batch(self) -> List[Datapoint]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            # When stopping we only drain what is already there.
+            timeout = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(timeout, 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._commit(batch)
+            elif self._stopping.is_set():
+                # Drained.
+                return
+
+    def _commit(self, batch: List[Datapoint]):
+        start = time.monotonic()
+        try:
+            committed = self._insert(batch)
+        except Exception:
+            self.failed += len(batch)
+            self.logger.exception(f'Failed to insert a batch of {len(batch)} datapoints')
+        else:
+            latency = time.monotonic() - start
+            self.batches += 1
+            self.committed += committed
+            self.failed += len(batch) - committed
+            self.last_commit_latency = latency
+            self.max_commit_latency = max(self.max_commit_latency, latency)
+            self.total_commit_latency += latency
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _insert(self, batch: List[Datapoint]) -> int:
+        """
+        Insert the batch, returns how many datapoints were inserted. The sensors were
+        already answered so the batch is tried again while the db fails as a whole, and
+        when a datapoint fails the others are inserted without it.
+        """
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return self._insert_once(batch)
+            except sqlite3.OperationalError:
+                self.logger.exception(f'Failed to insert a batch of {len(batch)} datapoints, attempt {attempt}')
+            self.retries += 1
+            time.sleep(self.retry_delay * attempt)
+        return self._insert_once(batch)
+
+    def _insert_once(self, batch: List[Datapoint]) -> int:
+        try:
+            with self.config.db_connection() as db_conn:
+                Datapoint.create_many(db_conn, batch)
+            return len(batch)
+        except _datapoint_errors:
+            self.logger.exception(f'Failed to insert a batch of {len(batch)} datapoints, retrying one by one')
+
+        inserted = 0
+        with self.config.db_connection() as db_conn:
+            for d in batch:
+                try:
+                    # A failed statement is rolled back on its own, not the transaction.
+                    Datapoint.create_many(db_conn, [d])
+                except _datapoint_errors:
+                    self.logger.exception(f'Dropped {d}')
+                else:
+                    inserted += 1
+        return inserted
+
+
+def ingest_queue() -> Optional[IngestQueue]:
+    """The queue of the app, None when the datapoints are inserted straight away."""
+    return current_app.config.get('brewmonitor ingest queue')
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Callable, List, Sequence, Tuple
+
+import attr
+from brewmonitor.configuration import SQLConnection
+
+
+@attr.s(frozen=True)
+class Migration:
+    """
+    One step of the schema history.
+    apply() is given a connection inside a transaction and must not commit.
+    """
+    version = attr.ib(type=int)
+    description = attr.ib(type=str)
+    apply = attr.ib(type=Callable[[SQLConnection], None])
+
+
+def create_version_table(db_conn: SQLConnection):
+    db_conn.execute(
+        """
+        create table if not exists schema_version (
+            version integer primary key,
+            description text not null,
+            applied_at text not null
+        );
+        """,
+    )
+
+
+def current_version(db_conn: SQLConnection) -> int:
+    """Version of the db, 0 if it was never migrated."""
+    has_table = db_conn.execute(
+        """
+        select 1 from sqlite_master where type='table' and name='schema_version';
+        """,
+    ).fetchone()
+    if not has_table:
+        return 0
+    return db_conn.execute('select coalesce(max(version), 0) from schema_version;').fetchone()[0]
+
+
+def latest_version(migrations: Sequence[Migration]) -> int:
+    return max((m.version for m in migrations), default=0)
+
+
+def pending_migrations(db_conn: SQLConnection, migrations: Sequence[Migration]) -> List[Migration]:
+    version = current_version(db_conn)
+    return sorted((m for m in migrations if m.version > version), key=lambda m: m.version)
+
+
+def apply_migrations(
+    db_conn: SQLConnection,
+    migrations: Sequence[Migration],
+    dry_run: bool = False,
+) -> List[Tuple[Migration, List[str]]]:
+    """
+    Apply the pending migrations in order, each one in its own transaction.
+    Returns the migrations that were applied with the statements they executed.
+    With dry_run all the steps are executed then rolled back, nothing changes on disk.
+    """
+    if db_conn.in_transaction:
+        db_conn.commit()
+
+    applied = []
+    try:
+        for migration in pending_migrations(db_conn, migrations):
+            if not db_conn.in_transaction:
+                # immediate to hold the write lock, another worker may be migrating too.
+                db_conn.execute('begin immediate;')
+            if current_version(db_conn) >= migration.version:
+                # Applied by another worker since we checked.
+                continue
+
+            statements = []
+            db_conn.set_trace_callback(statements.append)
+            try:
+                migration.apply(db_conn)
+            finally:
+                db_conn.set_trace_callback(None)
+
+            create_version_table(db_conn)
+            db_conn.execute(
+                """
+                insert into schema_version (version, description, applied_at) values (?, ?, ?);
+                """,
+                (migration.version, migration.description, datetime.now().isoformat()),
+            )
+            if not dry_run:
+                db_conn.commit()
+            applied.append((migration, statements))
+    finally:
+        # Rolls back the failed step or everything in dry_run mode.
+        if db_conn.in_transaction:
+            db_conn.rollback()
+
+    return applied
@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Union
+
+import bcrypt
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Too many passwords are being checked already."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a pool of max_workers threads. bcrypt releases the GIL, so however many
+    logins come in they use at most max_workers cores and the other requests keep going.
+    Past max_pending hashes running or waiting for the pool, the new ones raise
+    PasswordHasherBusy straight away rather than queueing up.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_pending: int = 16):
+        self._lock = threading.Lock()
+        # Started by the first hash.
+        self._executor = None
+        self.pending = 0
+        self.configure(rounds, max_workers, max_pending)
+
+    def configure(self, rounds: int, max_workers: int, max_pending: int):
+        """Change the cost and limits, the hashes in progress finish on the old pool."""
+        if not 4 <= rounds <= 31 or max_workers < 1 or max_pending < max_workers:
+            raise ValueError(
+                f'Invalid password settings rounds={rounds} max_workers={max_workers} max_pending={max_pending}',
+            )
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self.rounds = rounds
+            self.max_workers = max_workers
+            self.max_pending = max_pending
+            self.completed = 0
+            self.rejected = 0
+
+    def _run(self, func: Callable, *args) -> Any:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy(f'{self.pending} passwords are being checked already.')
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='brewmonitor-bcrypt')
+            future = self._executor.submit(func, *args)
+            self.pending += 1
+
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def hash(self, password: str) -> bytes:
+        return self._run(bcrypt.hashpw, password.encode('utf8'), bcrypt.gensalt(self.rounds))
+
+    def check(self, password: str, hashed_password: bytes) -> bool:
+        return self._run(bcrypt.checkpw, password.encode('utf8'), _as_bytes(hashed_password))
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """If the hash was made with fewer rounds than configured."""
+        # $2b$<rounds>$<salt and hash>
+        return int(_as_bytes(hashed_password).split(b'$')[2]) < self.rounds
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+
+def _as_bytes(hashed_password: Union[bytes, str]) -> bytes:
+    if isinstance(hashed_password, str):
+        return hashed_password.encode('ascii')
+    return hashed_password
+
+
+# For User.create and access.verify_user, configured by make_app.
+password_hasher = PasswordHasher()
@@ -1,10 +1,17 @@
 import abc
+import calendar
+import collections.abc
+import keyword
+import math
+import sqlite3
+from array import array
 from datetime import datetime, timedelta
-from typing import Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import attr
-import bcrypt
 from brewmonitor.configuration import SQLConnection
+from brewmonitor.storage.cache import DataVersion, SensorCredentials
+from brewmonitor.storage.passwords import password_hasher
 from flask import url_for
 from flask_login import UserMixin
 
@@ -16,8 +23,10 @@ Required = None
 
 class BaseTable(metaclass=abc.ABCMeta):
     # Assumes children classes will use attr.s
-    # Each attributes can defined metadata.db_factory: Callable[[Dict], Any] to get a row
-    # and transform it to the expected object in python from the db value.
+    # Each attributes can defined metadata.db_convert: Callable[[Any], Any] to transform
+    # the db value to the expected object in python, or metadata.db_factory:
+    # Callable[[Dict], Any] when it needs the whole row.
+    # Indexes are declared with additional_sql_indexes() as tuples of column names.
 
     def __init__(self, *args, **kwargs):
         super().__init__()
@@ -38,6 +47,22 @@ class BaseTable(metaclass=abc.ABCMeta):
 
         return f'create table if not exists {cls.__name__} ({", ".join(rv)});'
 
+    @classmethod
+    def additional_sql_indexes(cls) -> List[Tuple[str, ...]]:
+        """Columns of the indexes to create on the table, can be composite."""
+        return []
+
+    @classmethod
+    def index_name(cls, columns: Tuple[str, ...]) -> str:
+        return f'{cls.__name__}_{"_".join(columns)}_idx'
+
+    @classmethod
+    def create_indexes_req(cls) -> List[str]:
+        return [
+            f'create index if not exists {cls.index_name(columns)} on {cls.__name__} ({", ".join(columns)});'
+            for columns in cls.additional_sql_indexes()
+        ]
+
     @classmethod
     def row_factory_as_dict(cls, cursor, row) -> Dict:
         """
@@ -54,11 +79,58 @@ class BaseTable(metaclass=abc.ABCMeta):
                     d[field.name] = field.default.factory()
                 elif field.default is not attr.NOTHING:
                     d[field.name] = field.default
+            elif field.metadata.get('db_convert'):
+                d[field.name] = field.metadata['db_convert'](d[field.name])
             elif field.metadata.get('db_factory'):
                 d[field.name] = field.metadata['db_factory'](d)
 
         return d
 
+    @classmethod
+    def row_factory_for(cls, cursor) -> Callable[[Any, Tuple], 'BaseTable']:
+        """
+        Row factory for the columns of the cursor, made once per set of columns and
+        cached on the class. Same objects as row_factory_as_dict() but the row values
+        go straight to the constructor, the defaults are left to attr.s.
+        """
+        columns = tuple(col[0] for col in cursor.description)
+        factories = cls.__dict__.get('_row_factories')
+        if factories is None:
+            # In cls.__dict__ so sub classes don't share it.
+            factories = {}
+            cls._row_factories = factories
+        factory = factories.get(columns)
+        if factory is None:
+            factory = factories[columns] = cls._compile_row_factory(columns)
+        return factory
+
+    @classmethod
+    def _compile_row_factory(cls, columns: Tuple[str, ...]) -> Callable[[Any, Tuple], 'BaseTable']:
+        fields = attr.fields_dict(cls)
+        namespace = {'cls': cls}
+        args = {}
+        uses_dict = False
+        for idx, name in enumerate(columns):
+            if not name.isidentifier() or keyword.iskeyword(name):
+                raise ValueError(f'Cannot build {cls.__name__} from a column named {name!r}')
+            metadata = fields[name].metadata if name in fields else {}
+            if metadata.get('db_convert'):
+                namespace[f'convert_{idx}'] = metadata['db_convert']
+                args[name] = f'convert_{idx}(row[{idx}])'
+            elif metadata.get('db_factory'):
+                namespace[f'factory_{idx}'] = metadata['db_factory']
+                args[name] = f'factory_{idx}(d)'
+                uses_dict = True
+            else:
+                args[name] = f'row[{idx}]'
+
+        lines = ['def row_factory(cursor, row):']
+        if uses_dict:
+            lines.append(f'    d = dict(zip({columns!r}, row))')
+        lines.append(f'    return cls({", ".join(f"{name}={value}" for name, value in args.items())})')
+        exec('\n'.join(lines), namespace)
+        return namespace['row_factory']
+
     @classmethod
     def sub_fields(cls) -> List[str]:
         """Helper method to extract sub-querries from attr fields"""
@@ -70,7 +142,7 @@ class BaseTable(metaclass=abc.ABCMeta):
 
     @classmethod
     def row_factory(cls, cursor, row) -> 'BaseTable':
-        return cls(**cls.row_factory_as_dict(cursor, row))
+        return cls.row_factory_for(cursor)(cursor, row)
 
     @classmethod
     @abc.abstractmethod
@@ -82,6 +154,30 @@ class BaseTable(metaclass=abc.ABCMeta):
     def find(cls, db_conn: SQLConnection, **kwargs) -> Optional:
         raise NotImplementedError()
 
+    @classmethod
+    def find_many(cls, db_conn: SQLConnection, ids: Iterable[int]) -> Dict[int, 'BaseTable']:
+        """
+        The objects with these ids, by id, in as few queries as possible. Unknown ids are
+        left out.
+        """
+        raise NotImplementedError()
+
+    # Stays under the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions.
+    max_ids_per_query = 500
+
+    @classmethod
+    def _select_many(cls, db_conn: SQLConnection, select: str, ids: Iterable[int]) -> Dict[int, 'BaseTable']:
+        """find_many() helper, select is the query without its where clause."""
+        ids = sorted(set(ids))
+        found = {}
+        for start in range(0, len(ids), cls.max_ids_per_query):
+            chunk = ids[start:start + cls.max_ids_per_query]
+            cursor = db_conn.execute(f'{select} where id in ({", ".join("?" * len(chunk))});', chunk)
+            cursor.row_factory = cls.row_factory_for(cursor)
+            for obj in cursor:
+                found[obj.id] = obj
+        return found
+
     @classmethod
     @abc.abstractmethod
     def create(cls, db_conn: SQLConnection, **kwargs) -> 'BaseTable':
@@ -96,19 +192,38 @@ class BaseTable(metaclass=abc.ABCMeta):
         raise NotImplementedError()
 
 
-def datetime_row_factory(field_name: str) -> Callable[[Dict], Optional[datetime]]:
-    def _f(r: Dict) -> Optional[datetime]:
-        if r[field_name]:
-            return datetime.fromisoformat(r[field_name])
+# Timestamps are stored as seconds since Epoch, naive datetimes are considered UTC
+# so they are read back unchanged.
+def to_epoch(when: Union[datetime, str, int, float]) -> int:
+    if isinstance(when, str):
+        # ISO 8601, like the sensors can send them.
+        when = datetime.fromisoformat(when[:-1] + '+00:00' if when.endswith('Z') else when)
+    if isinstance(when, datetime):
+        return calendar.timegm(when.utctimetuple())
+    return int(when)
+
+
+def from_epoch(value: Union[int, str, None]) -> Optional[datetime]:
+    if value is None or value == '':
         return None
-    return _f
+    if isinstance(value, str):
+        # Written before the timestamps were stored as integers.
+        return datetime.fromisoformat(value)
+    return datetime.utcfromtimestamp(value)
+
+
+def decode_timestamps(values: Sequence[Union[int, str, None]]) -> List[Optional[datetime]]:
+    """Decode a whole column of timestamps at once, instead of once per row."""
+    if all(type(v) is int for v in values):
+        return list(map(datetime.utcfromtimestamp, values))
+    return [from_epoch(v) for v in values]
 
 
 @attr.s
 class User(BaseTable, UserMixin):
     id = attr.ib(type=int, metadata={'sql': '{name} integer primary key autoincrement'})
     username = attr.ib(type=str, metadata={'sql': '{name} text not null'})
-    is_admin = attr.ib(type=bool, metadata={'sql': '{name} bool', 'db_factory': lambda r: bool(r['is_admin'])})
+    is_admin = attr.ib(type=bool, metadata={'sql': '{name} bool', 'db_convert': bool})
 
     @classmethod
     def additional_sql_fields(cls) -> List[str]:
@@ -126,7 +241,7 @@ class User(BaseTable, UserMixin):
             select id, username, is_admin from User;
             """,
         )
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchall()
 
     @classmethod
@@ -142,9 +257,13 @@ class User(BaseTable, UserMixin):
             """,
             (user_id,),
         )
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchone()
 
+    @classmethod
+    def find_many(cls, db_conn: SQLConnection, ids: Iterable[int]) -> Dict[int, 'User']:
+        return cls._select_many(db_conn, 'select id, username, is_admin from User', ids)
+
     @classmethod
     def create(
         cls,
@@ -152,12 +271,14 @@ class User(BaseTable, UserMixin):
         username: str = Required,
         password: str = Required,
         is_admin: bool = Required,
+        hashed_password: Optional[bytes] = None,
     ) -> 'User':
+        """hashed_password: when password was already hashed, see access.insert_user."""
         if username is None or password is None or is_admin is None:
             raise ValueError('All args are required.')
 
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(password.encode('utf8'), salt)
+        if hashed_password is None:
+            hashed_password = password_hasher.hash(password)
         cursor = db_conn.cursor()
 
         cursor.execute(
@@ -185,6 +306,15 @@ class User(BaseTable, UserMixin):
 
     @classmethod
     def verify(cls, db_conn: SQLConnection, username: str, password: str) -> Optional['User']:
+        """Checks the password in the transaction of db_conn, see access.verify_user."""
+        credentials = cls.get_credentials(db_conn, username)
+        if credentials is not None and password_hasher.check(password, credentials[1]):
+            return credentials[0]
+        return None
+
+    @classmethod
+    def get_credentials(cls, db_conn: SQLConnection, username: str) -> Optional[Tuple['User', bytes]]:
+        """The user and its password hash."""
         data = db_conn.execute(
             """
             select id, is_admin, password
@@ -194,15 +324,36 @@ class User(BaseTable, UserMixin):
             (username,),
         ).fetchone()
 
-        if data is not None:
-            hashed_password = data[2]
-            if bcrypt.checkpw(password.encode('utf8'), hashed_password):
-                return cls(
-                    data[0],
-                    username,
-                    data[1],
-                )
+        if data is None:
+            return None
+        return cls(data[0], username, data[1]), data[2]
+
+    @classmethod
+    def set_password_hash(cls, db_conn: SQLConnection, user_id: int, hashed_password: bytes, previous: bytes):
+        """Replace the hash, unless it was changed since previous was read."""
+        db_conn.execute(
+            """
+            update User set password=? where id=? and password=?;
+            """,
+            (hashed_password, user_id, previous),
+        )
+
+
+@attr.s(frozen=True)
+class SensorAssignment:
+    """A sensor and the project it's attached to, see Sensor.get_assignments."""
+    sensor_id = attr.ib(type=int)
+    sensor_name = attr.ib(type=str)
+    project_id = attr.ib(type=Optional[int])
+    project_name = attr.ib(type=Optional[str])
+
+
+def _data_version(row: Optional[Tuple]) -> Optional[DataVersion]:
+    """DataVersion of a (datapoint_count, max_datapoint_id, last_active) summary row."""
+    if row is None:
         return None
+    count, max_id, last_active = row
+    return DataVersion(count or 0, max_id, from_epoch(last_active))
 
 
 @attr.s
@@ -221,13 +372,14 @@ class Sensor(BaseTable):
     max_battery = attr.ib(type=float, default=2.0, metadata={'sql': '{name} real'})
     min_battery = attr.ib(type=float, default=4.0, metadata={'sql': '{name} real'})
 
+    # SensorSummary is maintained from Datapoint by triggers, see schema._summary_tables.
     last_active = attr.ib(
         type=datetime,
         default=None,
         metadata={
-            'db_factory': datetime_row_factory('last_active'),
+            'db_convert': from_epoch,
             'subquery': """
-                select timestamp from Datapoint where sensor_id = Sensor.id order by timestamp desc limit 1
+                select last_active from SensorSummary where sensor_id = Sensor.id
             """,
         },
     )
@@ -236,7 +388,7 @@ class Sensor(BaseTable):
         default=None,
         metadata={
             'subquery': """
-                select battery from Datapoint where sensor_id = Sensor.id order by timestamp desc limit 1
+                select last_battery from SensorSummary where sensor_id = Sensor.id
             """,
         },
     )
@@ -264,7 +416,7 @@ class Sensor(BaseTable):
             order by id desc;
             """,
         )
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchall()
 
     @classmethod
@@ -278,9 +430,62 @@ class Sensor(BaseTable):
             """,
             (sensor_id,),
         )
-        sens_cursor.row_factory = cls.row_factory
+        sens_cursor.row_factory = cls.row_factory_for(sens_cursor)
         return sens_cursor.fetchone()
 
+    @classmethod
+    def find_many(cls, db_conn: SQLConnection, ids: Iterable[int]) -> Dict[int, 'Sensor']:
+        return cls._select_many(
+            db_conn,
+            f'select id, name, secret, max_battery, min_battery, {", ".join(cls.sub_fields())} from Sensor',
+            ids,
+        )
+
+    @classmethod
+    def credentials(cls, db_conn: SQLConnection, sensor_id: int) -> Optional[SensorCredentials]:
+        """The secret and active project of the sensor, without the other sub-queries."""
+        row = db_conn.execute(
+            """
+            select secret, (
+                select id from Project where active_sensor = Sensor.id order by id desc limit 1
+            )
+            from Sensor where id = ?;
+            """,
+            (sensor_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return SensorCredentials(sensor_id, row[0], row[1])
+
+    @classmethod
+    def get_data_version(cls, db_conn: SQLConnection, sensor_id: int) -> Optional[DataVersion]:
+        """From SensorSummary, no datapoint is read. None for unknown sensors."""
+        row = db_conn.execute(
+            """
+            select SensorSummary.datapoint_count, SensorSummary.max_datapoint_id, SensorSummary.last_active
+            from Sensor
+            left join SensorSummary on SensorSummary.sensor_id = Sensor.id
+            where Sensor.id = ?;
+            """,
+            (sensor_id,),
+        ).fetchone()
+        return _data_version(row)
+
+    @classmethod
+    def get_assignments(cls, db_conn: SQLConnection) -> List['SensorAssignment']:
+        """Every sensor with its active project, if any, without the other sub-queries."""
+        cursor = db_conn.execute(
+            """
+            select Sensor.id, Sensor.name, Project.id, Project.name
+            from Sensor
+            left join Project on Project.id = (
+                select id from Project where active_sensor = Sensor.id order by id desc limit 1
+            )
+            order by Sensor.id desc;
+            """,
+        )
+        return [SensorAssignment(*row) for row in cursor]
+
     @classmethod
     def create(
         cls,
@@ -350,12 +555,7 @@ class Sensor(BaseTable):
         """Cascade deletion of the sensor.
         Removes Datapoint entries and detach from active Project.
         """
-        db_conn.execute(
-            """
-            delete from Datapoint where sensor_id=?;
-            """,
-            (self.id,),
-        )
+        Datapoint.delete_all(db_conn, sensor_id=self.id)
         db_conn.execute(
             """
             update Project set 'active_sensor' = NULL where active_sensor=?;
@@ -439,32 +639,33 @@ class Project(BaseTable):
     # Assuming 1 sensor per project but could change the sensor.
     active_sensor = attr.ib(type=int, default=None, metadata={'sql': '{name} integer'})
 
+    # ProjectSummary is maintained from Datapoint by triggers, see schema._summary_tables.
     first_active = attr.ib(
         type=datetime,
         default=None,
         metadata={
-            'db_factory': datetime_row_factory('first_active'),
+            'db_convert': from_epoch,
             'subquery': """
-                select timestamp from Datapoint where project_id = Project.id order by timestamp asc limit 1
+                select first_active from ProjectSummary where project_id = Project.id
             """,
         },
-    )  # in SQL we would get that from the datapoints
+    )
     last_active = attr.ib(
         type=datetime,
         default=None,
         metadata={
-            'db_factory': datetime_row_factory('last_active'),
+            'db_convert': from_epoch,
             'subquery': """
-                select timestamp from Datapoint where project_id = Project.id order by timestamp desc limit 1
+                select last_active from ProjectSummary where project_id = Project.id
             """,
         },
-    )  # in SQL we would get that from the datapoints
+    )
     first_angle = attr.ib(
         type=float,
         default=None,
         metadata={
             'subquery': """
-                select angle from Datapoint where project_id = Project.id order by timestamp asc limit 1
+                select first_angle from ProjectSummary where project_id = Project.id
             """,
         },
     )
@@ -473,7 +674,7 @@ class Project(BaseTable):
         default=None,
         metadata={
             'subquery': """
-                select angle from Datapoint where project_id = Project.id order by timestamp desc limit 1
+                select last_angle from ProjectSummary where project_id = Project.id
             """,
         },
     )
@@ -482,7 +683,7 @@ class Project(BaseTable):
         default=None,
         metadata={
             'subquery': """
-                select temperature from Datapoint where project_id = Project.id order by timestamp desc limit 1
+                select last_temperature from ProjectSummary where project_id = Project.id
             """,
         },
     )
@@ -494,6 +695,13 @@ class Project(BaseTable):
             'foreign key(active_sensor) references Sensor(id)',
         ]
 
+    @classmethod
+    def additional_sql_indexes(cls) -> List[Tuple[str, ...]]:
+        return super(Project, cls).additional_sql_indexes() + [
+            # Used by by_active_sensor() and the Sensor.linked_project sub-query.
+            ('active_sensor',),
+        ]
+
     @classmethod
     def get_all(cls, db_conn: SQLConnection, **kwargs) -> List['Project']:
         if kwargs:
@@ -507,9 +715,14 @@ class Project(BaseTable):
             """,
         )
         # TODO(tr) Add order by last activity
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchall()
 
+    @classmethod
+    def get_names(cls, db_conn: SQLConnection) -> List[Tuple[int, str]]:
+        """The id and name of every project, without the sub-queries."""
+        return db_conn.execute('select id, name from Project order by id desc;').fetchall()
+
     @classmethod
     def find(cls, db_conn: SQLConnection, project_id: int = Required) -> Optional['Project']:
         if project_id is None:
@@ -523,9 +736,31 @@ class Project(BaseTable):
             """,
             (project_id,),
         )
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchone()
 
+    @classmethod
+    def find_many(cls, db_conn: SQLConnection, ids: Iterable[int]) -> Dict[int, 'Project']:
+        return cls._select_many(
+            db_conn,
+            f'select id, name, active_sensor, {", ".join(cls.sub_fields())} from Project',
+            ids,
+        )
+
+    @classmethod
+    def get_data_version(cls, db_conn: SQLConnection, project_id: int) -> Optional[DataVersion]:
+        """From ProjectSummary, no datapoint is read. None for unknown projects."""
+        row = db_conn.execute(
+            """
+            select ProjectSummary.datapoint_count, ProjectSummary.max_datapoint_id, ProjectSummary.last_active
+            from Project
+            left join ProjectSummary on ProjectSummary.project_id = Project.id
+            where Project.id = ?;
+            """,
+            (project_id,),
+        ).fetchone()
+        return _data_version(row)
+
     @classmethod
     def by_active_sensor(cls, db_conn: SQLConnection, sensor_id: int) -> Optional['Project']:
         proj_cursor = db_conn.execute(
@@ -537,7 +772,7 @@ class Project(BaseTable):
             """,
             (sensor_id,),
         )
-        proj_cursor.row_factory = cls.row_factory
+        proj_cursor.row_factory = cls.row_factory_for(proj_cursor)
         return proj_cursor.fetchone()
 
     @classmethod
@@ -557,12 +792,7 @@ class Project(BaseTable):
 
     def delete(self, db_conn: SQLConnection):
         """Cascade deletion of the Project (removes all entries fro Datapoint too)."""
-        db_conn.execute(
-            """
-            delete from Datapoint where project_id=?;
-            """,
-            (self.id,),
-        )
+        Datapoint.delete_all(db_conn, project_id=self.id)
         db_conn.execute(
             """
             delete from Project where id=?;
@@ -633,6 +863,7 @@ class Project(BaseTable):
                 """,
                 (self.id,),
             )
+
         self.active_sensor = sensor_id
 
 
@@ -642,7 +873,7 @@ class Datapoint(BaseTable):
     project_id = attr.ib(type=int, metadata={'sql': '{name} integer'})
     timestamp = attr.ib(
         type=datetime,
-        metadata={'sql': '{name} integer not null', 'db_factory': datetime_row_factory('timestamp')},
+        metadata={'sql': '{name} integer not null', 'db_convert': from_epoch},
     )
     angle = attr.ib(type=float, metadata={'sql': '{name} real'})
     temperature = attr.ib(type=float, metadata={'sql': '{name} real'})
@@ -657,49 +888,304 @@ class Datapoint(BaseTable):
         ]
 
     @classmethod
-    def get_all(
+    def additional_sql_indexes(cls) -> List[Tuple[str, ...]]:
+        return super(Datapoint, cls).additional_sql_indexes() + [
+            # Used by get_all(), the Sensor and Project sub-queries and cascade deletions.
+            ('project_id', 'timestamp'),
+            ('sensor_id', 'timestamp'),
+        ]
+
+    @classmethod
+    def _window_where(
         cls,
-        db_conn: SQLConnection,
         project_id: int = None,
         sensor_id: int = None,
-    ) -> List['Datapoint']:
+        since: datetime = None,
+        until: datetime = None,
+    ) -> Tuple[List[str], List]:
         if project_id is not None:
-            data_cursor = db_conn.execute(
-                """
-                select id, project_id, sensor_id, angle, temperature, battery, timestamp
-                from Datapoint
-                where project_id = ?;
-                """,
-                (project_id,),
-            )
+            where = ['project_id = ?']
+            params = [project_id]
         elif sensor_id is not None:
-            data_cursor = db_conn.execute(
-                """
-                select id, project_id, sensor_id, angle, temperature, battery, timestamp
-                from Datapoint
-                where sensor_id = ?;
-                """,
-                (sensor_id,),
-            )
+            where = ['sensor_id = ?']
+            params = [sensor_id]
         else:
             # Needs either a project or a sensor id.
             raise NotImplementedError()
-        data_cursor.row_factory = cls.row_factory
-        return data_cursor.fetchall()
+
+        if since is not None:
+            where.append('timestamp >= ?')
+            params.append(to_epoch(since))
+        if until is not None:
+            where.append('timestamp < ?')
+            params.append(to_epoch(until))
+        return where, params
+
+    @classmethod
+    def window_query(
+        cls,
+        project_id: int = None,
+        sensor_id: int = None,
+        since: datetime = None,
+        until: datetime = None,
+        limit: int = None,
+        after_id: int = None,
+    ) -> Tuple[str, List, bool]:
+        """
+        The select statement and its parameters for get_all(), and whether the rows come
+        newest first and need to be reversed.
+        """
+        where, params = cls._window_where(project_id, sensor_id, since, until)
+        if after_id:
+            where.append('(timestamp, id) > (select timestamp, id from Datapoint where id = ?)')
+            params.append(after_id)
+
+        # Without a cursor the limit keeps the newest ones.
+        newest = limit is not None and after_id is None
+        order = 'timestamp desc, id desc' if newest else 'timestamp, id'
+        if limit is not None:
+            order += ' limit ?'
+            params.append(limit)
+
+        statement = f"""
+            select id, project_id, sensor_id, angle, temperature, battery, timestamp
+            from Datapoint
+            where {" and ".join(where)}
+            order by {order}
+        """
+        return statement, params, newest
+
+    @classmethod
+    def get_all(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        **window,
+    ) -> List['Datapoint']:
+        """
+        Datapoints of a project or a sensor, ordered by timestamp (then id).
+        The window can have:
+        - since (inclusive) and until (exclusive) datetimes,
+        - after_id to get the ones that come after that datapoint, for keyset pagination.
+          0 starts from the oldest,
+        - limit to keep the first ones after after_id, or the newest ones without it.
+        """
+        statement, params, newest = cls.window_query(project_id, sensor_id, **window)
+        rows = db_conn.execute(statement, params).fetchall()
+        if newest:
+            rows.reverse()
+        return cls.from_rows(rows)
+
+    @classmethod
+    def iter_all(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        batch_size: int = 1000,
+        **window,
+    ) -> Iterator['Datapoint']:
+        """Same as get_all() but only holds batch_size rows at a time."""
+        statement, params, newest = cls.window_query(project_id, sensor_id, **window)
+        cursor = db_conn.execute(statement, params)
+        if newest:
+            # Bounded by the limit.
+            yield from cls.from_rows(cursor.fetchall()[::-1])
+            return
+
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            yield from cls.from_rows(rows)
+            rows = cursor.fetchmany(batch_size)
+
+    @classmethod
+    def get_series(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        **window,
+    ) -> 'DatapointSeries':
+        """Same as get_all() but stored by column, see DatapointSeries."""
+        statement, params, newest = cls.window_query(project_id, sensor_id, **window)
+        cursor = db_conn.execute(statement, params)
+        if newest:
+            # Bounded by the limit.
+            series = DatapointSeries()
+            series.extend_rows(cursor.fetchall()[::-1])
+            return series
+        return DatapointSeries.from_cursor(cursor)
+
+    @classmethod
+    def _window_source(
+        cls,
+        project_id: int = None,
+        sensor_id: int = None,
+        since: datetime = None,
+        until: datetime = None,
+        limit: int = None,
+        after_id: int = None,
+    ) -> Tuple[str, List]:
+        """
+        What to select from for the datapoints of the window, and its parameters. The
+        table itself unless limit or after_id make it a subquery.
+        """
+        if limit is None and after_id is None:
+            where, params = cls._window_where(project_id, sensor_id, since, until)
+            return f'Datapoint where {" and ".join(where)}', params
+        statement, params, _ = cls.window_query(project_id, sensor_id, since, until, limit, after_id)
+        return f'({statement})', params
+
+    @classmethod
+    def count(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        **window,
+    ) -> int:
+        """How many datapoints get_all() would return."""
+        source, params = cls._window_source(project_id, sensor_id, **window)
+        return db_conn.execute(f'select count(*) from {source};', params).fetchone()[0]
+
+    @classmethod
+    def get_version(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        since: datetime = None,
+        until: datetime = None,
+    ) -> Tuple[int, Optional[int]]:
+        """
+        The number of datapoints and the last id, which change when datapoints are added
+        or removed. Only reads the timestamp indexes.
+        """
+        where, params = cls._window_where(project_id, sensor_id, since, until)
+        count, last_id = db_conn.execute(
+            f'select count(*), max(id) from Datapoint where {" and ".join(where)};',
+            params,
+        ).fetchone()
+        return count, last_id
+
+    @classmethod
+    def distinct_ids(
+        cls,
+        db_conn: SQLConnection,
+        column: str,
+        project_id: int = None,
+        sensor_id: int = None,
+        since: datetime = None,
+        until: datetime = None,
+    ) -> Set[int]:
+        """Distinct sensor_id or project_id of the datapoints, without loading them."""
+        if column not in ('sensor_id', 'project_id'):
+            raise ValueError(f'Unknown column {column}')
+        where, params = cls._window_where(project_id, sensor_id, since, until)
+        cursor = db_conn.execute(
+            f'select distinct {column} from Datapoint where {" and ".join(where)} and {column} is not null;',
+            params,
+        )
+        return {row[0] for row in cursor}
+
+    @classmethod
+    def get_page(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        offset: int = 0,
+        length: int = 10,
+        descending: bool = True,
+        **window,
+    ) -> 'DatapointSeries':
+        """
+        One page of the datapoints of the window, as for get_all(), ordered by timestamp
+        (then id), newest first when descending, for the tables of the pages.
+        """
+        source, params = cls._window_source(project_id, sensor_id, **window)
+        order = 'timestamp desc, id desc' if descending else 'timestamp, id'
+        cursor = db_conn.execute(
+            f"""
+            select id, project_id, sensor_id, angle, temperature, battery, timestamp
+            from {source}
+            order by {order}
+            limit ? offset ?;
+            """,
+            params + [length, offset],
+        )
+        return DatapointSeries.from_cursor(cursor)
+
+    @classmethod
+    def get_span(
+        cls,
+        db_conn: SQLConnection,
+        project_id: int = None,
+        sensor_id: int = None,
+        **window,
+    ) -> Optional[Tuple[datetime, datetime]]:
+        """The first and last timestamps of what get_all() would return, None if empty."""
+        statement, params, _ = cls.window_query(project_id, sensor_id, **window)
+        first, last = db_conn.execute(
+            f'select min(timestamp), max(timestamp) from ({statement});',
+            params,
+        ).fetchone()
+        if first is None:
+            return None
+        return from_epoch(first), from_epoch(last)
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple]) -> List['Datapoint']:
+        """
+        Build the objects from rows of
+        (id, project_id, sensor_id, angle, temperature, battery, timestamp).
+        """
+        timestamps = decode_timestamps([r[6] for r in rows])
+        return [
+            cls(
+                sensor_id=r[2],
+                project_id=r[1],
+                timestamp=timestamp,
+                angle=r[3],
+                temperature=r[4],
+                battery=r[5],
+                id=r[0],
+            )
+            for r, timestamp in zip(rows, timestamps)
+        ]
 
     @classmethod
     def create_many(cls, conn: SQLConnection, datapoints: List['Datapoint']):
         conn.executemany(
             """
             insert into Datapoint (sensor_id, project_id, timestamp, angle, temperature, battery)
-            values (?, ?, datetime(?), ?, ?, ?);
+            values (?, ?, ?, ?, ?, ?);
             """,
             (
-                (d.sensor_id, d.project_id, d.timestamp, d.angle, d.temperature, d.battery)
+                (d.sensor_id, d.project_id, to_epoch(d.timestamp), d.angle, d.temperature, d.battery)
                 for d in datapoints
             ),
         )
 
+    @classmethod
+    def delete_all(cls, db_conn: SQLConnection, project_id: int = None, sensor_id: int = None):
+        """
+        Delete all the datapoints of a project or a sensor. Their rollup buckets are
+        recomputed once at the end rather than by the delete triggers for each datapoint.
+        """
+        if project_id is not None:
+            column, value = 'project_id', project_id
+        elif sensor_id is not None:
+            column, value = 'sensor_id', sensor_id
+        else:
+            # Needs either a project or a sensor id.
+            raise NotImplementedError()
+
+        buckets = Rollup.drop_buckets(db_conn, column, value)
+        db_conn.execute(f'delete from Datapoint where {column}=?;', (value,))
+        Rollup.rebuild_buckets(db_conn, buckets)
+
     @classmethod
     def create(cls, db_conn: SQLConnection, **kwargs) -> 'Datapoint':
         raise RuntimeError('Use create_many() instead.')
@@ -717,7 +1203,7 @@ class Datapoint(BaseTable):
             """,
             (datapoint_id,),
         )
-        cursor.row_factory = cls.row_factory
+        cursor.row_factory = cls.row_factory_for(cursor)
         return cursor.fetchone()
 
     @classmethod
@@ -769,20 +1255,356 @@ class Datapoint(BaseTable):
     def angle_as_str(self):
         return self.format_angle(self.angle)
 
-    @property
-    def gravity(self):
+    @classmethod
+    def angle_to_gravity(cls, angle: float) -> float:
         # TODO(tr) Use an actual algorithm with the sensor's config to convert
         # Transforms 45 to 1.045
-        return 1.0 + self.angle / 1000
+        return 1.0 + angle / 1000
 
-    def as_datatable(self):
+    @property
+    def gravity(self):
+        return self.angle_to_gravity(self.angle)
+
+    @classmethod
+    def datatable_entry(cls, timestamp: datetime, angle: float, temperature: float, battery: float) -> Dict:
         return {
             'when': {
-                'label': self.timestamp_as_str(),
-                'timestamp': self.timestamp.timestamp(),
+                'label': cls.format_timestamp(timestamp),
+                'timestamp': timestamp.timestamp(),
             },
-            'gravity': self.gravity_as_str(),
-            'angle': self.angle_as_str(),
-            'temperature': self.temperature_as_str(),
-            'battery': self.battery_as_str(),
+            'gravity': cls.format_gravity(cls.angle_to_gravity(angle)),
+            'angle': cls.format_angle(angle),
+            'temperature': cls.format_temperature(temperature),
+            'battery': cls.format_battery(battery),
         }
+
+    def as_datatable(self):
+        return self.datatable_entry(self.timestamp, self.angle, self.temperature, self.battery)
+
+
+def _ids_column(values: Sequence[Optional[int]]) -> Sequence[int]:
+    if None in values:
+        return [0 if v is None else v for v in values]
+    return values
+
+
+def _values_column(values: Sequence[Optional[float]]) -> Sequence[float]:
+    if None in values:
+        return [math.nan if v is None else v for v in values]
+    return values
+
+
+def _epoch_column(values: Sequence[Union[int, str]]) -> Sequence[int]:
+    if all(type(v) is int for v in values):
+        return values
+    return [to_epoch(from_epoch(v)) for v in values]
+
+
+class DatapointSeries(collections.abc.Sequence):
+    """
+    Datapoints stored by column, in arrays of machine ints and floats, rather than as one
+    Datapoint object per row. Indexing or iterating gives Datapoint row views for the
+    callers that want objects, slices are DatapointSeries.
+    Missing ids are stored as 0 (the ids start at 1) and missing values as NaN.
+    """
+
+    def __init__(self):
+        self.id = array('q')
+        self.project_id = array('q')
+        self.sensor_id = array('q')
+        self.angle = array('d')
+        self.temperature = array('d')
+        self.battery = array('d')
+        # Seconds since Epoch.
+        self.timestamp = array('q')
+
+    @classmethod
+    def from_cursor(cls, cursor: sqlite3.Cursor, batch_size: int = 1000) -> 'DatapointSeries':
+        """
+        Load the rows of the cursor, batch_size rows at a time. They are
+        (id, project_id, sensor_id, angle, temperature, battery, timestamp).
+        """
+        series = cls()
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            series.extend_rows(rows)
+            rows = cursor.fetchmany(batch_size)
+        return series
+
+    @classmethod
+    def of(cls, data_points: Iterable[Datapoint]) -> 'DatapointSeries':
+        """The data points as a DatapointSeries, unchanged if it already is one."""
+        if isinstance(data_points, cls):
+            return data_points
+        series = cls()
+        series.extend_rows([
+            (d.id, d.project_id, d.sensor_id, d.angle, d.temperature, d.battery, to_epoch(d.timestamp))
+            for d in data_points
+        ])
+        return series
+
+    def extend_rows(self, rows: Sequence[Tuple]):
+        """
+        Append rows of
+        (id, project_id, sensor_id, angle, temperature, battery, timestamp).
+        """
+        if not rows:
+            return
+        ids, project_ids, sensor_ids, angles, temperatures, batteries, timestamps = zip(*rows)
+        self.id.extend(_ids_column(ids))
+        self.project_id.extend(_ids_column(project_ids))
+        self.sensor_id.extend(sensor_ids)
+        self.angle.extend(_values_column(angles))
+        self.temperature.extend(_values_column(temperatures))
+        self.battery.extend(_values_column(batteries))
+        self.timestamp.extend(_epoch_column(timestamps))
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Datapoint, 'DatapointSeries']:
+        if isinstance(index, slice):
+            series = DatapointSeries()
+            for name, column in vars(self).items():
+                getattr(series, name).extend(column[index])
+            return series
+        return self._row(index, from_epoch(self.timestamp[index]))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DatapointSeries):
+            return NotImplemented
+        # Through the row views so missing values compare equal, NaN != NaN.
+        return list(self) == list(other)
+
+    def __iter__(self) -> Iterator[Datapoint]:
+        for i, timestamp in enumerate(self.datetimes()):
+            yield self._row(i, timestamp)
+
+    def _row(self, i: int, timestamp: datetime) -> Datapoint:
+        return Datapoint(
+            sensor_id=self.sensor_id[i],
+            project_id=self.project_id[i] or None,
+            timestamp=timestamp,
+            angle=self._value(self.angle[i]),
+            temperature=self._value(self.temperature[i]),
+            battery=self._value(self.battery[i]),
+            id=self.id[i] or None,
+        )
+
+    @staticmethod
+    def _value(value: float) -> Optional[float]:
+        return None if math.isnan(value) else value
+
+    def datetimes(self) -> List[datetime]:
+        return decode_timestamps(self.timestamp)
+
+    def span(self) -> Optional[Tuple[datetime, datetime]]:
+        """The first and last timestamps, None if empty."""
+        if not self.timestamp:
+            return None
+        return from_epoch(min(self.timestamp)), from_epoch(max(self.timestamp))
+
+    def as_columns(self, names: Iterable[str] = None) -> Dict[str, List]:
+        """
+        The columns (all of them by default) as lists, for JSON: missing ids and values
+        are None and the timestamps seconds since Epoch.
+        """
+        columns = {}
+        for name in names or vars(self):
+            column = getattr(self, name)
+            values = column.tolist()
+            if column.typecode == 'd':
+                # NaN isn't JSON, the sum is only NaN if there is one.
+                if math.isnan(sum(column)):
+                    values = [self._value(v) for v in values]
+            elif name != 'timestamp' and 0 in column:
+                values = [v or None for v in values]
+            columns[name] = values
+        return columns
+
+    def sensor_ids(self) -> Set[int]:
+        return set(self.sensor_id)
+
+    def project_ids(self) -> Set[int]:
+        return set(self.project_id) - {0}
+
+
+@attr.s
+class Rollup(BaseTable):
+    """
+    Datapoint values aggregated per hour or day.
+    The SensorRollup and ProjectRollup tables are maintained by triggers, see
+    schema._rollup_tables, so the objects are read only.
+    """
+    # Named resolutions and their period in seconds, 'raw' being the Datapoint themselves.
+    periods = {
+        'hour': 3600,
+        'day': 86400,
+    }
+    values = ('angle', 'temperature', 'battery')
+    # The Datapoint columns each rollup table is grouped by, as in schema._rollup_tables.
+    tables = {
+        'SensorRollup': ('sensor_id',),
+        'ProjectRollup': ('project_id', 'sensor_id'),
+    }
+
+    sensor_id = attr.ib(type=int)
+    project_id = attr.ib(type=int)
+    period = attr.ib(type=int)
+    # Start of the bucket.
+    timestamp = attr.ib(type=datetime, metadata={'db_convert': from_epoch})
+    datapoint_count = attr.ib(type=int)
+    angle_min = attr.ib(type=float)
+    angle_max = attr.ib(type=float)
+    angle_mean = attr.ib(type=float)
+    angle_last = attr.ib(type=float)
+    temperature_min = attr.ib(type=float)
+    temperature_max = attr.ib(type=float)
+    temperature_mean = attr.ib(type=float)
+    temperature_last = attr.ib(type=float)
+    battery_min = attr.ib(type=float)
+    battery_max = attr.ib(type=float)
+    battery_mean = attr.ib(type=float)
+    battery_last = attr.ib(type=float)
+
+    @classmethod
+    def get_all(
+        cls,
+        db_conn: SQLConnection,
+        period: int = Required,
+        project_id: int = None,
+        sensor_id: int = None,
+        since: datetime = None,
+        until: datetime = None,
+    ) -> List['Rollup']:
+        """The buckets that overlap since (inclusive) to until (exclusive)."""
+        if period is None:
+            raise ValueError('period is required')
+
+        window = ''
+        params = []
+        if since is not None:
+            # Keep the bucket that since falls into.
+            window += ' and bucket > ?'
+            params.append(to_epoch(since) - period)
+        if until is not None:
+            window += ' and bucket < ?'
+            params.append(to_epoch(until))
+
+        value_fields = ', '.join(
+            f'{v}_min, {v}_max, {v}_sum / datapoint_count as {v}_mean, {v}_last'
+            for v in cls.values
+        )
+        if project_id is not None:
+            cursor = db_conn.execute(
+                f"""
+                select sensor_id, project_id, period, bucket as timestamp, datapoint_count, {value_fields}
+                from ProjectRollup
+                where period = ? and project_id = ?{window}
+                order by bucket, sensor_id;
+                """,
+                (period, project_id, *params),
+            )
+        elif sensor_id is not None:
+            cursor = db_conn.execute(
+                f"""
+                select sensor_id, null as project_id, period, bucket as timestamp, datapoint_count, {value_fields}
+                from SensorRollup
+                where period = ? and sensor_id = ?{window}
+                order by bucket;
+                """,
+                (period, sensor_id, *params),
+            )
+        else:
+            # Needs either a project or a sensor id.
+            raise NotImplementedError()
+        cursor.row_factory = cls.row_factory_for(cursor)
+        return cursor.fetchall()
+
+    @classmethod
+    def drop_buckets(cls, db_conn: SQLConnection, column: str, value: Any) -> Dict[Tuple[str, int], Set[Tuple]]:
+        """
+        Remove the buckets of the datapoints where column = value, for rebuild_buckets()
+        to compute them again once those datapoints are deleted. Without their bucket
+        the delete triggers have nothing to recompute.
+        """
+        buckets = {(table, period): set() for table in cls.tables for period in cls.periods.values()}
+        # One pass on the index rather than a select distinct, which sorts, per period.
+        cursor = db_conn.execute(
+            f'select sensor_id, project_id, timestamp from Datapoint where {column} = ?;',
+            (value,),
+        )
+        for sensor_id, project_id, timestamp in cursor:
+            keys = {'sensor_id': sensor_id, 'project_id': project_id}
+            for (table, period), table_buckets in buckets.items():
+                row = tuple(keys[k] for k in cls.tables[table])
+                if None not in row:
+                    table_buckets.add((*row, timestamp - timestamp % period))
+
+        for (table, period), table_buckets in buckets.items():
+            match = ' and '.join(f'{k} = ?' for k in cls.tables[table])
+            delete = f'delete from {table} where period = {period} and {match} and bucket = ?;'
+            db_conn.executemany(delete, table_buckets)
+        return buckets
+
+    @classmethod
+    def rebuild_buckets(cls, db_conn: SQLConnection, buckets: Dict[Tuple[str, int], Set[Tuple]]):
+        """Compute the buckets from drop_buckets() from the remaining datapoints."""
+        aggregates = ', '.join(f'min({v}), max({v}), sum({v})' for v in cls.values)
+        aggregate_columns = ', '.join(f'{v}_min, {v}_max, {v}_sum' for v in cls.values)
+        last_columns = ', '.join(f'{v}_last' for v in cls.values)
+
+        for (table, period), rows in buckets.items():
+            keys = cls.tables[table]
+            # The keys then the bucket of each row.
+            key_params = ', '.join(f'?{i}' for i in range(1, len(keys) + 1))
+            match = ' and '.join(f'{k} = ?{i}' for i, k in enumerate(keys, 1))
+            bucket = f'?{len(keys) + 1}'
+            in_bucket = f'{match} and timestamp >= {bucket} and timestamp < {bucket} + {period}'
+            db_conn.executemany(
+                f"""
+                insert into {table} (period, {", ".join(keys)}, bucket, datapoint_count, {aggregate_columns})
+                select {period}, {key_params}, {bucket}, count(*), {aggregates}
+                from Datapoint
+                where {in_bucket}
+                having count(*) > 0;
+                """,
+                rows,
+            )
+            db_conn.executemany(
+                f"""
+                update {table} set
+                    (last_timestamp, {last_columns}) = (
+                        select timestamp, {", ".join(cls.values)} from Datapoint
+                        where {in_bucket}
+                        order by timestamp desc limit 1
+                    )
+                where period = {period} and {match} and bucket = {bucket};
+                """,
+                rows,
+            )
+
+    @classmethod
+    def find(cls, db_conn: SQLConnection, **kwargs) -> Optional['Rollup']:
+        raise RuntimeError('Use get_all() instead.')
+
+    @classmethod
+    def create(cls, db_conn: SQLConnection, **kwargs) -> 'Rollup':
+        raise RuntimeError('Rollups are computed from Datapoint.')
+
+    def edit(self, db_conn: SQLConnection, **kwargs):
+        raise RuntimeError('Rollups are computed from Datapoint.')
+
+    def delete(self, db_conn: SQLConnection):
+        raise RuntimeError('Rollups are computed from Datapoint.')
+
+    def as_datapoint(self) -> Datapoint:
+        """Datapoint with the mean values of the bucket, to draw charts."""
+        return Datapoint(
+            sensor_id=self.sensor_id,
+            project_id=self.project_id,
+            timestamp=self.timestamp,
+            angle=self.angle_mean,
+            temperature=self.temperature_mean,
+            battery=self.battery_mean,
+        )
@@ -1,10 +1,12 @@
 from datetime import datetime
 from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
 
 import attr
 from brewmonitor.storage import access, tables
+from brewmonitor.storage.ingest import IngestQueueFull, ingest_queue
 from brewmonitor.utils import json_response
-from flask import Blueprint, current_app, request
+from flask import Blueprint, Response, current_app, g, request
 
 
 storage_bp = Blueprint(
@@ -15,18 +17,50 @@ storage_bp = Blueprint(
 )
 
 
-@storage_bp.route('/sensor/add_data', methods=['POST'])
-def add_data():
+# Found for a (sensor_id, secret): the project to attach to or the error to report.
+SensorCheck = Tuple[Optional[int], HTTPStatus, Optional[str]]
 
-    if request.headers.get('Content-Type') != 'application/json':
-        return json_response({'error': 'Content-Type header must be application/json'})
 
-    json_args = request.get_json()
-    current_app.logger.debug(f'Received json_args={json_args}')
+def _check_sensor(sensor_id: int, secret: str, checked: Dict[Tuple[int, str], SensorCheck]) -> SensorCheck:
+    """Verify the secret of the sensor, only once per sensor for a batch."""
+    key = (sensor_id, secret)
+    if key not in checked:
+        credentials = access.get_sensor_credentials(sensor_id)
+        if credentials is None:
+            checked[key] = (None, HTTPStatus.NOT_FOUND, f'Did not find the sensor {sensor_id!r}')
+        elif not credentials.verify_identity(secret):
+            checked[key] = (None, HTTPStatus.NOT_FOUND, 'Invalid sensor identification')
+        else:
+            checked[key] = (credentials.project_id, HTTPStatus.CREATED, None)
+    return checked[key]
+
+
+def _normalise(d: tables.Datapoint):
+    """
+    Convert the values sent to what is stored, raises if one can't be. They are rejected
+    here rather than failing the insert, which for the ingest queue comes after the
+    response.
+    """
+    d.sensor_id = int(d.sensor_id)
+    d.timestamp = tables.from_epoch(tables.to_epoch(d.timestamp))
+    for name in ('angle', 'temperature', 'battery'):
+        value = getattr(d, name)
+        if value is not None:
+            setattr(d, name, float(value))
 
+
+def _make_datapoint(
+    json_args: Dict,
+    checked: Dict[Tuple[int, str], SensorCheck],
+) -> Tuple[Optional[tables.Datapoint], HTTPStatus, Optional[str]]:
+    """The datapoint to insert for one entry of the request, or its status and error."""
+    if not isinstance(json_args, dict):
+        return None, HTTPStatus.BAD_REQUEST, 'Expected an object'
+
+    json_args = dict(json_args)
     request_secret = json_args.pop('secret', None)
     if request_secret is None:
-        return json_response({'errors': ["Missing mandatory field 'secret'"]}, HTTPStatus.BAD_REQUEST)
+        return None, HTTPStatus.BAD_REQUEST, "Missing mandatory field 'secret'"
 
     if 'timestamp' not in json_args:
         json_args['timestamp'] = datetime.now()
@@ -36,24 +70,92 @@ def add_data():
             project_id=None,  # populated once we got the sensor id
             **json_args,
         )
+        _normalise(d)
     except Exception as e:
-        return json_response({'errors': [f'Failed to construct datapoint: {e}']}, HTTPStatus.BAD_REQUEST)
+        return None, HTTPStatus.BAD_REQUEST, f'Failed to construct datapoint: {e}'
+
+    # Outside the try: the db failing is not the sensor's fault.
+    project_id, status, error = _check_sensor(d.sensor_id, request_secret, checked)
+    if error is not None:
+        return None, status, error
+
+    d.project_id = project_id
+    return d, status, None
 
-    sensor, project = access.get_active_project_for_sensor(d.sensor_id)
-    if sensor is None:
-        return json_response({'errors': [f'Did not find the sensor {d.sensor_id!r}']}, HTTPStatus.NOT_FOUND)
 
-    if not sensor.verify_identity(request_secret):
-        return json_response({'errors': ['Invalid sensor identification']}, HTTPStatus.NOT_FOUND)
+def _insert_datapoints(datapoints: List[tables.Datapoint]) -> Optional[Response]:
+    """None once inserted or queued, else the response to send instead."""
+    queue = ingest_queue()
+    if queue is None:
+        access.insert_datapoints(datapoints)
+        return None
+
+    try:
+        queue.put(datapoints)
+    except IngestQueueFull as e:
+        current_app.logger.warning(f'Rejecting {len(datapoints)} datapoints: {e}')
+        errors = ['Too many datapoints pending, try again later']
+        return json_response({'errors': errors}, HTTPStatus.SERVICE_UNAVAILABLE)
+    return None
 
-    if project is not None:
-        d.project_id = project.id
 
-    access.insert_datapoints([d])
+@storage_bp.route('/sensor/add_data', methods=['POST'])
+def add_data():
+
+    if request.headers.get('Content-Type') != 'application/json':
+        return json_response({'error': 'Content-Type header must be application/json'})
+
+    if ingest_queue() is not None:
+        # The queue inserts the datapoints in its own transactions, we only read.
+        g.db_read_only = True
+
+    json_args = request.get_json()
+    current_app.logger.debug(f'Received json_args={json_args}')
+
+    if isinstance(json_args, list):
+        return _add_many(json_args)
+
+    d, status, error = _make_datapoint(json_args, {})
+    if d is None:
+        return json_response({'errors': [error]}, status)
+
+    response = _insert_datapoints([d])
+    if response is not None:
+        return response
 
     return json_response(
         {'created': [attr.asdict(d)]},
         headers=[
-            ('project_id', project.id if project else None),
+            ('project_id', d.project_id),
         ],
     )
+
+
+def _add_many(entries: List) -> Response:
+    """
+    A batch of entries, from one or more sensors, inserted in the transaction of the
+    request. Each entry gets its own status, the invalid ones don't stop the others.
+    """
+    if not entries:
+        return json_response({'errors': ['Expected at least one entry']}, HTTPStatus.BAD_REQUEST)
+
+    checked = {}
+    datapoints = []
+    results = []
+    for entry in entries:
+        d, status, error = _make_datapoint(entry, checked)
+        if d is None:
+            results.append({'status': status, 'errors': [error]})
+        else:
+            datapoints.append(d)
+            results.append({'status': status, 'created': attr.asdict(d)})
+
+    if datapoints:
+        response = _insert_datapoints(datapoints)
+        if response is not None:
+            return response
+
+    return json_response({
+        'created': [attr.asdict(d) for d in datapoints],
+        'results': results,
+    })
@@ -1,11 +1,14 @@
+import csv
+import hashlib
+import io
+import itertools
 from http import HTTPStatus
-from typing import Any, Iterable, List, Optional, Tuple
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Type
 
 import attr
-from brewmonitor import json
-from brewmonitor.storage.tables import Datapoint
-from flask import Response
-from flask_csv import send_csv
+from brewmonitor import json, serialize
+from flask import Response, request
+from werkzeug.http import is_resource_modified
 
 
 def json_response(
@@ -23,26 +26,100 @@ def json_response(
     return response
 
 
-def make_csv(data: List[attr.s], filename: str) -> Response:
+def etag_for(*parts: Any) -> str:
+    """Strong ETag made of the parts, they have to change whenever the content does."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
 
-    headers = set()
-    entries = []
-    for d in data:
-        headers.update(attr.fields_dict(d.__class__).keys())
-        # This will not work too well for objects that include other attr.s objects.
-        entries.append(attr.asdict(d))
 
-    return send_csv(entries, filename, headers)
+def not_modified(etag: str) -> Optional[Response]:
+    """A 304 response when If-None-Match has that version already, None otherwise."""
+    if is_resource_modified(request.environ, etag=etag):
+        return None
+    return with_etag(Response(status=HTTPStatus.NOT_MODIFIED), etag)
 
 
-def export_data(filename: str, _format: str, data: List[Datapoint]) -> Response:
+def with_etag(response: Response, etag: str) -> Response:
+    """Set the ETag, the clients have to check it before using their copy."""
+    if response.status_code not in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+        # E.g. the 400 of stream_export, it doesn't stand for the resource.
+        return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Formats of the exports, and their mimetype.
+export_formats = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+# Rows written per chunk of a streamed export.
+export_chunk_size = 500
+
+
+def _chunks(lines: Iterable[str]) -> Iterator[str]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= export_chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _csv_lines(data: Iterable[attr.s], fields: List[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([fields], ([getattr(d, f) for f in fields] for d in data)):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _batches(data: Iterable[attr.s]) -> Iterator[List[attr.s]]:
+    data = iter(data)
+    batch = list(itertools.islice(data, export_chunk_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(data, export_chunk_size))
+
+
+def _json_lines(data: Iterable[attr.s], cls: Type) -> Iterator[str]:
+    # Same output as json.dumps() of the whole list.
+    yield '['
+    separator = ''
+    for batch in _batches(data):
+        for line in serialize.encode_objects(batch, cls):
+            yield separator + line
+            separator = ', '
+    yield ']'
+
+
+def _ndjson_lines(data: Iterable[attr.s], cls: Type) -> Iterator[str]:
+    for batch in _batches(data):
+        for line in serialize.encode_objects(batch, cls):
+            yield line + '\n'
+
 
-    if _format == 'json':
-        output = [attr.asdict(d) for d in data]
-        return json_response(output, headers=(
-            ('Content-Disposition', f'attachment; filename={filename}'),
-        ))
-    elif _format == 'csv':
-        return make_csv(data, filename)
+def stream_export(filename: str, _format: str, data: Iterable[attr.s], cls: Type) -> Response:
+    """
+    Export data, objects of the attr.s class cls, as a streamed response. The data is
+    only iterated while the response is sent so it can be a generator over the db.
+    """
+    if _format == 'csv':
+        lines = _csv_lines(data, [f.name for f in attr.fields(cls)])
+    elif _format == 'json':
+        lines = _json_lines(data, cls)
+    elif _format == 'ndjson':
+        lines = _ndjson_lines(data, cls)
+    else:
+        return Response('Invalid format', HTTPStatus.BAD_REQUEST)
 
-    return Response('Invalid format', HTTPStatus.BAD_REQUEST)
+    return Response(
+        _chunks(lines),
+        mimetype=export_formats[_format],
+        headers=[('Content-Disposition', f'attachment; filename={filename}')],
+    )
@@ -1,5 +1,7 @@
-from brewmonitor.configuration import config
-from brewmonitor.storage.tables import User
+from http import HTTPStatus
+
+from brewmonitor.storage import access
+from brewmonitor.storage.passwords import PasswordHasherBusy
 from flask import Blueprint, current_app, redirect, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from flask_mako import render_template
@@ -33,12 +35,17 @@ def check_login():
     password = request.form.get('password')
     remember = request.form.get('remember') is not None  # only has a value if ticked
 
-    with config().db_connection() as db_conn:
-        user = User.verify(db_conn, username, password)
-        if user is not None:
-            current_app.logger.info(f'User {user.username} is logging in.')
-            login_user(user, remember=remember)
-            return redirect(url_for('home.index'))
+    try:
+        user = access.verify_user(username, password)
+    except PasswordHasherBusy:
+        current_app.logger.warning('Too many logins at once, rejecting one.')
+        page = render_template('login.html.mako', error='Too many logins, try again later')
+        return page, HTTPStatus.SERVICE_UNAVAILABLE
+
+    if user is not None:
+        current_app.logger.info(f'User {user.username} is logging in.')
+        login_user(user, remember=remember)
+        return redirect(url_for('home.index'))
 
     return render_template('login.html.mako', error='Wrong credentials')
 
@@ -0,0 +1,242 @@
+import heapq
+import itertools
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from operator import attrgetter
+from typing import Iterator, List, Optional, Tuple
+
+import attr
+from brewmonitor.configuration import Configuration, SQLConnection
+from brewmonitor.schema import initialise_db
+from brewmonitor.storage.tables import Datapoint, Project, Sensor, User
+
+
+@attr.s
+class Brew:
+    """A project fermenting with one sensor between start and end."""
+    project_id = attr.ib(type=int)
+    start = attr.ib(type=datetime)
+    end = attr.ib(type=datetime)
+    # Specific gravity, attenuated with a logistic curve.
+    original_gravity = attr.ib(type=float)
+    final_gravity = attr.ib(type=float)
+    # Hours after start.
+    lag = attr.ib(type=float)
+    half_life = attr.ib(type=float)
+    set_point = attr.ib(type=float)
+
+    def gravity(self, hours: float) -> float:
+        done = 1 / (1 + math.exp(-(hours - self.lag - self.half_life) / (self.half_life / 4)))
+        return self.original_gravity - (self.original_gravity - self.final_gravity) * done
+
+    def temperature(self, hours: float) -> float:
+        # The yeast warms the wort up while it's most active.
+        activity = math.exp(-((hours - self.lag - self.half_life) / self.half_life) ** 2)
+        return self.set_point + 2.5 * activity
+
+
+def _angle(gravity: float) -> float:
+    # Roughly how an iSpindel tilts in the wort.
+    return 25 + (gravity - 1) * 600
+
+
+def plan_brews(
+    rng: random.Random,
+    project_ids: List[int],
+    start: datetime,
+    end: datetime,
+) -> List[Brew]:
+    """Consecutive brews of one sensor, with the sensor left unattached in between."""
+    if not project_ids:
+        return []
+
+    slot = (end - start) / len(project_ids)
+    brews = []
+    for i, project_id in enumerate(project_ids):
+        # Cleaned and put in the next brew some time after the previous one.
+        brew_start = start + slot * i + slot * rng.uniform(0, 0.15)
+        original_gravity = rng.uniform(1.040, 1.075)
+        brews.append(Brew(
+            project_id=project_id,
+            start=brew_start,
+            end=start + slot * (i + 1) if i + 1 < len(project_ids) else end,
+            original_gravity=original_gravity,
+            final_gravity=original_gravity - (original_gravity - 1) * rng.uniform(0.68, 0.82),
+            lag=rng.uniform(6, 24),
+            half_life=rng.uniform(24, 72),
+            set_point=rng.uniform(17, 21),
+        ))
+    return brews
+
+
+def sensor_datapoints(
+    rng: random.Random,
+    sensor_id: int,
+    brews: List[Brew],
+    start: datetime,
+    end: datetime,
+    interval: timedelta,
+    gap_rate: float,
+) -> Iterator[Datapoint]:
+    """
+    What the sensor sends every interval between start and end, with the project of the
+    brew it's in if any. gap_rate is the chance of the sensor going offline for a while at
+    each datapoint.
+    """
+    step = interval.total_seconds()
+    count = int((end - start) / interval)
+    brews = iter(brews)
+    brew = next(brews, None)
+    battery = rng.uniform(3.9, 4.2)
+    # Per datapoint, recharged when a new brew starts.
+    drain = 0.8 / max(count, 1) * rng.uniform(0.5, 1.5)
+
+    i = 0
+    while i < count:
+        if rng.random() < gap_rate:
+            # From a few minutes to half a day without datapoints.
+            i += max(1, int(rng.expovariate(1 / 3600) / step))
+            continue
+
+        when = start + interval * i
+        i += 1
+        while brew is not None and when >= brew.end:
+            brew = next(brews, None)
+            battery = rng.uniform(3.9, 4.2)
+        battery -= drain
+
+        if brew is not None and when >= brew.start:
+            hours = (when - brew.start).total_seconds() / 3600
+            gravity = brew.gravity(hours)
+            yield Datapoint(
+                sensor_id,
+                brew.project_id,
+                when,
+                round(_angle(gravity) + rng.gauss(0, 0.3), 2),
+                round(brew.temperature(hours) + rng.gauss(0, 0.15), 2),
+                round(battery, 3),
+            )
+        else:
+            # Out of the wort, on the bench.
+            yield Datapoint(
+                sensor_id,
+                None,
+                when,
+                round(rng.uniform(80, 90), 2),
+                round(21 + rng.gauss(0, 0.5), 2),
+                round(battery, 3),
+            )
+
+
+def insert_chunked(conn: SQLConnection, datapoints: Iterator[Datapoint], chunk_size: int) -> int:
+    """Insert with Datapoint.create_many and one commit per chunk_size datapoints."""
+    total = 0
+    began = time.perf_counter()
+    while True:
+        chunk = list(itertools.islice(datapoints, chunk_size))
+        if not chunk:
+            return total
+        Datapoint.create_many(conn, chunk)
+        conn.commit()
+        total += len(chunk)
+        print(f'{total} datapoints, {total / (time.perf_counter() - began):.0f}/s')
+
+
+def make_synthetic_data(
+    config: Configuration,
+    admin_pwd: str,
+    users: int = 2,
+    sensors: int = 3,
+    projects: int = 6,
+    days: float = 30,
+    interval: timedelta = timedelta(minutes=15),
+    gap_rate: float = 0.001,
+    chunk_size: int = 100000,
+    when: Optional[datetime] = None,
+    seed: Optional[int] = None,
+) -> Tuple[int, int]:
+    """
+    Like make_dummy_data but with as many users, sensors, projects and days of history
+    as needed. The projects are brewed one after the other by the sensors, each project
+    gets its own fermentation curve and the last one of each sensor is still attached to
+    it. Returns how many datapoints were made and the seed used.
+    """
+    if users < 1:
+        raise ValueError('At least the admin user is needed.')
+    if when is None:
+        when = datetime.now().replace(microsecond=0)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = random.Random(seed)
+    start = when - timedelta(days=days)
+
+    initialise_db(config)
+
+    conn = config.db_connection()
+    print(f'Creating {users} users, {sensors} sensors and {projects} projects (seed={seed})...')
+    all_users = [User.create(conn, 'toto', admin_pwd, True)]
+    all_users += [User.create(conn, f'user {i}', 'pass', False) for i in range(1, users)]
+    all_sensors = [
+        Sensor.create(conn, f'sensor {i}', 'secret', all_users[i % users])
+        for i in range(sensors)
+    ]
+    all_projects = [
+        Project.create(conn, f'Brew #{i}', all_users[i % users])
+        for i in range(projects)
+    ]
+
+    datapoints = []
+    for i, sensor in enumerate(all_sensors):
+        sensor_projects = all_projects[i::sensors]
+        brews = plan_brews(rng, [p.id for p in sensor_projects], start, when)
+        if sensor_projects:
+            # Still fermenting.
+            sensor_projects[-1].attach_sensor(conn, sensor.id)
+        datapoints.append(sensor_datapoints(rng, sensor.id, brews, start, when, interval, gap_rate))
+    conn.commit()
+
+    print('Creating datapoints...')
+    # In the order the sensors would have sent them.
+    total = insert_chunked(conn, heapq.merge(*datapoints, key=attrgetter('timestamp')), chunk_size)
+    return total, seed
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Fill the db with generated fermentations.')
+    parser.add_argument('--admin-password', type=str, default='admin')
+    parser.add_argument('--clear', action='store_true', help='First clear the data')
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--sensors', type=int, default=3)
+    parser.add_argument('--projects', type=int, default=6)
+    parser.add_argument('--days', type=float, default=30, help='Days of history')
+    parser.add_argument('--interval', type=float, default=15, help='Minutes between the datapoints of a sensor')
+    parser.add_argument('--gap-rate', type=float, default=0.001, help='Chance of a sensor going offline')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Datapoints per transaction')
+    parser.add_argument('--seed', type=int, default=None)
+
+    args = parser.parse_args()
+
+    cfg_file = os.environ.get('BREWMONITOR_CONFIG', './debug_config.yaml')
+    cfg = Configuration.load(cfg_file)
+
+    if args.clear:
+        print(f'Clearing content from {cfg.sqlite_file}')
+        open(cfg.sqlite_file, 'w').close()
+
+    make_synthetic_data(
+        cfg,
+        args.admin_password,
+        users=args.users,
+        sensors=args.sensors,
+        projects=args.projects,
+        days=args.days,
+        interval=timedelta(minutes=args.interval),
+        gap_rate=args.gap_rate,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+    )
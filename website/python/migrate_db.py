@@ -0,0 +1,36 @@
+import os
+
+from brewmonitor.configuration import Configuration
+from brewmonitor.schema import migrations
+from brewmonitor.storage.migrations import apply_migrations, current_version, latest_version
+
+
+def migrate_db(config: Configuration, dry_run: bool = False) -> int:
+    """Apply (or only show with dry_run) the pending migrations, returns the version."""
+    if config.sqlite_file:
+        open(config.sqlite_file, 'a+').close()  # Ensure the file exists
+
+    with config.db_connection() as conn:
+        version = current_version(conn)
+        print(f'Database {config.sqlite_file} is at version {version}/{latest_version(migrations)}')
+
+        for migration, statements in apply_migrations(conn, migrations, dry_run=dry_run):
+            print(f'{"Would apply" if dry_run else "Applied"} {migration.version}: {migration.description}')
+            for statement in statements:
+                print(f'    {" ".join(statement.split())}')
+            if not dry_run:
+                version = migration.version
+
+    return version
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true', help='Show the pending migrations without applying them')
+
+    args = parser.parse_args()
+
+    cfg_file = os.environ.get('BREWMONITOR_CONFIG', './debug_config.yaml')
+    migrate_db(Configuration.load(cfg_file), dry_run=args.dry_run)
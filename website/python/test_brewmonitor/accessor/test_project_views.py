@@ -1,7 +1,10 @@
+from datetime import datetime
 from http import HTTPStatus
 
 import pytest
-from brewmonitor.storage.tables import Project, Sensor
+from brewmonitor.storage import access
+from brewmonitor.storage.cache import sensor_cache
+from brewmonitor.storage.tables import Datapoint, Project, Sensor
 from flask import url_for
 from test_brewmonitor.utils import MultiClientBase, config_from_client, find_project
 
@@ -30,6 +33,22 @@ class TestGetProjectOk(MultiClientBase):
         assert resp.status_code == HTTPStatus.OK
 
 
+class TestGetProjectManagement:
+    def test_sensor_labels(self, user_client):
+        bm_config = config_from_client(user_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Sad project')  # sensor not attached
+            sensors = Sensor.get_all(conn)
+
+        resp = user_client.get(url_for('accessor.get_project', project_id=project.id))
+        assert resp.status_code == HTTPStatus.OK
+
+        page = resp.get_data(as_text=True)
+        assert 'Move green sensor from Brown Ale #12' in page
+        for sensor in sensors:
+            assert f'<option value="{sensor.id}">' in page
+
+
 class TestGetProjectNotFound(MultiClientBase):
     def _check_view(self, client):
         resp = client.get(url_for('accessor.get_project', project_id=42))
@@ -37,7 +56,7 @@ class TestGetProjectNotFound(MultiClientBase):
 
 
 class TestGetProjectDataOk(MultiClientBase):
-    supported_formats = ('csv', 'json')
+    supported_formats = ('csv', 'json', 'ndjson')
 
     def _check_view(self, client):
         bm_config = config_from_client(client.application)
@@ -47,6 +66,7 @@ class TestGetProjectDataOk(MultiClientBase):
         for fmt in self.supported_formats:
             resp = client.get(url_for('accessor.get_project_data', project_id=project_a.id, out_format=fmt))
             assert resp.status_code == HTTPStatus.OK
+            assert resp.is_streamed
 
 
 class TestGetProjectDataNotFound(MultiClientBase):
@@ -65,6 +85,400 @@ class TestGetProjectDataBadRequest(MultiClientBase):
         assert resp.status_code == HTTPStatus.BAD_REQUEST
 
 
+class TestGetProjectResolution:
+    @pytest.mark.parametrize('resolution', ('raw', 'hour', 'day'))
+    def test_resolution(self, public_client, resolution):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=project.id, resolution=resolution))
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data']
+
+        resp = public_client.get(
+            url_for('accessor.get_project_data', project_id=project.id, out_format='json', resolution=resolution),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        if resolution == 'raw':
+            assert 'angle' in resp.json[0]
+        else:
+            assert {'angle_min', 'angle_max', 'angle_mean', 'angle_last'} <= resp.json[0].keys()
+            assert f'_{resolution}.json' in resp.headers['Content-Disposition']
+
+    def test_invalid_resolution(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=project.id, resolution='week'))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+        resp = public_client.get(
+            url_for('accessor.get_project_data', project_id=project.id, out_format='csv', resolution='week'),
+        )
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestGetProjectWindow:
+    def test_window(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        resp = public_client.get(url_for('accessor.get_project', project_id=project.id, limit=2, resolution='day'))
+        assert resp.status_code == HTTPStatus.OK
+        assert 'limit=2' in resp.get_data(as_text=True), 'export links should keep the window'
+
+        resp = public_client.get(url_for('accessor.get_project_data', project_id=project.id, out_format='json'))
+        everything = resp.json
+
+        resp = public_client.get(
+            url_for('accessor.get_project_data', project_id=project.id, out_format='json', limit=2),
+        )
+        assert resp.json == everything[-2:]
+
+        resp = public_client.get(
+            url_for('accessor.get_project_data', project_id=project.id, out_format='json', after_id=0, limit=2),
+        )
+        assert resp.json == everything[:2]
+
+        resp = public_client.get(
+            url_for(
+                'accessor.get_project_data',
+                project_id=project.id,
+                out_format='json',
+                since=everything[1]['timestamp'],
+                until=everything[-1]['timestamp'],
+            ),
+        )
+        assert resp.json == everything[1:-1]
+
+    @pytest.mark.parametrize('endpoint, kw', (
+        ('accessor.get_project', {}),
+        ('accessor.get_project_plot', {}),
+        ('accessor.get_project_data', {'out_format': 'csv'}),
+    ))
+    def test_invalid_window(self, public_client, endpoint, kw):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        resp = public_client.get(url_for(endpoint, project_id=project.id, limit='all', **kw))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.parametrize('window', (
+        {'since': '99999999999999999999'},
+        {'until': '-99999999999999999999'},
+        {'limit': str(2 ** 63)},
+        {'after_id': str(2 ** 64)},
+    ))
+    def test_window_out_of_range(self, public_client, window):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        # Checked before the export starts streaming.
+        resp = public_client.get(
+            url_for('accessor.get_project_data', project_id=project.id, out_format='ndjson', **window),
+        )
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestGetProjectPlot:
+    def test_plot_url_in_view(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        resp = public_client.get(url_for('accessor.get_project', project_id=project.id, limit=2))
+        assert resp.status_code == HTTPStatus.OK
+        page = resp.get_data(as_text=True)
+        assert url_for('accessor.get_project_plot', project_id=project.id, payload='compact', limit=2) in page
+        assert 'Plotly.newPlot' in page
+
+    def test_conditional_get(self, public_client, other_project, other_sensor):
+        def _datapoint(minute):
+            return Datapoint(other_sensor.id, other_project.id, datetime(2021, 11, 30, 10, minute), 30.0, 20.5, 4.0)
+
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [_datapoint(0), _datapoint(1)])
+
+        url = url_for('accessor.get_project_plot', project_id=other_project.id)
+        resp = public_client.get(url)
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.headers['Cache-Control'] == 'no-cache'
+        assert len(resp.json['data'][0]['x']) == 2
+        etag = resp.headers['ETag']
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.NOT_MODIFIED
+        assert resp.headers['ETag'] == etag
+        assert not resp.get_data()
+
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=other_project.id, limit=1))
+        assert resp.headers['ETag'] != etag, 'other parameters, other plot'
+
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [_datapoint(2)])
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.headers['ETag'] != etag
+        assert len(resp.json['data'][0]['x']) == 3
+
+    @pytest.mark.parametrize('resolution, reads_datapoints', (('raw', True), ('hour', False), ('day', False)))
+    def test_reads_datapoints_only_raw(self, public_client, monkeypatch, resolution, reads_datapoints):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        calls = []
+        get_series = Datapoint.get_series
+
+        def _counting(*args, **kwargs):
+            calls.append(args)
+            return get_series(*args, **kwargs)
+
+        monkeypatch.setattr(Datapoint, 'get_series', _counting)
+
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=project.id, resolution=resolution))
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data'][0]['x']
+        assert bool(calls) == reads_datapoints
+
+    def test_etag_sensor_renamed(self, public_client, other_project, other_sensor):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [
+                Datapoint(other_sensor.id, other_project.id, datetime(2021, 11, 30, 10), 30.0, 20.5, 4.0),
+            ])
+
+        url = url_for('accessor.get_project_plot', project_id=other_project.id)
+        resp = public_client.get(url)
+        etag = resp.headers['ETag']
+        assert resp.json['data'][0]['name'] == 'sensor temperature'
+
+        with bm_config.db_connection() as conn:
+            other_sensor.edit(conn, name='renamed')
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data'][0]['name'] == 'renamed temperature'
+
+    def test_empty(self, public_client, other_project):
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=other_project.id))
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data'] == []
+
+    def test_not_found(self, public_client):
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=42))
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
+class TestGetProjectConditional:
+    @pytest.mark.parametrize('endpoint, kw', (
+        ('accessor.get_project', {}),
+        ('accessor.get_project_data', {'out_format': 'csv'}),
+        ('accessor.get_project_data', {'out_format': 'json', 'resolution': 'hour'}),
+    ))
+    def test_if_none_match(self, public_client, other_project, other_sensor, endpoint, kw):
+        def _add_datapoint(minute):
+            with bm_config.db_connection() as conn:
+                Datapoint.create_many(conn, [
+                    Datapoint(other_sensor.id, other_project.id, datetime(2021, 11, 30, 10, minute), 30.0, 20.5, 4.0),
+                ])
+
+        bm_config = config_from_client(public_client.application)
+        _add_datapoint(0)
+
+        url = url_for(endpoint, project_id=other_project.id, **kw)
+        resp = public_client.get(url)
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.headers['Cache-Control'] == 'no-cache'
+        etag = resp.headers['ETag']
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.NOT_MODIFIED
+        assert not resp.get_data()
+
+        _add_datapoint(1)
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.headers['ETag'] != etag
+
+    def test_no_last_modified(self, public_client, other_project, other_sensor):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [
+                Datapoint(other_sensor.id, other_project.id, datetime(2021, 11, 30, 10, 0), 30.0, 20.5, 4.0),
+            ])
+
+        url = url_for('accessor.get_project_data', project_id=other_project.id, out_format='ndjson')
+        resp = public_client.get(url)
+        assert 'Last-Modified' not in resp.headers
+
+        # An older datapoint doesn't move the newest one, only the ETag tells it changed.
+        older = Datapoint(other_sensor.id, other_project.id, datetime(2021, 11, 29, 10, 0), 30.0, 20.5, 4.0)
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [older])
+        resp = public_client.get(url, headers={'If-Modified-Since': 'Tue, 30 Nov 2021 10:00:00 GMT'})
+        assert resp.status_code == HTTPStatus.OK
+
+    def test_view_depends_on_user(self, public_client, user_client):
+        url = url_for('accessor.get_project', project_id=1)
+        public_etag = public_client.get(url).headers['ETag']
+
+        resp = user_client.get(url, headers={'If-None-Match': public_etag})
+        assert resp.status_code == HTTPStatus.OK, 'the page has more for logged in users'
+
+    def test_view_depends_on_names(self, public_client, other_project, admin_user):
+        bm_config = config_from_client(public_client.application)
+        url = url_for('accessor.get_project', project_id=other_project.id)
+        etag = public_client.get(url).headers['ETag']
+
+        with bm_config.db_connection() as conn:
+            other_project.edit(conn, 'renamed beer', admin_user)
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK
+        assert 'renamed beer' in resp.get_data(as_text=True)
+
+    def test_view_etag_cheap(self, public_client, monkeypatch):
+        url = url_for('accessor.get_project', project_id=1)
+        etag = public_client.get(url).headers['ETag']
+
+        def _fail():
+            raise AssertionError('should not read every sensor and project')
+
+        monkeypatch.setattr(access, 'get_sensors', _fail)
+        monkeypatch.setattr(access, 'get_projects', _fail)
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.NOT_MODIFIED
+
+    def test_view_depends_on_sensors(self, public_client, other_project, other_sensor):
+        bm_config = config_from_client(public_client.application)
+        url = url_for('accessor.get_project', project_id=other_project.id)
+        etag = public_client.get(url).headers['ETag']
+
+        with bm_config.db_connection() as conn:
+            other_sensor.edit(conn, name='renamed sensor')
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK, 'can be attached, so it is listed'
+        etag = resp.headers['ETag']
+
+        with bm_config.db_connection() as conn:
+            other_project.attach_sensor(conn, other_sensor.id)
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.OK
+        assert 'renamed sensor' in resp.get_data(as_text=True)
+
+
+class TestGetProjectDatatable:
+    @classmethod
+    def _project(cls, client):
+        bm_config = config_from_client(client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+            datapoints = Datapoint.get_all(conn, project_id=project.id)
+        return project, datapoints
+
+    def test_first_page_in_view(self, public_client):
+        project, datapoints = self._project(public_client)
+
+        resp = public_client.get(url_for('accessor.get_project', project_id=project.id))
+        assert resp.status_code == HTTPStatus.OK
+        page = resp.get_data(as_text=True)
+        assert url_for('accessor.get_project_datatable', project_id=project.id) in page
+        assert f'"recordsTotal": {len(datapoints)}' in page
+
+    def test_pages(self, public_client):
+        project, datapoints = self._project(public_client)
+        assert len(datapoints) > 2
+
+        resp = public_client.get(
+            url_for('accessor.get_project_datatable', project_id=project.id, draw=3, start=1, length=2),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['draw'] == 3
+        assert resp.json['recordsTotal'] == resp.json['recordsFiltered'] == len(datapoints)
+        newest_first = datapoints[::-1]
+        assert [row['when']['label'] for row in resp.json['data']] == [
+            d.timestamp_as_str() for d in newest_first[1:3]
+        ]
+
+        resp = public_client.get(
+            url_for('accessor.get_project_datatable', project_id=project.id, length=-1, **{'order[0][dir]': 'asc'}),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert [row['when']['label'] for row in resp.json['data']] == [d.timestamp_as_str() for d in datapoints]
+
+    @pytest.mark.parametrize('window, expected', (
+        ({'limit': 2}, slice(-2, None)),
+        ({'after_id': 0, 'limit': 2}, slice(0, 2)),
+    ))
+    def test_window(self, public_client, window, expected):
+        # Same datapoints as the chart.
+        project, datapoints = self._project(public_client)
+        assert len(datapoints) > 2
+
+        resp = public_client.get(url_for(
+            'accessor.get_project_datatable',
+            project_id=project.id,
+            length=-1,
+            **{'order[0][dir]': 'asc'},
+            **window,
+        ))
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['recordsTotal'] == 2
+        assert [row['when']['label'] for row in resp.json['data']] == [
+            d.timestamp_as_str() for d in datapoints[expected]
+        ]
+
+    def test_compact(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            project = find_project(conn, 'Brown Ale #12')
+
+        rows = public_client.get(url_for('accessor.get_project_datatable', project_id=project.id, length=3)).json
+        resp = public_client.get(
+            url_for('accessor.get_project_datatable', project_id=project.id, length=3, payload='compact'),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert 'data' not in resp.json
+        assert resp.json['recordsTotal'] == rows['recordsTotal']
+        columns = resp.json['columns']
+        assert [Datapoint.format_angle(v) for v in columns['angle']] == [r['angle'] for r in rows['data']]
+        assert columns['timestamp'] == [r['when']['timestamp'] for r in rows['data']]
+
+        resp = public_client.get(url_for('accessor.get_project_plot', project_id=project.id, payload='compact'))
+        assert resp.status_code == HTTPStatus.OK
+        assert all(isinstance(x, int) for x in resp.json['data'][0]['x'])
+
+    @pytest.mark.parametrize('args', (
+        {'start': -1},
+        {'start': 2 ** 63},
+        {'length': 0},
+        {'draw': 'x'},
+        {'order[0][dir]': 'sideways'},
+        {'since': 'yesterday'},
+        {'payload': 'xml'},
+    ))
+    def test_invalid(self, public_client, args):
+        project, _ = self._project(public_client)
+
+        resp = public_client.get(url_for('accessor.get_project_datatable', project_id=project.id, **args))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_not_found(self, public_client):
+        resp = public_client.get(url_for('accessor.get_project_datatable', project_id=42))
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
 class TestAddProject:
 
     def test_public_redirect(self, public_client):
@@ -168,6 +582,21 @@ class TestChangeProjectSensor:
 
         assert resp.location == redirect
 
+    def test_sensor_cache_invalidated(self, user_client, other_project, other_sensor):
+        bm_config = config_from_client(user_client.application)
+        with bm_config.db_connection() as conn:
+            # What add_data cached before the sensor was moved.
+            sensor_cache.set(other_sensor.id, Sensor.credentials(conn, other_sensor.id))
+        assert sensor_cache.get(other_sensor.id).project_id is None
+
+        target = url_for('accessor.change_project_sensor', project_id=other_project.id)
+        resp = user_client.post(target, data={'sensor_id': str(other_sensor.id)})
+        assert resp.status_code == HTTPStatus.FOUND
+        # The client keeps the request context until the next one, ending the session.
+        user_client.get(resp.location)
+
+        assert sensor_cache.get(other_sensor.id) is None
+
     @pytest.mark.parametrize('send_null', (True, False))
     @pytest.mark.parametrize('to_sensor', (True, False))
     def test_user_detach_sensor(self, user_client, normal_user, other_project, other_sensor, send_null, to_sensor):
@@ -1,5 +1,7 @@
 from http import HTTPStatus
 
+import pytest
+from brewmonitor.storage.tables import Datapoint
 from flask import url_for
 from test_brewmonitor.utils import MultiClientBase, config_from_client, find_sensor
 
@@ -35,7 +37,7 @@ class TestGetSensorNotFound(MultiClientBase):
 
 
 class TestGetSensorDataOk(MultiClientBase):
-    supported_formats = ('csv', 'json')
+    supported_formats = ('csv', 'json', 'ndjson')
 
     def _check_view(self, client):
         bm_config = config_from_client(client.application)
@@ -45,6 +47,7 @@ class TestGetSensorDataOk(MultiClientBase):
         for fmt in self.supported_formats:
             resp = client.get(url_for('accessor.get_sensor_data', sensor_id=linked_sensor.id, out_format=fmt))
             assert resp.status_code == HTTPStatus.OK
+            assert resp.is_streamed
 
 
 class TestGetSensorDataNotFound(MultiClientBase):
@@ -63,6 +66,211 @@ class TestGetSensorDataBadRequest(MultiClientBase):
         assert resp.status_code == HTTPStatus.BAD_REQUEST
 
 
+class TestGetSensorResolution:
+    @pytest.mark.parametrize('resolution', ('raw', 'hour', 'day'))
+    def test_resolution(self, public_client, resolution):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        resp = public_client.get(url_for('accessor.get_sensor_plot', sensor_id=sensor.id, resolution=resolution))
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data']
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format='json', resolution=resolution),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        if resolution == 'raw':
+            assert 'angle' in resp.json[0]
+        else:
+            assert {'angle_min', 'angle_max', 'angle_mean', 'angle_last'} <= resp.json[0].keys()
+            assert f'_{resolution}.json' in resp.headers['Content-Disposition']
+
+    def test_invalid_resolution(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        resp = public_client.get(url_for('accessor.get_sensor_plot', sensor_id=sensor.id, resolution='week'))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format='csv', resolution='week'),
+        )
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestGetSensorWindow:
+    def test_window(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        resp = public_client.get(url_for('accessor.get_sensor', sensor_id=sensor.id, limit=2, resolution='day'))
+        assert resp.status_code == HTTPStatus.OK
+        assert 'limit=2' in resp.get_data(as_text=True), 'export links should keep the window'
+
+        resp = public_client.get(url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format='json'))
+        everything = resp.json
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format='json', limit=2),
+        )
+        assert resp.json == everything[-2:]
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_data', sensor_id=sensor.id, out_format='json', after_id=0, limit=2),
+        )
+        assert resp.json == everything[:2]
+
+        resp = public_client.get(
+            url_for(
+                'accessor.get_sensor_data',
+                sensor_id=sensor.id,
+                out_format='json',
+                since=everything[1]['timestamp'],
+                until=everything[-1]['timestamp'],
+            ),
+        )
+        assert resp.json == everything[1:-1]
+
+    @pytest.mark.parametrize('endpoint, kw', (
+        ('accessor.get_sensor', {}),
+        ('accessor.get_sensor_plot', {}),
+        ('accessor.get_sensor_data', {'out_format': 'csv'}),
+    ))
+    def test_invalid_window(self, public_client, endpoint, kw):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        resp = public_client.get(url_for(endpoint, sensor_id=sensor.id, limit='all', **kw))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestGetSensorPlot:
+    def test_conditional_get(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        resp = public_client.get(url_for('accessor.get_sensor', sensor_id=sensor.id))
+        assert url_for('accessor.get_sensor_plot', sensor_id=sensor.id) in resp.get_data(as_text=True)
+
+        url = url_for('accessor.get_sensor_plot', sensor_id=sensor.id)
+        resp = public_client.get(url)
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['data']
+        assert resp.json['layout']
+
+        resp = public_client.get(url, headers={'If-None-Match': resp.headers['ETag']})
+        assert resp.status_code == HTTPStatus.NOT_MODIFIED
+
+    def test_not_found(self, public_client):
+        resp = public_client.get(url_for('accessor.get_sensor_plot', sensor_id=42))
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
+class TestGetSensorConditional:
+    @pytest.mark.parametrize('endpoint, kw', (
+        ('accessor.get_sensor', {}),
+        ('accessor.get_sensor_data', {'out_format': 'json'}),
+    ))
+    def test_if_none_match(self, public_client, endpoint, kw):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        url = url_for(endpoint, sensor_id=sensor.id, **kw)
+        etag = public_client.get(url).headers['ETag']
+
+        resp = public_client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == HTTPStatus.NOT_MODIFIED
+
+    def test_not_found(self, public_client):
+        resp = public_client.get(url_for('accessor.get_sensor_data', sensor_id=42, out_format='csv'))
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
+class TestGetSensorDatatable:
+    @classmethod
+    def _sensor(cls, client):
+        bm_config = config_from_client(client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'green sensor')
+            datapoints = Datapoint.get_all(conn, sensor_id=sensor.id)
+        return sensor, datapoints
+
+    def test_first_page_in_view(self, public_client):
+        sensor, datapoints = self._sensor(public_client)
+
+        resp = public_client.get(url_for('accessor.get_sensor', sensor_id=sensor.id))
+        assert resp.status_code == HTTPStatus.OK
+        page = resp.get_data(as_text=True)
+        assert url_for('accessor.get_sensor_datatable', sensor_id=sensor.id) in page
+        assert f'"recordsTotal": {len(datapoints)}' in page
+
+    def test_pages(self, public_client):
+        sensor, datapoints = self._sensor(public_client)
+        assert len(datapoints) > 2
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, draw=3, start=1, length=2),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert resp.json['draw'] == 3
+        assert resp.json['recordsTotal'] == resp.json['recordsFiltered'] == len(datapoints)
+        newest_first = datapoints[::-1]
+        assert [row['when']['label'] for row in resp.json['data']] == [
+            d.timestamp_as_str() for d in newest_first[1:3]
+        ]
+
+        resp = public_client.get(
+            url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, length=-1, **{'order[0][dir]': 'asc'}),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert [row['when']['label'] for row in resp.json['data']] == [d.timestamp_as_str() for d in datapoints]
+
+    def test_compact(self, public_client):
+        bm_config = config_from_client(public_client.application)
+        with bm_config.db_connection() as conn:
+            sensor = find_sensor(conn, 'brown sensor')
+
+        rows = public_client.get(url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, length=3)).json
+        resp = public_client.get(
+            url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, length=3, payload='compact'),
+        )
+        assert resp.status_code == HTTPStatus.OK
+        assert 'data' not in resp.json
+        assert resp.json['recordsTotal'] == rows['recordsTotal']
+        columns = resp.json['columns']
+        assert [Datapoint.format_angle(v) for v in columns['angle']] == [r['angle'] for r in rows['data']]
+        assert columns['timestamp'] == [r['when']['timestamp'] for r in rows['data']]
+
+        resp = public_client.get(url_for('accessor.get_sensor_plot', sensor_id=sensor.id, payload='compact'))
+        assert resp.status_code == HTTPStatus.OK
+        assert all(isinstance(x, int) for x in resp.json['data'][0]['x'])
+
+    @pytest.mark.parametrize('args', (
+        {'start': -1},
+        {'length': 0},
+        {'draw': 'x'},
+        {'order[0][dir]': 'sideways'},
+        {'since': 'yesterday'},
+        {'payload': 'xml'},
+    ))
+    def test_invalid(self, public_client, args):
+        sensor, _ = self._sensor(public_client)
+
+        resp = public_client.get(url_for('accessor.get_sensor_datatable', sensor_id=sensor.id, **args))
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_not_found(self, public_client):
+        resp = public_client.get(url_for('accessor.get_sensor_datatable', sensor_id=42))
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
 class TestAddSensor:
 
     def test_public_redirect(self, public_client):
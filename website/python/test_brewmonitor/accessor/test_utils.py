@@ -1,13 +1,19 @@
-from datetime import datetime
+import json
+import math
+from datetime import datetime, timedelta
+from tempfile import NamedTemporaryFile
 from typing import List, Optional
 
 import pytest
-from brewmonitor.accessor.utils import build_view_data
-from brewmonitor.storage.tables import Datapoint, Sensor
+from brewmonitor.accessor import utils
+from brewmonitor.accessor.utils import MAX_PLOT_POINTS, RAW_INTERVAL, build_datatable, build_plot, compact_datatable
+from brewmonitor.storage.tables import Datapoint, DatapointSeries, Sensor, from_epoch
 from flask import url_for
+from test_brewmonitor.utils import config_from_client, make_clean_client
+from werkzeug.exceptions import BadRequest
 
 
-class TestBuildViewData:
+class TestViewData:
     @classmethod
     @pytest.fixture
     def s1_datapoints(cls) -> List[Datapoint]:
@@ -75,7 +81,7 @@ class TestBuildViewData:
                 assert 'delete_link' not in d
 
     def test_project_graph_view(self, s1_datapoints):
-        _, plot_data = build_view_data('my project', s1_datapoints, sensor_info=None, delete_next=None)
+        plot_data = build_plot('my project', s1_datapoints, sensor_info=None)
         self.check_s1_plot(plot_data)
 
     @pytest.mark.parametrize('delete_next', (
@@ -90,11 +96,11 @@ class TestBuildViewData:
                 next_url = url_for(delete_next)
             else:
                 next_url = None
-            dt_data, _ = build_view_data('my project', s1_datapoints, sensor_info=None, delete_next=next_url)
+            dt_data = build_datatable(s1_datapoints, delete_next=next_url)
             self.check_s1_datatable(dt_data, delete_next)
 
     def test_sensor_graph_view(self, s1_datapoints):
-        _, plot_data = build_view_data('my project', s1_datapoints, sensor_info=None, delete_next=None)
+        plot_data = build_plot('my project', s1_datapoints, sensor_info=None)
         self.check_s1_plot(plot_data)
 
     @pytest.mark.parametrize('delete_next', (
@@ -109,11 +115,61 @@ class TestBuildViewData:
                 next_url = url_for(delete_next)
             else:
                 next_url = None
-            dt_data, _ = build_view_data('my project', s1_datapoints, sensor_info=None, delete_next=next_url)
+            dt_data = build_datatable(s1_datapoints, delete_next=next_url)
             self.check_s1_datatable(dt_data, delete_next)
 
+    def test_series_same_as_datapoints(self, s1_datapoints, s2_datapoints):
+        data_points = s1_datapoints + s2_datapoints
+
+        series = DatapointSeries.of(data_points)
+        assert build_datatable(series) == build_datatable(data_points)
+        assert build_plot('my project', series) == build_plot('my project', data_points)
+        assert compact_datatable(series) == compact_datatable(data_points)
+
+    def test_compact_same_values(self, tmp_app, s1_datapoints, s2_datapoints):
+        data_points = s1_datapoints + s2_datapoints
+        with tmp_app.test_request_context():
+            rows = build_datatable(data_points, delete_next='/next')
+            columns = compact_datatable(data_points, delete_next='/next')
+            delete_url = url_for('accessor.remove_datapoint', datapoint_id=utils.DATAPOINT_ID_PLACEHOLDER, next='/next')
+
+        plot = build_plot('my project', data_points)
+        compact_plot = build_plot('my project', data_points, compact=True)
+
+        assert columns['delete_url'] == delete_url
+        assert [Datapoint.format_timestamp(from_epoch(t)) for t in columns['columns']['timestamp']] == [
+            r['when']['label'] for r in rows
+        ]
+        for name, format_value in (
+            ('angle', Datapoint.format_angle),
+            ('temperature', Datapoint.format_temperature),
+            ('battery', Datapoint.format_battery),
+        ):
+            assert [format_value(v) for v in columns['columns'][name]] == [r[name] for r in rows]
+
+        assert compact_plot['layout']['xaxis']['type'] == 'date'
+        for trace, compact_trace in zip(plot['data'], compact_plot['data']):
+            assert [Datapoint.format_timestamp(from_epoch(t)) for t in compact_trace['x']] == trace['x']
+            format_value = Datapoint.format_angle if trace['yaxis'] == 'y2' else Datapoint.format_temperature
+            assert [format_value(v) for v in compact_trace['y']] == trace['y']
+
+    def test_compact_missing_values(self):
+        data_points = [
+            Datapoint(1, 1, datetime(2021, 11, 30, 9, 40), 10, None, 9.6, id=1),
+            Datapoint(1, 1, datetime(2021, 11, 30, 9, 45), 8, 21.0, None, id=2),
+        ]
+
+        columns = compact_datatable(data_points)
+        plot = build_plot('my project', data_points, compact=True)
+
+        assert columns['columns']['temperature'] == [None, 21.0]
+        assert columns['columns']['battery'] == [9.6, None]
+        assert plot['data'][0]['y'] == [None, 21.0]
+        # Valid JSON, without NaN.
+        json.loads(json.dumps(plot, allow_nan=False))
+
     def test_provide_sensor_data(self, s2_datapoints):
-        _, plot_data = build_view_data(
+        plot_data = build_plot(
             'my project',
             s2_datapoints,
             # real usage reads that from the db
@@ -121,7 +177,6 @@ class TestBuildViewData:
                 1: Sensor(1, 'green name', 'secret', 'toto'),  # should not be used
                 2: Sensor(2, 'brown sensor', 'secret', 'toto'),
             },
-            delete_next=None,
         )
 
         assert plot_data['data'][0]['name'] == 'brown sensor temperature'
@@ -129,7 +184,7 @@ class TestBuildViewData:
 
     def test_provide_sensor_data_but_not_found(self, s2_datapoints):
         # to check that providing sensor info without the correct sensor still works
-        _, plot_data = build_view_data(
+        plot_data = build_plot(
             'my project',
             s2_datapoints,
             sensor_info={
@@ -137,21 +192,19 @@ class TestBuildViewData:
                 # remove so that it has to use default name
                 # 2: Sensor(2, 'brown sensor', 'secret', 'toto'),
             },
-            delete_next=None,
         )
 
         assert plot_data['data'][0]['name'] == 'sensor 2 temperature', 'should use id as name'
         assert plot_data['data'][1]['name'] == 'sensor 2 angle', 'should use id as name'
 
     def test_multiple_sensors_make_multiple_traces(self, s1_datapoints, s2_datapoints):
-        _, plot_data = build_view_data(
+        plot_data = build_plot(
             'my project',
             s1_datapoints + s2_datapoints,
             sensor_info={
                 1: Sensor(1, 'green sensor', 'secret', 'toto'),
                 2: Sensor(2, 'brown sensor', 'secret', 'toto'),
             },
-            delete_next=None,
         )
 
         assert len(plot_data['data']) == 4, 'Should have 2 trace per sensor'
@@ -159,3 +212,157 @@ class TestBuildViewData:
         assert plot_data['data'][1]['name'] == 'green sensor angle'
         assert plot_data['data'][2]['name'] == 'brown sensor temperature'
         assert plot_data['data'][3]['name'] == 'brown sensor angle'
+
+
+def _spanning(seconds: int) -> List[Datapoint]:
+    start = datetime(2021, 11, 30, 9, 40)
+    return [
+        Datapoint(1, 1, start + timedelta(seconds=seconds), 10, 22.0, 9.6),
+        Datapoint(1, 1, start, 10, 22.0, 9.6),
+    ]
+
+
+@pytest.mark.parametrize('data_points, expected', (
+    ([], 'raw'),
+    (_spanning(0), 'raw'),
+    (_spanning(MAX_PLOT_POINTS * RAW_INTERVAL), 'raw'),
+    (_spanning(MAX_PLOT_POINTS * RAW_INTERVAL + 1), 'hour'),
+    (_spanning(MAX_PLOT_POINTS * 3600), 'hour'),
+    (_spanning(MAX_PLOT_POINTS * 3600 + 1), 'day'),
+    (_spanning(MAX_PLOT_POINTS * 86400 * 10), 'day'),
+))
+def test_resolution_for_span(data_points, expected):
+    assert utils.resolution_for_span(DatapointSeries.of(data_points).span()) == expected
+
+
+@pytest.mark.parametrize('value, expected', (
+    ('1638266400', datetime(2021, 11, 30, 10)),
+    ('2021-11-30T10:00', datetime(2021, 11, 30, 10)),
+    ('2021-11-30', datetime(2021, 11, 30)),
+    ('2021-11-30T11:00+01:00', datetime(2021, 11, 30, 10)),
+))
+def test_parse_timestamp(value, expected):
+    assert utils.parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize('value', (
+    '99999999999999999999',
+    '-99999999999999999999',
+    '1000000000000',
+    '0001-01-01T00:00+01:00',
+))
+def test_parse_timestamp_out_of_range(value):
+    with pytest.raises(ValueError):
+        utils.parse_timestamp(value)
+
+
+@pytest.mark.parametrize('value', (str(2 ** 63), str(-2 ** 63 - 1)))
+def test_parse_int_out_of_range(value):
+    with pytest.raises(ValueError):
+        utils.parse_int(value)
+    assert utils.parse_int(str(2 ** 63 - 1)) == 2 ** 63 - 1
+
+
+def test_get_window(tmp_app):
+    with tmp_app.test_request_context('/?since=2021-11-30&until=1638266400&limit=10&after_id=3&other=1'):
+        assert utils.get_window() == {
+            'since': datetime(2021, 11, 30),
+            'until': datetime(2021, 11, 30, 10),
+            'limit': 10,
+            'after_id': 3,
+        }
+
+    with tmp_app.test_request_context('/'):
+        assert utils.get_window() == {}
+
+
+@pytest.mark.parametrize('query', (
+    'since=yesterday',
+    'until=',
+    'limit=ten',
+    'limit=0',
+    'after_id=1.5',
+    'since=99999999999999999999',
+    'limit=9223372036854775808',
+    'after_id=9223372036854775808',
+))
+def test_get_window_invalid(tmp_app, query):
+    with tmp_app.test_request_context(f'/?{query}'):
+        with pytest.raises(BadRequest):
+            utils.get_window()
+
+
+@pytest.mark.parametrize('n, threshold', ((10, 20), (10, 10), (10, 2), (0, 5)))
+def test_lttb_keeps_everything(n, threshold):
+    assert utils.lttb(list(range(n)), [1.0] * n, threshold) == list(range(n))
+
+
+@pytest.mark.parametrize('n, threshold', ((100, 10), (1000, 3), (1001, 250), (50000, 2000)))
+def test_lttb_threshold(n, threshold):
+    x = list(range(n))
+    y = [math.sin(i / 50) for i in x]
+
+    kept = utils.lttb(x, y, threshold)
+
+    assert len(kept) == threshold
+    assert kept[0] == 0
+    assert kept[-1] == n - 1
+    assert kept == sorted(set(kept)), 'should be increasing without duplicates'
+
+
+def test_lttb_keeps_shape():
+    # A flat line with a spike and a dip, like when the fermenter is moved.
+    y = [20.0] * 1000
+    y[300] = 25.0
+    y[700] = 15.0
+
+    kept = utils.lttb(list(range(1000)), y, 20)
+
+    assert 300 in kept
+    assert 700 in kept
+
+
+def test_build_plot_downsamples():
+    start = datetime(2021, 11, 30)
+    data_points = [
+        Datapoint(sensor_id, 1, start + timedelta(minutes=10 * i), i % 7, 20 + i % 5, 3.3)
+        for i in range(100)
+        for sensor_id in (1, 2)
+    ]
+
+    plot = utils.build_plot('project', data_points, max_points=10)
+
+    assert len(plot['data']) == 4
+    for trace in plot['data']:
+        assert len(trace['x']) == len(trace['y']) == 10
+        assert trace['x'][0] == Datapoint.format_timestamp(start)
+        assert trace['x'][-1] == Datapoint.format_timestamp(start + timedelta(minutes=990))
+
+
+def test_max_plot_points_from_config():
+    assert utils.max_plot_points() == MAX_PLOT_POINTS
+
+    with NamedTemporaryFile() as config_file, NamedTemporaryFile() as db_file:
+        app = make_clean_client(config_file, db_file, {'max plot points': 5})
+        with app.app_context():
+            assert utils.max_plot_points() == 5
+            plot = build_plot('project', sorted(_spanning(3600) * 10, key=lambda d: d.timestamp))
+        config_from_client(app).db_pool.close()
+
+    assert len(plot['data'][0]['x']) == 5
+
+
+def test_compact_payload_smaller(tmp_app):
+    start = datetime(2021, 11, 30)
+    series = DatapointSeries.of([
+        Datapoint(1, 1, start + timedelta(minutes=i), 20 + i % 50 / 7, 18 + i % 30 / 11, 3.3 + i % 9 / 13, id=i + 1)
+        for i in range(2000)
+    ])
+
+    with tmp_app.test_request_context():
+        rows = build_datatable(series, delete_next='/next'), build_plot('project', series)
+        compact = compact_datatable(series, delete_next='/next'), build_plot('project', series, compact=True)
+    rows_size = len(json.dumps(rows))
+    compact_size = len(json.dumps(compact))
+
+    assert compact_size * 2 < rows_size
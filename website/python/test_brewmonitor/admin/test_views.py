@@ -1,7 +1,11 @@
 from http import HTTPStatus
 
+import pytest
+from brewmonitor.storage import access
+from brewmonitor.storage.tables import User
 from flask import url_for
-from test_brewmonitor.utils import MultiClientBase
+from test_brewmonitor.storage.test_access import can_write
+from test_brewmonitor.utils import MultiClientBase, config_from_client
 
 
 class TestIndexView(MultiClientBase):
@@ -10,3 +14,55 @@ class TestIndexView(MultiClientBase):
         assert resp.status_code == HTTPStatus.FOUND
         # redirects to home.index that redirects to accessor.all_projects
         assert resp.location == url_for('accessor.all_projects', _external=True)
+
+
+def test_metrics_requires_admin(user_client):
+    resp = user_client.get(url_for('admin.metrics'))
+    assert resp.status_code == HTTPStatus.FOUND
+
+
+def test_metrics(admin_client):
+    resp = admin_client.get(url_for('admin.metrics'))
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json['db_pool']['misses'] >= 1
+    assert resp.json['ingest_queue'] is None, 'not enabled in the tests'
+    assert 'hits' in resp.json['sensor_cache']
+
+    hits = resp.json['user_cache']['hits']
+    resp = admin_client.get(url_for('admin.metrics'))
+    assert resp.json['user_cache']['hits'] > hits, 'the admin should be cached'
+
+
+@pytest.mark.parametrize('endpoint, remove, key', (
+    ('admin.delete_project', 'remove_project', 'project_id'),
+    ('admin.delete_sensor', 'remove_sensor', 'sensor_id'),
+    ('admin.delete_user', 'remove_user', 'user_id'),
+))
+def test_delete_views_lock_first(
+    admin_client,
+    other_project,
+    other_sensor,
+    new_user_data,
+    monkeypatch,
+    endpoint,
+    remove,
+    key,
+):
+    bm_config = config_from_client(admin_client.application)
+    with bm_config.db_connection() as conn:
+        user = User.create(conn, is_admin=False, **new_user_data)
+    ids = {'project_id': other_project.id, 'sensor_id': other_sensor.id, 'user_id': user.id}
+
+    original = getattr(access, remove)
+    locked = []
+
+    def _remove(obj):
+        # Read and about to write, another request must not have committed in between.
+        locked.append(not can_write(bm_config))
+        return original(obj)
+
+    monkeypatch.setattr(access, remove, _remove)
+
+    resp = admin_client.get(url_for(endpoint, **{key: ids[key]}))
+    assert resp.status_code == HTTPStatus.FOUND
+    assert locked == [True]
@@ -1,3 +1,4 @@
+import os
 from http import HTTPStatus
 from tempfile import NamedTemporaryFile
 
@@ -9,12 +10,24 @@ from test_brewmonitor.constants import preset_when
 from test_brewmonitor.utils import config_from_client, find_project, find_sensor, find_user, make_clean_client
 
 
+def pytest_collection_modifyitems(config, items):
+    """The benchmarks time the code, they only run with BREWMONITOR_BENCHMARKS set."""
+    if os.environ.get('BREWMONITOR_BENCHMARKS'):
+        return
+    skip = pytest.mark.skip(reason='set BREWMONITOR_BENCHMARKS=1 to run the benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture(scope='function')
 def tmp_app() -> Flask:
     """Creates a clean db every time and destroys it at the end of the test."""
     with NamedTemporaryFile() as config_file:
         with NamedTemporaryFile() as db_file:
-            yield make_clean_client(config_file, db_file)
+            app = make_clean_client(config_file, db_file)
+            yield app
+            config_from_client(app).db_pool.close()
 
 
 @pytest.fixture(scope='package')
@@ -30,6 +43,7 @@ def preset_app() -> Flask:
             bm_config = config_from_client(app)
             make_dummy_data(bm_config, 'admin', when=preset_when)
             yield app
+            bm_config.db_pool.close()
 
 
 @pytest.fixture
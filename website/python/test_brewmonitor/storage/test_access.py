@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytest
+from brewmonitor.storage import access
+from brewmonitor.storage.cache import sensor_cache
+from brewmonitor.storage.tables import Datapoint, Project, Sensor, User
+from flask import g
+from test_brewmonitor.utils import config_from_client
+
+
+def count_users(bm_config) -> int:
+    # Another connection, only sees what was committed.
+    conn = sqlite3.connect(bm_config.sqlite_file)
+    try:
+        return conn.execute('select count(*) from User;').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_commit_outside_request(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.app_context():
+        access.insert_user('toto', 'pass', False)
+
+    assert count_users(bm_config) == 1
+
+
+def test_commit_at_end_of_request(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.test_request_context(method='POST'):
+        access.insert_user('toto', 'pass', False)
+        access.insert_user('titi', 'pass', False)
+        assert count_users(bm_config) == 0, 'should not be committed yet'
+
+    assert count_users(bm_config) == 2
+
+
+def test_rollback_on_error(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    ctx = tmp_app.test_request_context(method='POST')
+    ctx.push()
+    access.insert_user('toto', 'pass', False)
+    ctx.pop(RuntimeError('request failed'))
+
+    assert count_users(bm_config) == 0
+
+
+def test_get_reads_one_snapshot(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.test_request_context(method='GET'):
+        assert access.get_users() == []
+
+        def _other_request():
+            with bm_config.db_connection() as conn:
+                User.create(conn, 'toto', 'pass', False)
+
+        # Written by another request while the page is being built.
+        thread = threading.Thread(target=_other_request)
+        thread.start()
+        thread.join()
+        assert count_users(bm_config) == 1
+
+        assert access.get_users() == [], 'should still read the same snapshot'
+
+    with tmp_app.test_request_context(method='GET'):
+        assert len(access.get_users()) == 1
+
+
+def test_stream_datapoints_own_connection(tmp_app, monkeypatch):
+    bm_config = config_from_client(tmp_app)
+    with bm_config.db_connection() as conn:
+        Datapoint.create_many(conn, [
+            Datapoint(1, 1, datetime(2021, 11, 30, 10, i), i, 20, 3)
+            for i in range(5)
+        ])
+
+    connections = []
+    connect = bm_config.db_pool.connect
+
+    def _connect():
+        connections.append(connect())
+        return connections[-1]
+
+    monkeypatch.setattr(bm_config.db_pool, 'connect', _connect)
+
+    with tmp_app.test_request_context(method='GET'):
+        datapoints = access.stream_datapoints(project_id=1)
+        assert connections == [], 'should only connect once iterated'
+
+    # Still readable once the request is over, like a streamed response.
+    assert [d.angle for d in datapoints] == [0, 1, 2, 3, 4]
+    assert len(connections) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[0].execute('select 1;')
+
+
+def test_get_login_user_cached(tmp_app, monkeypatch):
+    with tmp_app.app_context():
+        user = access.insert_user('toto', 'pass', True)
+
+    calls = []
+    find = User.find
+
+    def _counting(db_conn, user_id):
+        calls.append(user_id)
+        return find(db_conn, user_id)
+
+    monkeypatch.setattr(User, 'find', _counting)
+
+    with tmp_app.test_request_context(method='GET'):
+        assert access.get_login_user(str(user.id)) == user
+        assert access.get_login_user(str(user.id)) == user
+        assert access.get_login_user('invalid') is None
+    assert calls == [user.id], 'should be cached'
+
+    with tmp_app.app_context():
+        access.remove_user(user)
+        assert access.get_login_user(user.id) is None
+        assert access.get_login_user(user.id) is None, 'unknown users are not cached'
+    assert calls == [user.id, user.id, user.id]
+
+
+def test_sensor_cache_invalidated_after_commit(tmp_app):
+    bm_config = config_from_client(tmp_app)
+    with bm_config.db_connection() as conn:
+        owner = User.create(conn, 'toto', 'pass', False)
+        sensor = Sensor.create(conn, 'sensor', 'old secret', owner)
+
+    with tmp_app.test_request_context(method='POST'):
+        old_credentials = access.get_sensor_credentials(sensor.id)
+        access.edit_sensor(sensor, 'sensor', 'new secret', owner, 4, 3)
+
+        # Another request reads the sensor before the commit and caches it again.
+        sensor_cache.set(sensor.id, old_credentials)
+
+    with tmp_app.app_context():
+        assert access.get_sensor_credentials(sensor.id).secret == 'new secret'
+
+
+def test_sensor_cache_invalidated_outside_request(tmp_app):
+    bm_config = config_from_client(tmp_app)
+    with bm_config.db_connection() as conn:
+        owner = User.create(conn, 'toto', 'pass', False)
+        sensor = Sensor.create(conn, 'sensor', 'secret', owner)
+        project = Project.create(conn, 'project', owner)
+
+    with tmp_app.app_context():
+        assert access.get_sensor_credentials(sensor.id).project_id is None
+        access.update_project_sensor(project, sensor.id)
+        assert access.get_sensor_credentials(sensor.id).project_id == project.id
+
+
+def test_rollback_left_open_transaction(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.app_context():
+        # Some code of the same thread forgot to end its transaction.
+        User.create(bm_config.db_connection(), 'toto', 'pass', False)
+
+        with tmp_app.test_request_context(method='POST'):
+            access.insert_user('titi', 'pass', False)
+
+    assert count_users(bm_config) == 1
+    with tmp_app.app_context():
+        assert [u.username for u in access.get_users()] == ['titi']
+
+
+def can_write(bm_config) -> bool:
+    # Fails straight away if someone holds the write lock.
+    conn = sqlite3.connect(bm_config.sqlite_file, timeout=0)
+    try:
+        with conn:
+            conn.execute('update User set is_admin=is_admin;')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('db_write, expected', ((False, True), (True, False)))
+def test_get_which_writes(tmp_app, db_write, expected):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.test_request_context(method='GET'):
+        if db_write:
+            g.db_write = True
+        access.get_users()
+        assert can_write(bm_config) == expected, 'only the GET views which write lock the db'
@@ -0,0 +1,68 @@
+import pytest
+from brewmonitor.storage.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_get_set(clock):
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_expires(clock):
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_evicts_least_recently_used(clock):
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_invalidate_and_clear(clock):
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    cache.invalidate('a')
+    cache.invalidate('unknown')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+    cache.clear()
+    assert cache.get('b') is None
+
+
+@pytest.mark.parametrize('max_size, ttl', ((0, 10), (1, -1)))
+def test_invalid_limits(max_size, ttl):
+    with pytest.raises(ValueError):
+        TTLCache(max_size, ttl)
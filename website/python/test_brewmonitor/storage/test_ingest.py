@@ -0,0 +1,233 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from tempfile import NamedTemporaryFile
+
+import pytest
+from brewmonitor.storage import ingest
+from brewmonitor.storage.ingest import IngestQueue, IngestQueueFull
+from brewmonitor.storage.tables import Datapoint
+from flask import url_for
+from make_dummy_data import make_dummy_data
+from test_brewmonitor.utils import config_from_client, make_clean_client
+
+
+def _datapoints(count: int):
+    start = datetime(2021, 11, 30, 10)
+    return [Datapoint(1, 1, start + timedelta(minutes=10 * i), 10, 20, 3) for i in range(count)]
+
+
+def _count(bm_config) -> int:
+    with bm_config.db_connection() as conn:
+        return conn.execute('select count(*) from Datapoint;').fetchone()[0]
+
+
+@pytest.fixture
+def ingest_queue(tmp_app):
+    queue = IngestQueue(config_from_client(tmp_app), max_batch_size=10, max_latency=0.05)
+    queue.start()
+    yield queue
+    queue.stop()
+
+
+def test_group_commit(ingest_queue):
+    ingest_queue.put(_datapoints(25))
+    ingest_queue.flush()
+
+    metrics = ingest_queue.metrics()
+    assert _count(ingest_queue.config) == 25
+    assert metrics['depth'] == 0
+    assert metrics['committed'] == 25
+    assert metrics['failed'] == 0
+    assert 3 <= metrics['batches'] < 25, 'should commit in batches of at most 10'
+    assert 0 < metrics['mean_commit_latency'] <= metrics['max_commit_latency']
+
+
+def test_commit_after_latency(ingest_queue):
+    ingest_queue.put(_datapoints(1))
+    ingest_queue.flush()
+
+    assert _count(ingest_queue.config) == 1
+    assert ingest_queue.metrics()['batches'] == 1
+
+
+def test_stop_drains(tmp_app):
+    queue = IngestQueue(config_from_client(tmp_app), max_batch_size=10, max_latency=60)
+    queue.start()
+    queue.put(_datapoints(15))
+
+    queue.stop()
+
+    assert _count(queue.config) == 15
+    with pytest.raises(RuntimeError):
+        queue.put(_datapoints(1))
+
+
+def test_failed_batch(ingest_queue):
+    ingest_queue.put([Datapoint(None, None, datetime(2021, 11, 30), 1, 2, 3)])  # sensor_id is not null
+    ingest_queue.flush()
+
+    assert ingest_queue.metrics()['failed'] == 1
+    assert _count(ingest_queue.config) == 0
+
+
+def test_failed_datapoint_only(ingest_queue):
+    datapoints = _datapoints(4)
+    datapoints[1] = Datapoint(None, None, datetime(2021, 11, 30), 1, 2, 3)
+    datapoints[2].timestamp = 'not a timestamp'
+    ingest_queue.put(datapoints)
+    ingest_queue.flush()
+
+    metrics = ingest_queue.metrics()
+    assert metrics['committed'] == 2
+    assert metrics['failed'] == 2
+    assert _count(ingest_queue.config) == 2
+
+
+def _locked(monkeypatch, times: int):
+    """Fails the first inserts like a locked db, returns the list of calls."""
+    calls = []
+    create_many = Datapoint.create_many
+
+    def locked_create_many(db_conn, datapoints):
+        calls.append(len(datapoints))
+        if len(calls) <= times:
+            raise sqlite3.OperationalError('database is locked')
+        create_many(db_conn, datapoints)
+
+    monkeypatch.setattr(ingest.Datapoint, 'create_many', locked_create_many)
+    return calls
+
+
+@pytest.mark.parametrize('times, committed', [(1, 4), (3, 0)])
+def test_locked_retries_batch(tmp_app, monkeypatch, times, committed):
+    queue = IngestQueue(config_from_client(tmp_app), max_latency=0.01, max_retries=2, retry_delay=0.01)
+    calls = _locked(monkeypatch, times)
+    queue.start()
+    queue.put(_datapoints(4))
+    queue.stop()
+
+    metrics = queue.metrics()
+    assert calls == [4] * len(calls), 'should never insert one datapoint at a time'
+    assert metrics['committed'] == committed
+    assert metrics['failed'] == 4 - committed
+    assert metrics['retries'] == min(times, 2)
+    assert _count(queue.config) == committed
+
+
+def test_put_full(tmp_app, monkeypatch):
+    queue = IngestQueue(config_from_client(tmp_app), max_batch_size=2, max_depth=2, put_timeout=0.05)
+    inserting = threading.Event()
+    release = threading.Event()
+    create_many = Datapoint.create_many
+
+    def slow_create_many(db_conn, datapoints):
+        inserting.set()
+        release.wait(5)
+        create_many(db_conn, datapoints)
+
+    monkeypatch.setattr(ingest.Datapoint, 'create_many', slow_create_many)
+    queue.start()
+    try:
+        queue.put(_datapoints(2))
+        assert inserting.wait(5)
+        queue.put(_datapoints(1))
+
+        # Room for one only, none of them is queued.
+        with pytest.raises(IngestQueueFull):
+            queue.put(_datapoints(2))
+        with pytest.raises(IngestQueueFull):
+            queue.put(_datapoints(3))
+        assert queue.metrics()['depth'] == 1
+        assert queue.metrics()['rejected'] == 5
+    finally:
+        release.set()
+        queue.stop()
+    assert _count(queue.config) == 3
+
+
+def test_not_started(tmp_app):
+    queue = IngestQueue(config_from_client(tmp_app))
+    with pytest.raises(RuntimeError):
+        queue.put(_datapoints(1))
+
+
+def test_add_data_uses_queue():
+    with NamedTemporaryFile() as config_file, NamedTemporaryFile() as db_file:
+        app = make_clean_client(config_file, db_file, {'ingest queue': {'max latency': 0.01}})
+        bm_config = config_from_client(app)
+        make_dummy_data(bm_config, 'admin')
+        before = _count(bm_config)
+
+        with app.test_request_context():
+            with app.test_client() as client:
+                resp = client.post(url_for('storage.add_data'), json=[
+                    {'sensor_id': 1, 'angle': 1, 'temperature': 2, 'battery': 3, 'secret': 'secret', 'timestamp': i}
+                    for i in range(5)
+                ])
+                assert resp.status_code == HTTPStatus.OK
+
+        queue = app.config['brewmonitor ingest queue']
+        queue.stop()
+        assert queue.metrics()['committed'] == 5
+        assert _count(bm_config) == before + 5
+        bm_config.db_pool.close()
+
+
+def test_add_data_queue_normalised():
+    with NamedTemporaryFile() as config_file, NamedTemporaryFile() as db_file:
+        app = make_clean_client(config_file, db_file, {'ingest queue': {'max latency': 0.01}})
+        bm_config = config_from_client(app)
+        make_dummy_data(bm_config, 'admin')
+        before = _count(bm_config)
+
+        with app.test_request_context():
+            with app.test_client() as client:
+                for entry in (
+                    {'sensor_id': 1, 'angle': 1, 'temperature': 2, 'battery': 3, 'secret': 'secret'},
+                    {'sensor_id': 2, 'angle': '1.5', 'temperature': 2, 'battery': None, 'secret': 'secret',
+                     'timestamp': '2021-11-26T10:00:00'},
+                ):
+                    resp = client.post(url_for('storage.add_data'), json=entry)
+                    assert resp.status_code == HTTPStatus.OK
+
+                resp = client.post(url_for('storage.add_data'), json={
+                    'sensor_id': 1, 'angle': 'flat', 'temperature': 2, 'battery': 3, 'secret': 'secret',
+                })
+                assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+        queue = app.config['brewmonitor ingest queue']
+        queue.stop()
+        assert queue.metrics()['committed'] == 2
+        assert queue.metrics()['failed'] == 0
+        assert _count(bm_config) == before + 2
+        with bm_config.db_connection() as conn:
+            last = conn.execute('select angle from Datapoint where id=(select max(id) from Datapoint);').fetchone()
+            assert last == (1.5,)
+        bm_config.db_pool.close()
+
+
+def test_add_data_queue_full(monkeypatch):
+    with NamedTemporaryFile() as config_file, NamedTemporaryFile() as db_file:
+        app = make_clean_client(config_file, db_file, {'ingest queue': {'max latency': 0.01}})
+        bm_config = config_from_client(app)
+        make_dummy_data(bm_config, 'admin')
+        before = _count(bm_config)
+        queue = app.config['brewmonitor ingest queue']
+
+        def full(datapoints):
+            raise IngestQueueFull('full')
+
+        monkeypatch.setattr(queue, 'put', full)
+        with app.test_request_context():
+            with app.test_client() as client:
+                entry = {'sensor_id': 1, 'angle': 1, 'temperature': 2, 'battery': 3, 'secret': 'secret'}
+                resp = client.post(url_for('storage.add_data'), json=entry)
+                assert resp.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+                resp = client.post(url_for('storage.add_data'), json=[entry, entry])
+                assert resp.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+        queue.stop()
+        assert _count(bm_config) == before
+        bm_config.db_pool.close()
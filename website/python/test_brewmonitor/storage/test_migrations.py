@@ -0,0 +1,124 @@
+import sqlite3
+from tempfile import NamedTemporaryFile
+
+import pytest
+from brewmonitor import schema
+from brewmonitor.configuration import Configuration
+from brewmonitor.storage.migrations import Migration, apply_migrations, current_version, latest_version
+from migrate_db import migrate_db
+from test_brewmonitor.utils import config_from_client
+
+
+def _create_a(conn):
+    conn.execute('create table A (id integer primary key);')
+
+
+def _create_b(conn):
+    conn.execute('create table B (id integer primary key);')
+
+
+def _broken(conn):
+    conn.execute('create table C (id integer primary key);')
+    conn.execute('insert into Unknown values (1);')
+
+
+steps = (
+    Migration(2, 'create B', _create_b),
+    Migration(1, 'create A', _create_a),
+)
+
+
+def table_names(conn):
+    return {r[0] for r in conn.execute("select name from sqlite_master where type='table';")}
+
+
+@pytest.fixture
+def db_conn():
+    conn = sqlite3.connect(':memory:')
+    yield conn
+    conn.close()
+
+
+def test_apply_in_order(db_conn):
+    assert current_version(db_conn) == 0
+
+    applied = apply_migrations(db_conn, steps)
+
+    assert [m.version for m, _ in applied] == [1, 2]
+    assert applied[0][1] == ['create table A (id integer primary key);']
+    assert current_version(db_conn) == latest_version(steps) == 2
+    assert {'A', 'B', 'schema_version'} <= table_names(db_conn)
+    assert apply_migrations(db_conn, steps) == [], 'nothing left to apply'
+
+
+def test_apply_only_pending(db_conn):
+    apply_migrations(db_conn, steps[1:])
+    assert current_version(db_conn) == 1
+
+    applied = apply_migrations(db_conn, steps)
+    assert [m.version for m, _ in applied] == [2]
+
+
+def test_failed_step_is_rolled_back(db_conn):
+    with pytest.raises(sqlite3.OperationalError):
+        apply_migrations(db_conn, steps + (Migration(3, 'broken', _broken),))
+
+    assert current_version(db_conn) == 2, 'previous steps should be kept'
+    assert 'C' not in table_names(db_conn)
+    assert not db_conn.in_transaction
+
+
+def test_dry_run(db_conn):
+    applied = apply_migrations(db_conn, steps, dry_run=True)
+
+    assert [m.version for m, _ in applied] == [1, 2]
+    assert current_version(db_conn) == 0
+    assert table_names(db_conn) == set()
+
+
+def test_app_db_is_up_to_date(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with bm_config.db_connection() as conn:
+        assert current_version(conn) == latest_version(schema.migrations)
+
+
+def test_initialise_db_skips_when_current(tmp_app, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise AssertionError('should not migrate')
+
+    monkeypatch.setattr(schema, 'apply_migrations', _fail)
+    schema.initialise_db(config_from_client(tmp_app))
+
+
+def test_initialise_db_adopts_existing_db():
+    with NamedTemporaryFile() as db_file:
+        bm_config = Configuration({'sqlite file': db_file.name})
+        # db created before the migrations existed
+        with bm_config.db_connection() as conn:
+            for table in schema.tables:
+                conn.execute(table.create_table_req())
+            conn.execute("insert into User (username, password, is_admin) values ('toto', 'pwd', 1);")
+
+        schema.initialise_db(bm_config)
+
+        with bm_config.db_connection() as conn:
+            assert current_version(conn) == latest_version(schema.migrations)
+            assert conn.execute('select username from User;').fetchall() == [('toto',)]
+
+
+@pytest.mark.parametrize('dry_run', (True, False))
+def test_migrate_db(dry_run, capsys):
+    with NamedTemporaryFile() as db_file:
+        bm_config = Configuration({'sqlite file': db_file.name})
+
+        version = migrate_db(bm_config, dry_run=dry_run)
+
+        with bm_config.db_connection() as conn:
+            assert current_version(conn) == version
+
+    expected = 0 if dry_run else latest_version(schema.migrations)
+    assert version == expected
+    out = capsys.readouterr().out
+    assert 'Initial schema' in out
+    assert 'create table if not exists Datapoint' in out
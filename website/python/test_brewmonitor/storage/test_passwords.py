@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+from http import HTTPStatus
+
+import pytest
+from brewmonitor.storage import access
+from brewmonitor.storage.passwords import PasswordHasher, PasswordHasherBusy, password_hasher
+from test_brewmonitor.utils import config_from_client
+
+
+@pytest.fixture
+def fast_hasher():
+    """The cheapest cost for the test, then back to the defaults of make_app."""
+    password_hasher.configure(rounds=4, max_workers=2, max_pending=16)
+    yield password_hasher
+    password_hasher.configure(rounds=12, max_workers=2, max_pending=16)
+
+
+def test_hash_and_check():
+    hasher = PasswordHasher(rounds=4)
+
+    hashed = hasher.hash('pass')
+    assert hashed.startswith(b'$2b$04$')
+    assert hasher.check('pass', hashed)
+    assert hasher.check('pass', hashed.decode('ascii')), 'can be read back as text'
+    assert not hasher.check('wrong', hashed)
+    assert hasher.metrics() == {'rounds': 4, 'pending': 0, 'completed': 4, 'rejected': 0}
+
+
+def test_needs_rehash():
+    hasher = PasswordHasher(rounds=4)
+    hashed = hasher.hash('pass')
+    assert not hasher.needs_rehash(hashed)
+
+    hasher.configure(rounds=5, max_workers=2, max_pending=16)
+    assert hasher.needs_rehash(hashed)
+
+
+def test_busy():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def _slow():
+        started.set()
+        release.wait()
+
+    thread = threading.Thread(target=hasher._run, args=(_slow,))
+    thread.start()
+    started.wait()
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash('pass')
+    finally:
+        release.set()
+        thread.join()
+
+    assert hasher.metrics()['rejected'] == 1
+    assert hasher.check('pass', hasher.hash('pass')), 'should accept again once done'
+
+
+@pytest.mark.parametrize('rounds, max_workers, max_pending', (
+    (3, 2, 16),
+    (32, 2, 16),
+    (12, 0, 16),
+    (12, 4, 2),
+))
+def test_invalid_settings(rounds, max_workers, max_pending):
+    with pytest.raises(ValueError):
+        PasswordHasher(rounds, max_workers, max_pending)
+
+
+def test_verify_user_rehashes(tmp_app, fast_hasher):
+    bm_config = config_from_client(tmp_app)
+    with tmp_app.app_context():
+        user = access.insert_user('toto', 'pass', False)
+
+        fast_hasher.configure(rounds=5, max_workers=2, max_pending=16)
+        assert access.verify_user('toto', 'wrong') is None
+        assert access.verify_user('nobody', 'pass') is None
+        assert _stored_hash(bm_config).startswith(b'$2b$04$')
+
+        assert access.verify_user('toto', 'pass') == user
+        assert _stored_hash(bm_config).startswith(b'$2b$05$')
+        assert access.verify_user('toto', 'pass') == user
+
+
+def _stored_hash(bm_config) -> bytes:
+    conn = sqlite3.connect(bm_config.sqlite_file)
+    try:
+        return conn.execute('select password from User;').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _can_write(bm_config) -> bool:
+    # Fails straight away if someone holds the write lock.
+    conn = sqlite3.connect(bm_config.sqlite_file, timeout=0)
+    try:
+        with conn:
+            conn.execute('update User set is_admin=is_admin;')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def hashing_checks_lock(tmp_app, fast_hasher, monkeypatch):
+    """While hashing, records if the db could be written by another connection."""
+    bm_config = config_from_client(tmp_app)
+    with tmp_app.app_context():
+        access.insert_user('toto', 'pass', True)
+
+    could_write = []
+    for name in ('hash', 'check'):
+        def _checking(*args, _run=getattr(fast_hasher, name)):
+            could_write.append(_can_write(bm_config))
+            return _run(*args)
+
+        monkeypatch.setattr(fast_hasher, name, _checking)
+    # A rehash too.
+    fast_hasher.rounds = 5
+    return could_write
+
+
+def test_login_hashes_without_lock(tmp_app, hashing_checks_lock):
+    with tmp_app.test_client() as client:
+        resp = client.post('/login', data={'username': 'toto', 'password': 'pass'})
+        assert resp.status_code == HTTPStatus.FOUND
+
+    assert hashing_checks_lock == [True, True]
+
+
+def test_insert_user_hashes_without_lock(tmp_app, hashing_checks_lock):
+    with tmp_app.test_request_context(method='POST'):
+        # Like admin_required.
+        assert access.get_login_user(1) is not None
+        access.insert_user('titi', 'pass', False)
+        access.end_session()
+
+    assert hashing_checks_lock == [True]
@@ -1,5 +1,12 @@
+import sqlite3
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+
 import pytest
 from brewmonitor import schema
+from brewmonitor.configuration import Configuration
+from brewmonitor.storage.migrations import apply_migrations
+from brewmonitor.storage.tables import Datapoint, Project, Sensor, to_epoch
 from make_dummy_data import make_dummy_data
 from test_brewmonitor.utils import config_from_client
 
@@ -20,6 +27,17 @@ def test_initialise_db_creates_table(tmp_app, table):
         assert cursor.fetchone()[0], f'Table {table.__name__} should exist at start'
 
 
+@pytest.mark.parametrize('table', schema.tables)
+def test_migrations_match_table_classes(tmp_app, table):
+    # A column added to a class needs a migration, the released ones are not edited.
+    expected = sqlite3.connect(':memory:')
+    expected.execute(table.create_table_req())
+    pragma = f'pragma table_info({table.__name__});'
+
+    with config_from_client(tmp_app).db_connection() as conn:
+        assert conn.execute(pragma).fetchall() == expected.execute(pragma).fetchall()
+
+
 def test_initialise_db_keeps_content(tmp_app):
     # initialise_db is called when we create the tmp_client.
     # Let's populate the tables and make sure it's unaffected when calling
@@ -47,3 +65,261 @@ def test_initialise_db_keeps_content(tmp_app):
             assert (
                 conn.execute(count_req.format(table=t.__name__)).fetchone()[0] == rows_by_table[t.__name__]
             ), f'number of rows changed in {t.__name__}'
+
+
+@pytest.mark.parametrize('table', [t for t in schema.tables if t.additional_sql_indexes()])
+def test_initialise_db_creates_indexes(tmp_app, table):
+    bm_config = config_from_client(tmp_app)
+
+    with bm_config.db_connection() as conn:
+        for columns in table.additional_sql_indexes():
+            index_name = table.index_name(columns)
+            cursor = conn.execute(
+                """
+                select tbl_name from sqlite_master where type='index' and name=?;
+                """,
+                (index_name,),
+            )
+            assert cursor.fetchone() == (table.__name__,), f'Index {index_name} should exist at start'
+            index_columns = [row[2] for row in conn.execute(f'pragma index_info({index_name});')]
+            assert index_columns == list(columns)
+
+
+class TestSummaryTables:
+    summary_columns = {
+        'SensorSummary': 'sensor_id, datapoint_count, last_active, last_battery',
+        'ProjectSummary': (
+            'project_id, datapoint_count, first_active, first_angle, last_active, last_angle, last_temperature'
+        ),
+    }
+
+    @classmethod
+    def summaries(cls, conn):
+        return {
+            table: conn.execute(f'select {columns} from {table} where datapoint_count > 0 order by 1;').fetchall()
+            for table, columns in cls.summary_columns.items()
+        }
+
+    @classmethod
+    def check_summaries(cls, conn):
+        """The incremental summaries should match the ones computed from scratch."""
+        conn.commit()
+        incremental = cls.summaries(conn)
+        schema.rebuild_summary_tables(conn)
+        rebuilt = cls.summaries(conn)
+        conn.rollback()
+        assert incremental == rebuilt
+        return incremental
+
+    def test_updated_on_insert(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            summaries = self.check_summaries(conn)
+
+        assert [r[:2] for r in summaries['SensorSummary']] == [(1, 7), (2, 16)]
+        assert [r[:2] for r in summaries['ProjectSummary']] == [(1, 7), (2, 8)]
+
+    def test_insert_older_datapoint(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            project = Project.find(conn, project_id=1)
+            Datapoint.create_many(conn, [
+                Datapoint(1, 1, project.first_active.replace(year=2000), 1, 2, 3),
+            ])
+            self.check_summaries(conn)
+            assert Project.find(conn, project_id=1).first_angle == 1
+            assert Project.find(conn, project_id=1).last_angle == project.last_angle
+
+    @pytest.mark.parametrize('which', ('first', 'last', 'middle'))
+    def test_updated_on_delete(self, tmp_app, which):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            datapoints = sorted(Datapoint.get_all(conn, project_id=2), key=lambda d: d.timestamp)
+            to_delete = {'first': datapoints[0], 'last': datapoints[-1], 'middle': datapoints[3]}[which]
+            to_delete.delete(conn)
+
+            summaries = self.check_summaries(conn)
+
+        assert summaries['ProjectSummary'][1][:2] == (2, 7)
+        assert summaries['SensorSummary'][1][:2] == (2, 15)
+
+    def test_delete_all_datapoints(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            for d in Datapoint.get_all(conn, project_id=1):
+                d.delete(conn)
+            self.check_summaries(conn)
+            assert conn.execute('select * from ProjectSummary where project_id=1;').fetchone() == (
+                1, 0, 7, None, None, None, None, None,
+            ), 'should keep the max id'
+            assert Project.find(conn, project_id=1).last_active is None
+
+    def test_removed_with_sensor_and_project(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            Sensor.find(conn, sensor_id=2).delete(conn)
+            Project.find(conn, project_id=1).delete(conn)
+            summaries = self.check_summaries(conn)
+
+            # Rows of the deleted sensor and project are removed, the others are empty.
+            assert conn.execute('select sensor_id, datapoint_count from SensorSummary;').fetchall() == [(1, 0)]
+            assert conn.execute('select project_id, datapoint_count from ProjectSummary;').fetchall() == [(2, 0)]
+
+        assert summaries == {'SensorSummary': [], 'ProjectSummary': []}
+
+    def test_migrations_convert_existing_data(self):
+        with NamedTemporaryFile() as db_file:
+            bm_config = Configuration({'sqlite file': db_file.name})
+            with bm_config.db_connection() as conn:
+                apply_migrations(conn, schema.migrations[:1])
+            # Data written before the summary tables existed.
+            with bm_config.db_connection() as conn:
+                conn.execute("insert into User (username, password, is_admin) values ('toto', 'pwd', 1);")
+                conn.execute("insert into Sensor (name, secret, owner) values ('s', 'secret', 1);")
+                conn.execute("insert into Project (name, owner, active_sensor) values ('p', 1, 1);")
+                conn.execute(
+                    """
+                    insert into Datapoint (sensor_id, project_id, timestamp, angle, temperature, battery)
+                    values
+                        (1, 1, datetime('2021-11-30 10:00'), 10, 20, 3),
+                        (1, 1, datetime('2021-11-30 11:00'), 9, 21, 3);
+                    """,
+                )
+
+            schema.initialise_db(bm_config)
+
+            with bm_config.db_connection() as conn:
+                summaries = self.check_summaries(conn)
+                assert summaries['ProjectSummary'] == [
+                    (1, 2, to_epoch(datetime(2021, 11, 30, 10)), 10, to_epoch(datetime(2021, 11, 30, 11)), 9, 21),
+                ]
+                assert conn.execute('select distinct typeof(timestamp) from Datapoint;').fetchall() == [('integer',)]
+                assert [d.timestamp for d in Datapoint.get_all(conn, project_id=1)] == [
+                    datetime(2021, 11, 30, 10),
+                    datetime(2021, 11, 30, 11),
+                ]
+
+
+class TestRollupTables:
+
+    @classmethod
+    def rollups(cls, conn):
+        return {
+            table: conn.execute(f'select * from {table} order by 1, 2, 3, 4;').fetchall()
+            for table in ('SensorRollup', 'ProjectRollup')
+        }
+
+    @classmethod
+    def check_rollups(cls, conn):
+        """The incremental rollups should match the ones computed from scratch."""
+        conn.commit()
+        incremental = cls.rollups(conn)
+        schema.rebuild_rollup_tables(conn)
+        rebuilt = cls.rollups(conn)
+        conn.rollback()
+        assert incremental == rebuilt
+        return incremental
+
+    def test_updated_on_insert(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            rollups = self.check_rollups(conn)
+
+        assert rollups['SensorRollup'], 'should have rollups'
+        assert rollups['ProjectRollup'], 'should have rollups'
+
+    def test_bucket_values(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [
+                # Inserted out of order on purpose, the last value is the latest one.
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 20), 8, 21, 3.5),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 10), 10, 20, 4),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 0), 12, 22, 4),
+                Datapoint(1, 1, datetime(2021, 11, 30, 11, 0), 6, 19, 3),
+            ])
+            self.check_rollups(conn)
+
+            row = conn.execute(
+                """
+                select datapoint_count, angle_min, angle_max, angle_sum, angle_last, last_timestamp
+                from ProjectRollup where period = 3600 and project_id = 1 and bucket = ?;
+                """,
+                (to_epoch(datetime(2021, 11, 30, 10)),),
+            ).fetchone()
+            assert row == (3, 8, 12, 30, 8, to_epoch(datetime(2021, 11, 30, 10, 20)))
+
+            assert conn.execute(
+                'select bucket, datapoint_count from SensorRollup where period = 86400;',
+            ).fetchall() == [(to_epoch(datetime(2021, 11, 30)), 4)]
+
+    @pytest.mark.parametrize('which', ('first', 'last', 'middle'))
+    def test_updated_on_delete(self, tmp_app, which):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            datapoints = sorted(Datapoint.get_all(conn, project_id=2), key=lambda d: d.timestamp)
+            to_delete = {'first': datapoints[0], 'last': datapoints[-1], 'middle': datapoints[3]}[which]
+            to_delete.delete(conn)
+
+            self.check_rollups(conn)
+
+    def test_removed_with_sensor_and_project(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            Sensor.find(conn, sensor_id=2).delete(conn)
+            Project.find(conn, project_id=1).delete(conn)
+            rollups = self.check_rollups(conn)
+
+        assert rollups == {'SensorRollup': [], 'ProjectRollup': []}
+
+    @pytest.mark.parametrize('owner', ({'project_id': 1}, {'project_id': 2}, {'sensor_id': 1}))
+    def test_delete_all(self, tmp_app, owner):
+        bm_config = config_from_client(tmp_app)
+        make_dummy_data(bm_config, 'admin')
+
+        with bm_config.db_connection() as conn:
+            Datapoint.delete_all(conn, **owner)
+            rollups = self.check_rollups(conn)
+            assert not Datapoint.get_all(conn, **owner)
+
+        assert rollups['SensorRollup'], 'the other datapoints should keep their rollups'
+
+    def test_migrations_compute_existing_data(self):
+        with NamedTemporaryFile() as db_file:
+            bm_config = Configuration({'sqlite file': db_file.name})
+            with bm_config.db_connection() as conn:
+                apply_migrations(conn, schema.migrations[:3])
+            # Data written before the rollup tables existed.
+            with bm_config.db_connection() as conn:
+                conn.execute("insert into User (username, password, is_admin) values ('toto', 'pwd', 1);")
+                conn.execute("insert into Sensor (name, secret, owner) values ('s', 'secret', 1);")
+                conn.execute("insert into Project (name, owner, active_sensor) values ('p', 1, 1);")
+                Datapoint.create_many(conn, [
+                    Datapoint(1, 1, datetime(2021, 11, 30, 10), 10, 20, 3),
+                    Datapoint(1, 1, datetime(2021, 11, 30, 11), 9, 21, 3),
+                ])
+
+            schema.initialise_db(bm_config)
+
+            with bm_config.db_connection() as conn:
+                rollups = self.check_rollups(conn)
+                # 2 hours and 1 day
+                assert len(rollups['SensorRollup']) == 3
+                assert len(rollups['ProjectRollup']) == 3
@@ -1,12 +1,18 @@
 import re
+import sqlite3
+import sys
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Type
+from typing import Callable, Dict, List, Tuple, Type
 
+import attr
 import pytest
+from brewmonitor.storage import tables
 from brewmonitor.storage.access import ProjectData
-from brewmonitor.storage.tables import BaseTable, Datapoint, Project, Sensor, User
+from brewmonitor.storage.cache import DataVersion
+from brewmonitor.storage.tables import BaseTable, Datapoint, Project, Rollup, Sensor, User, decode_timestamps, to_epoch
 from test_brewmonitor.constants import preset_when
-from test_brewmonitor.utils import config_from_client
+from test_brewmonitor.utils import config_from_client, query_plans
 
 
 class TestCoverage:
@@ -19,6 +25,8 @@ class TestCoverage:
             for cls_method in ('get_all', 'find', 'create'):
                 with pytest.raises(NotImplementedError):
                     getattr(BaseTable, cls_method)(conn)
+            with pytest.raises(NotImplementedError):
+                BaseTable.find_many(conn, [1])
 
             base_obj = super(User, User.create(conn, username='user', password='pass', is_admin=True))
             for method in ('edit', 'delete'):
@@ -34,6 +42,99 @@ def check_sub_fields(cls: Type[BaseTable], expected: Dict[str, str]):
     assert i == len(expected)
 
 
+class TestRowFactory:
+    @classmethod
+    @pytest.fixture
+    def datapoint_cursor(cls, request) -> sqlite3.Cursor:
+        # 1000 rows unless parametrized with indirect=True.
+        count = getattr(request, 'param', 1000)
+        conn = sqlite3.connect(':memory:')
+        conn.execute(Datapoint.create_table_req())
+        Datapoint.create_many(conn, (
+            Datapoint(i % 3, i % 2 or None, datetime(2021, 11, 30) + timedelta(minutes=i), i / 10, 20.5, 3.3)
+            for i in range(count)
+        ))
+        yield conn.execute('select id, project_id, sensor_id, angle, temperature, battery, timestamp from Datapoint;')
+        conn.close()
+
+    @pytest.mark.parametrize('cls, query', (
+        (User, 'select id, username, is_admin from User;'),
+        (Sensor, f'select id, name, secret, max_battery, min_battery, {", ".join(Sensor.sub_fields())} from Sensor;'),
+        (ProjectData, f'select id, name, active_sensor, {", ".join(Project.sub_fields())} from Project;'),
+    ))
+    def test_same_as_dict(self, preset_app, cls, query):
+        bm_config = config_from_client(preset_app)
+        cursor = bm_config.db_connection().execute(query)
+        rows = cursor.fetchall()
+        assert rows
+
+        factory = cls.row_factory_for(cursor)
+        for row in rows:
+            assert factory(cursor, row) == cls(**cls.row_factory_as_dict(cursor, row))
+
+    def test_cached_per_class_and_columns(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+        factory = Project.row_factory_for(db_conn.execute('select * from Project;'))
+
+        assert factory is Project.row_factory_for(db_conn.execute('select * from Project;'))
+        assert factory is not ProjectData.row_factory_for(db_conn.execute('select * from Project;'))
+        assert factory is not Project.row_factory_for(db_conn.execute('select id from Project;'))
+
+    def test_db_factory(self, tmp_app):
+        @attr.s
+        class Counted(BaseTable):
+            id = attr.ib(type=int)
+            count = attr.ib(type=int, metadata={'db_factory': lambda r: r['count'] * r['id']})
+
+        # Only needs to be built.
+        Counted.__abstractmethods__ = frozenset()
+
+        cursor = config_from_client(tmp_app).db_connection().execute('select 2 as id, 21 as count;')
+
+        assert Counted.row_factory_for(cursor)(cursor, cursor.fetchone()) == Counted(id=2, count=42)
+
+    def test_invalid_column_name(self, tmp_app):
+        cursor = config_from_client(tmp_app).db_connection().execute('select count(*) from User;')
+
+        with pytest.raises(ValueError):
+            User.row_factory_for(cursor)
+
+    def test_datapoints_same_as_dict(self, datapoint_cursor):
+        rows = datapoint_cursor.fetchall()
+        assert len(rows) == 1000
+
+        factory = Datapoint.row_factory_for(datapoint_cursor)
+        compiled_objects = [factory(datapoint_cursor, row) for row in rows]
+        dict_objects = [Datapoint(**Datapoint.row_factory_as_dict(datapoint_cursor, row)) for row in rows]
+
+        assert compiled_objects == dict_objects
+
+    @pytest.mark.benchmark
+    @pytest.mark.parametrize('datapoint_cursor', [100000], indirect=True)
+    def test_faster_than_dict(self, datapoint_cursor):
+        # Micro-benchmark on 100k rows, fetched first to only time the factories.
+        rows = datapoint_cursor.fetchall()
+        assert len(rows) == 100000
+
+        def _best_of_3(make: Callable) -> Tuple[float, List]:
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                objects = [make(datapoint_cursor, row) for row in rows]
+                timings.append(time.perf_counter() - start)
+            return min(timings), objects
+
+        def _dict_factory(cursor, row):
+            return Datapoint(**Datapoint.row_factory_as_dict(cursor, row))
+
+        dict_time, dict_objects = _best_of_3(_dict_factory)
+        compiled_time, compiled_objects = _best_of_3(Datapoint.row_factory_for(datapoint_cursor))
+
+        assert compiled_objects == dict_objects
+        assert compiled_time < dict_time, f'{compiled_time=:.3f}s {dict_time=:.3f}s'
+
+
 class TestUser:
     def test_sub_fields(self):
         check_sub_fields(User, {})
@@ -74,6 +175,14 @@ class TestUser:
                 is_admin=True,
             )
 
+    def test_find_many(self, preset_app):
+        bm_config = config_from_client(preset_app)
+
+        with bm_config.db_connection() as conn:
+            users = User.find_many(conn, [2, 1, 2, 42])
+
+        assert users == {1: User.find(conn, 1), 2: User.find(conn, 2)}
+
     def test_find_nothing(self, tmp_app):
         bm_config = config_from_client(tmp_app)
 
@@ -180,8 +289,8 @@ class TestSensor:
     def test_sub_fields(self):
         expected = {
             'owner': r'\(select \b\w+\b from User where .+\)',
-            'last_active': r'\(select \b\w+\b from Datapoint where .+\)',
-            'last_battery': r'\(select \b\w+\b from Datapoint where .+\)',
+            'last_active': r'\(select \b\w+\b from SensorSummary where .+\)',
+            'last_battery': r'\(select \b\w+\b from SensorSummary where .+\)',
             'linked_project': r'\(select \b\w+\b from Project where .+\)',
         }
         check_sub_fields(Sensor, expected)
@@ -224,6 +333,85 @@ class TestSensor:
 
         assert Sensor.find(bm_config.db_connection(), expected.id) == expected
 
+    def test_find_many(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+        ids = [s.id for s in Sensor.get_all(db_conn)]
+
+        sensors = Sensor.find_many(db_conn, ids + [42])
+
+        assert sensors == {s_id: Sensor.find(db_conn, s_id) for s_id in ids}
+
+    def test_find_many_in_chunks(self, preset_app, monkeypatch):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+        ids = [s.id for s in Sensor.get_all(db_conn)]
+        monkeypatch.setattr(Sensor, 'max_ids_per_query', 1)
+
+        statements = []
+        db_conn.set_trace_callback(statements.append)
+        try:
+            sensors = Sensor.find_many(db_conn, ids)
+        finally:
+            db_conn.set_trace_callback(None)
+
+        assert sensors.keys() == set(ids)
+        assert len(statements) == len(ids)
+
+    def test_find_many_nothing(self, preset_app):
+        bm_config = config_from_client(preset_app)
+
+        assert Sensor.find_many(bm_config.db_connection(), []) == {}
+
+    def test_get_assignments(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+
+        assignments = Sensor.get_assignments(db_conn)
+
+        sensors = Sensor.get_all(db_conn)
+        assert [a.sensor_id for a in assignments] == [s.id for s in sensors]
+        for assignment, sensor in zip(assignments, sensors):
+            project = Project.by_active_sensor(db_conn, sensor.id)
+            assert assignment == tables.SensorAssignment(
+                sensor.id,
+                sensor.name,
+                project.id if project else None,
+                project.name if project else None,
+            )
+        assert any(a.project_id is None for a in assignments), 'preset should have a detached sensor'
+        assert any(a.project_id is not None for a in assignments), 'preset should have an attached sensor'
+
+    def test_get_data_version(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+
+        with bm_config.db_connection() as conn:
+            owner = User.create(conn, username='user', password='pass', is_admin=False)
+            sensor = Sensor.create(conn, name='sensor', secret='secret', owner=owner)
+            project = Project.create(conn, name='project', owner=owner)
+
+        db_conn = bm_config.db_connection()
+        assert Sensor.get_data_version(db_conn, 1234) is None
+        assert Project.get_data_version(db_conn, 1234) is None
+        assert Sensor.get_data_version(db_conn, sensor.id) == DataVersion()
+        assert Project.get_data_version(db_conn, project.id) == DataVersion()
+
+        with db_conn:
+            Datapoint.create_many(db_conn, [
+                Datapoint(sensor.id, project.id, datetime(2021, 11, 30, 10, 10), 1, 20, 3),
+                Datapoint(sensor.id, project.id, datetime(2021, 11, 30, 10, 0), 2, 20, 3),
+            ])
+        versions = Sensor.get_data_version(db_conn, sensor.id), Project.get_data_version(db_conn, project.id)
+        last_id = max(d.id for d in Datapoint.get_all(db_conn, sensor_id=sensor.id))
+        for version in versions:
+            assert version == DataVersion(2, last_id, datetime(2021, 11, 30, 10, 10))
+
+        with db_conn:
+            Datapoint.find(db_conn, datapoint_id=last_id - 1).delete(db_conn)
+        # max_datapoint_id stays, the count and last_active change.
+        version = Sensor.get_data_version(db_conn, sensor.id)
+        assert version == DataVersion(1, last_id, datetime(2021, 11, 30, 10, 0))
+
     def test_find_nothing(self, preset_app):
         bm_config = config_from_client(preset_app)
 
@@ -383,11 +571,11 @@ class TestSensor:
 class TestProject:
     def test_sub_fields(self):
         expected = {
-            'first_active': r'\(select \b\w+\b from Datapoint where .+\)',
-            'first_angle': r'\(select \b\w+\b from Datapoint where .+\)',
-            'last_active': r'\(select \b\w+\b from Datapoint where .+\)',
-            'last_angle': r'\(select \b\w+\b from Datapoint where .+\)',
-            'last_temperature': r'\(select \b\w+\b from Datapoint where .+\)',
+            'first_active': r'\(select \b\w+\b from ProjectSummary where .+\)',
+            'first_angle': r'\(select \b\w+\b from ProjectSummary where .+\)',
+            'last_active': r'\(select \b\w+\b from ProjectSummary where .+\)',
+            'last_angle': r'\(select \b\w+\b from ProjectSummary where .+\)',
+            'last_temperature': r'\(select \b\w+\b from ProjectSummary where .+\)',
             'owner': r'\(select \b\w+\b from User where .+\)',
         }
         check_sub_fields(Project, expected)
@@ -435,6 +623,41 @@ class TestProject:
                 last_temperature=20.0,
             )
 
+    def test_find_many(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+        ids = [p.id for p in Project.get_all(db_conn)]
+
+        projects = Project.find_many(db_conn, ids + [42])
+
+        assert projects == {p_id: Project.find(db_conn, project_id=p_id) for p_id in ids}
+
+    def test_get_data_loads_sensors_at_once(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+
+        statements = []
+        db_conn.set_trace_callback(statements.append)
+        try:
+            with preset_app.app_context():
+                project = ProjectData.get_data(db_conn, 1)
+        finally:
+            db_conn.set_trace_callback(None)
+
+        assert project.sensors
+        assert sum('from Sensor where id' in statement for statement in statements) == 1
+
+    def test_get_data_without_datapoints(self, preset_app):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+
+        with preset_app.app_context():
+            project = ProjectData.get_data(db_conn, 1)
+            light = ProjectData.get_data(db_conn, 1, with_datapoints=False)
+
+        assert not light.data_points
+        assert light.sensors == project.sensors
+
     def test_find_nothing(self, preset_app):
         bm_config = config_from_client(preset_app)
 
@@ -742,6 +965,169 @@ class TestDatapoint:
             assert db_data[0].timestamp == datapoints[0].timestamp
             assert db_data[1].timestamp == datapoints[1].timestamp
 
+    @classmethod
+    @pytest.fixture
+    def window_app(cls, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        with bm_config.db_connection() as conn:
+            # Inserted out of order, ids 1 to 6.
+            Datapoint.create_many(conn, [
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 30), 1, 20, 3),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 0), 2, 20, 3),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 10), 3, 20, 3),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 10), 4, 20, 3),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 50), 5, 20, 3),
+                Datapoint(1, 2, datetime(2021, 11, 30, 10, 20), 6, 20, 3),
+            ])
+        return tmp_app
+
+    @pytest.mark.parametrize('window, expected_ids', (
+        ({}, [2, 3, 4, 1, 5]),
+        ({'since': datetime(2021, 11, 30, 10, 10)}, [3, 4, 1, 5]),
+        ({'until': datetime(2021, 11, 30, 10, 30)}, [2, 3, 4]),
+        ({'since': datetime(2021, 11, 30, 10, 10), 'until': datetime(2021, 11, 30, 10, 50)}, [3, 4, 1]),
+        ({'limit': 2}, [1, 5]),
+        ({'after_id': 3}, [4, 1, 5]),
+        ({'after_id': 3, 'limit': 2}, [4, 1]),
+        ({'after_id': 5}, []),
+        ({'after_id': 0, 'limit': 2}, [2, 3]),
+        ({'since': datetime(2021, 11, 30, 10, 10), 'limit': 10}, [3, 4, 1, 5]),
+    ))
+    def test_get_all_window(self, window_app, window, expected_ids):
+        bm_config = config_from_client(window_app)
+
+        datapoints = Datapoint.get_all(bm_config.db_connection(), project_id=1, **window)
+
+        assert [d.id for d in datapoints] == expected_ids
+
+    def test_get_all_pages(self, window_app):
+        bm_config = config_from_client(window_app)
+
+        pages = []
+        after_id = 0
+        while True:
+            page = Datapoint.get_all(bm_config.db_connection(), sensor_id=1, after_id=after_id, limit=4)
+            if not page:
+                break
+            pages.append([d.id for d in page])
+            after_id = page[-1].id
+
+        assert pages == [[2, 3, 4, 6], [1, 5]]
+
+    @pytest.mark.parametrize('page, expected_ids', (
+        ({}, [5, 1, 4, 3, 2]),
+        ({'length': 2}, [5, 1]),
+        ({'offset': 2, 'length': 2}, [4, 3]),
+        ({'offset': 1, 'length': 2, 'descending': False}, [3, 4]),
+        ({'since': datetime(2021, 11, 30, 10, 10), 'until': datetime(2021, 11, 30, 10, 50)}, [1, 4, 3]),
+        ({'offset': 10}, []),
+        ({'limit': 3}, [5, 1, 4]),
+        ({'limit': 3, 'offset': 1, 'length': 1}, [1]),
+        ({'after_id': 3, 'limit': 2, 'descending': False}, [4, 1]),
+        ({'after_id': 0, 'limit': 2}, [3, 2]),
+    ))
+    def test_get_page(self, window_app, page, expected_ids):
+        bm_config = config_from_client(window_app)
+
+        datapoints = Datapoint.get_page(bm_config.db_connection(), project_id=1, **page)
+
+        assert [d.id for d in datapoints] == expected_ids
+
+    @pytest.mark.parametrize('window, expected', (
+        ({}, 5),
+        ({'since': datetime(2021, 11, 30, 10, 10)}, 4),
+        ({'since': datetime(2021, 11, 30, 10, 10), 'until': datetime(2021, 11, 30, 10, 50)}, 3),
+        ({'limit': 3}, 3),
+        ({'limit': 10}, 5),
+        ({'after_id': 3}, 3),
+        ({'since': datetime(2021, 11, 30, 10, 10), 'after_id': 0, 'limit': 2}, 2),
+    ))
+    def test_count(self, window_app, window, expected):
+        bm_config = config_from_client(window_app)
+
+        assert Datapoint.count(bm_config.db_connection(), project_id=1, **window) == expected
+
+    @pytest.mark.parametrize('window, expected', (
+        ({}, (5, 5)),
+        ({'until': datetime(2021, 11, 30, 10, 30)}, (3, 4)),
+        ({'since': datetime(2021, 11, 30, 11, 0)}, (0, None)),
+    ))
+    def test_get_version(self, window_app, window, expected):
+        bm_config = config_from_client(window_app)
+
+        assert Datapoint.get_version(bm_config.db_connection(), project_id=1, **window) == expected
+
+    @pytest.mark.parametrize('column, owner, window, expected', (
+        ('project_id', {'sensor_id': 1}, {}, {1, 2}),
+        ('project_id', {'sensor_id': 1}, {'since': datetime(2021, 11, 30, 10, 30)}, {1}),
+        ('sensor_id', {'project_id': 2}, {}, {1}),
+        ('sensor_id', {'project_id': 3}, {}, set()),
+    ))
+    def test_distinct_ids(self, window_app, column, owner, window, expected):
+        bm_config = config_from_client(window_app)
+
+        assert Datapoint.distinct_ids(bm_config.db_connection(), column, **owner, **window) == expected
+
+    def test_distinct_ids_invalid(self, window_app):
+        bm_config = config_from_client(window_app)
+
+        with pytest.raises(ValueError):
+            Datapoint.distinct_ids(bm_config.db_connection(), 'angle', project_id=1)
+
+    @pytest.mark.parametrize('window', ({}, {'limit': 2}, {'after_id': 3}, {'since': datetime(2021, 11, 30, 10, 10)}))
+    def test_iter_all(self, window_app, window):
+        bm_config = config_from_client(window_app)
+        db_conn = bm_config.db_connection()
+
+        # Smaller batches than rows so it goes through several fetchmany().
+        datapoints = Datapoint.iter_all(db_conn, project_id=1, batch_size=2, **window)
+
+        assert not isinstance(datapoints, list)
+        assert list(datapoints) == Datapoint.get_all(db_conn, project_id=1, **window)
+
+    @pytest.mark.parametrize('window, expected', (
+        ({}, (datetime(2021, 11, 30, 10, 0), datetime(2021, 11, 30, 10, 50))),
+        ({'limit': 2}, (datetime(2021, 11, 30, 10, 30), datetime(2021, 11, 30, 10, 50))),
+        ({'until': datetime(2021, 11, 30, 10, 30)}, (datetime(2021, 11, 30, 10, 0), datetime(2021, 11, 30, 10, 10))),
+        ({'after_id': 5}, None),
+    ))
+    def test_get_span(self, window_app, window, expected):
+        bm_config = config_from_client(window_app)
+
+        assert Datapoint.get_span(bm_config.db_connection(), project_id=1, **window) == expected
+
+    def test_timestamp_stored_as_epoch(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+
+        with bm_config.db_connection() as conn:
+            owner = User.create(conn, username='user', password='pass', is_admin=True)
+            sensor = Sensor.create(conn, name='green', secret='secret', owner=owner)
+            Datapoint.create_many(conn, [
+                Datapoint(sensor.id, None, datetime(2021, 11, 30, 15, 10, 42, 1234), 13, 18, 3.4),
+            ])
+
+        with bm_config.db_connection() as conn:
+            assert conn.execute('select timestamp from Datapoint;').fetchall() == [(1638285042,)]
+            assert Datapoint.find(conn, datapoint_id=1).timestamp == datetime(2021, 11, 30, 15, 10, 42)
+            assert Sensor.find(conn, sensor_id=sensor.id).last_active == datetime(2021, 11, 30, 15, 10, 42)
+
+    def test_decode_timestamps(self):
+        assert to_epoch(datetime(1970, 1, 1, 0, 1)) == 60
+        assert to_epoch(60.5) == 60
+        assert to_epoch('1970-01-01T00:01:00') == 60
+        assert to_epoch('1970-01-01 00:01:00') == 60
+        assert to_epoch('1970-01-01T01:01:00+01:00') == 60
+        assert to_epoch('1970-01-01T00:01:00Z') == 60
+        with pytest.raises(ValueError):
+            to_epoch('yesterday')
+        assert decode_timestamps([60, 120]) == [datetime(1970, 1, 1, 0, 1), datetime(1970, 1, 1, 0, 2)]
+        # Legacy text values and null are still read.
+        assert decode_timestamps([60, '2021-11-30 15:10:42', None]) == [
+            datetime(1970, 1, 1, 0, 1),
+            datetime(2021, 11, 30, 15, 10, 42),
+            None,
+        ]
+
     def test_find(self, preset_app):
         bm_config = config_from_client(preset_app)
 
@@ -785,3 +1171,261 @@ class TestDatapoint:
         with bm_config.db_connection() as conn:
             with pytest.raises(RuntimeError):
                 datapoints[0].edit(conn)
+
+
+class TestDatapointSeries:
+    @classmethod
+    @pytest.fixture
+    def datapoints(cls) -> List[Datapoint]:
+        return [
+            Datapoint(1, 1, datetime(2021, 11, 30, 10, 0), 10.5, 20, 3.5, id=1),
+            Datapoint(2, None, datetime(2021, 11, 30, 10, 10), 11, None, 3.4, id=2),
+            Datapoint(1, 2, datetime(2021, 11, 30, 9, 50), 12, 21, None, id=3),
+        ]
+
+    def test_row_views(self, datapoints):
+        series = tables.DatapointSeries.of(datapoints)
+
+        assert len(series) == 3
+        assert list(series) == datapoints, 'None should be read back as None'
+        assert series[1] == datapoints[1]
+        assert series[-1] == datapoints[-1]
+        with pytest.raises(IndexError):
+            series[3]
+
+    def test_slice(self, datapoints):
+        series = tables.DatapointSeries.of(datapoints)
+
+        assert isinstance(series[1:], tables.DatapointSeries)
+        assert list(series[1:]) == datapoints[1:]
+        assert list(series[::-1]) == datapoints[::-1]
+
+    def test_as_columns(self, datapoints):
+        series = tables.DatapointSeries.of(datapoints)
+
+        assert series.as_columns() == {
+            'id': [1, 2, 3],
+            'project_id': [1, None, 2],
+            'sensor_id': [1, 2, 1],
+            'angle': [10.5, 11.0, 12.0],
+            'temperature': [20.0, None, 21.0],
+            'battery': [3.5, 3.4, None],
+            'timestamp': [to_epoch(d.timestamp) for d in datapoints],
+        }
+        assert series[:1].as_columns(('id', 'temperature')) == {'id': [1], 'temperature': [20.0]}
+
+    def test_of_series_unchanged(self, datapoints):
+        series = tables.DatapointSeries.of(datapoints)
+
+        assert tables.DatapointSeries.of(series) is series
+
+    def test_columns(self, datapoints):
+        series = tables.DatapointSeries.of(datapoints)
+
+        assert list(series.timestamp) == [to_epoch(d.timestamp) for d in datapoints]
+        assert list(series.angle) == [10.5, 11, 12]
+        assert series.sensor_ids() == {1, 2}
+        assert series.project_ids() == {1, 2}
+        assert series.span() == (datetime(2021, 11, 30, 9, 50), datetime(2021, 11, 30, 10, 10))
+
+    def test_empty(self):
+        series = tables.DatapointSeries.of([])
+
+        assert len(series) == 0
+        assert list(series) == []
+        assert series.span() is None
+        assert series.sensor_ids() == set()
+
+    @pytest.mark.parametrize('window', ({}, {'limit': 2}, {'after_id': 3}, {'since': datetime(2021, 11, 30, 10, 10)}))
+    def test_get_series(self, preset_app, window):
+        bm_config = config_from_client(preset_app)
+        db_conn = bm_config.db_connection()
+        project_id = db_conn.execute('select project_id from Datapoint where project_id is not null;').fetchone()[0]
+
+        series = Datapoint.get_series(db_conn, project_id, **window)
+
+        assert list(series) == Datapoint.get_all(db_conn, project_id, **window)
+
+    def test_smaller_than_objects(self):
+        datapoints = [
+            Datapoint(1, 1, datetime(2021, 11, 30) + timedelta(minutes=10 * i), 10.5, 20.1, 3.5, id=i + 1)
+            for i in range(1000)
+        ]
+
+        series = tables.DatapointSeries.of(datapoints)
+
+        series_size = sum(sys.getsizeof(column) for column in vars(series).values())
+        objects_size = sum(
+            sys.getsizeof(d) + sys.getsizeof(d.__dict__) + sys.getsizeof(d.timestamp)
+            for d in datapoints
+        )
+        assert series_size * 3 < objects_size
+
+
+class TestRollup:
+    @classmethod
+    @pytest.fixture
+    def rollup_app(cls, tmp_app):
+        bm_config = config_from_client(tmp_app)
+        with bm_config.db_connection() as conn:
+            Datapoint.create_many(conn, [
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 0), 12, 22, 4),
+                Datapoint(1, 1, datetime(2021, 11, 30, 10, 30), 8, 20, 3),
+                Datapoint(2, 1, datetime(2021, 11, 30, 10, 10), 30, 18, 2),
+                Datapoint(1, None, datetime(2021, 11, 30, 11, 0), 6, 19, 3),
+            ])
+        return tmp_app
+
+    def test_get_all_for_project(self, rollup_app):
+        bm_config = config_from_client(rollup_app)
+
+        rollups = Rollup.get_all(bm_config.db_connection(), Rollup.periods['hour'], project_id=1)
+
+        assert [(r.sensor_id, r.project_id, r.timestamp, r.datapoint_count) for r in rollups] == [
+            (1, 1, datetime(2021, 11, 30, 10), 2),
+            (2, 1, datetime(2021, 11, 30, 10), 1),
+        ]
+        assert (rollups[0].angle_min, rollups[0].angle_max, rollups[0].angle_mean, rollups[0].angle_last) == (
+            8, 12, 10, 8,
+        )
+        assert rollups[0].temperature_mean == 21
+        assert rollups[0].battery_mean == 3.5
+
+    def test_get_all_for_sensor(self, rollup_app):
+        bm_config = config_from_client(rollup_app)
+
+        hours = Rollup.get_all(bm_config.db_connection(), Rollup.periods['hour'], sensor_id=1)
+        days = Rollup.get_all(bm_config.db_connection(), Rollup.periods['day'], sensor_id=1)
+
+        assert [(r.project_id, r.timestamp, r.datapoint_count) for r in hours] == [
+            (None, datetime(2021, 11, 30, 10), 2),
+            (None, datetime(2021, 11, 30, 11), 1),
+        ]
+        assert [(r.timestamp, r.datapoint_count, r.angle_last) for r in days] == [
+            (datetime(2021, 11, 30), 3, 6),
+        ]
+
+    @pytest.mark.parametrize('window, expected', (
+        ({'since': datetime(2021, 11, 30, 10, 59)}, [10, 11]),
+        ({'since': datetime(2021, 11, 30, 11)}, [11]),
+        ({'until': datetime(2021, 11, 30, 11)}, [10]),
+        ({'until': datetime(2021, 11, 30, 11, 1)}, [10, 11]),
+    ))
+    def test_get_all_window(self, rollup_app, window, expected):
+        bm_config = config_from_client(rollup_app)
+
+        rollups = Rollup.get_all(bm_config.db_connection(), Rollup.periods['hour'], sensor_id=1, **window)
+
+        assert [r.timestamp.hour for r in rollups] == expected
+
+    def test_get_all_invalid(self, tmp_app):
+        bm_config = config_from_client(tmp_app)
+
+        with pytest.raises(ValueError):
+            Rollup.get_all(bm_config.db_connection(), project_id=1)
+        with pytest.raises(NotImplementedError):
+            Rollup.get_all(bm_config.db_connection(), Rollup.periods['hour'])
+
+    def test_read_only(self, rollup_app):
+        bm_config = config_from_client(rollup_app)
+        with bm_config.db_connection() as conn:
+            rollup = Rollup.get_all(conn, Rollup.periods['hour'], sensor_id=1)[0]
+
+            with pytest.raises(RuntimeError):
+                Rollup.find(conn)
+            with pytest.raises(RuntimeError):
+                Rollup.create(conn)
+            with pytest.raises(RuntimeError):
+                rollup.edit(conn, angle_min=1)
+            with pytest.raises(RuntimeError):
+                rollup.delete(conn)
+
+    def test_as_datapoint(self, rollup_app):
+        bm_config = config_from_client(rollup_app)
+
+        rollup = Rollup.get_all(bm_config.db_connection(), Rollup.periods['hour'], project_id=1)[0]
+
+        assert rollup.as_datapoint() == Datapoint(1, 1, datetime(2021, 11, 30, 10), 10, 21, 3.5)
+
+
+class TestQueryPlans:
+    """The hot queries should search the Datapoint indexes instead of a full scan."""
+
+    project_index = Datapoint.index_name(('project_id', 'timestamp'))
+    sensor_index = Datapoint.index_name(('sensor_id', 'timestamp'))
+
+    @classmethod
+    def check_plans(cls, plans: List[str], expected_index: str):
+        assert plans, 'should have executed at least one statement'
+        for plan in plans:
+            assert 'SCAN Datapoint' not in plan, plan
+            assert 'TEMP B-TREE' not in plan, plan
+        assert any(expected_index in plan for plan in plans), plans
+
+    @pytest.mark.parametrize('query, expected_index', (
+        (lambda conn: Datapoint.get_all(conn, project_id=1), project_index),
+        (lambda conn: Datapoint.get_all(conn, sensor_id=1), sensor_index),
+        (lambda conn: Datapoint.get_all(conn, project_id=1, since=preset_when, until=preset_when), project_index),
+        (lambda conn: Datapoint.get_all(conn, project_id=1, limit=2), project_index),
+        (lambda conn: Datapoint.get_all(conn, sensor_id=1, after_id=3, limit=2), sensor_index),
+        (lambda conn: Datapoint.get_page(conn, project_id=1, offset=10, length=10), project_index),
+        (lambda conn: Datapoint.get_page(conn, sensor_id=1, since=preset_when, descending=False), sensor_index),
+        (lambda conn: Datapoint.count(conn, project_id=1, since=preset_when), project_index),
+    ))
+    def test_reads_use_index(self, preset_app, query, expected_index):
+        bm_config = config_from_client(preset_app)
+
+        with bm_config.db_connection() as conn:
+            self.check_plans(query_plans(conn, lambda: query(conn)), expected_index)
+
+    @pytest.mark.parametrize('query, summary_table', (
+        (lambda conn: Sensor.get_all(conn), 'SensorSummary'),
+        (lambda conn: Sensor.find(conn, sensor_id=1), 'SensorSummary'),
+        (lambda conn: Project.get_all(conn), 'ProjectSummary'),
+        (lambda conn: Project.find(conn, project_id=1), 'ProjectSummary'),
+        (lambda conn: Project.by_active_sensor(conn, sensor_id=1), 'ProjectSummary'),
+    ))
+    def test_reads_use_summary(self, preset_app, query, summary_table):
+        bm_config = config_from_client(preset_app)
+
+        with bm_config.db_connection() as conn:
+            plans = query_plans(conn, lambda: query(conn))
+
+        for plan in plans:
+            assert 'Datapoint' not in plan, plan
+            assert f'SEARCH {summary_table} USING INTEGER PRIMARY KEY' in plan, plan
+
+    def test_by_active_sensor_uses_index(self, preset_app):
+        bm_config = config_from_client(preset_app)
+
+        with bm_config.db_connection() as conn:
+            plans = query_plans(conn, lambda: Project.by_active_sensor(conn, sensor_id=1))
+        assert Project.index_name(('active_sensor',)) in plans[0]
+
+    def test_get_assignments_uses_index(self, preset_app):
+        bm_config = config_from_client(preset_app)
+
+        with bm_config.db_connection() as conn:
+            plans = query_plans(conn, lambda: Sensor.get_assignments(conn))
+        assert len(plans) == 1
+        assert Project.index_name(('active_sensor',)) in plans[0]
+        assert 'Summary' not in plans[0]
+
+    @pytest.mark.parametrize('to_delete, expected_index', (
+        ('sensor', sensor_index),
+        ('project', project_index),
+    ))
+    def test_cascade_delete_uses_index(self, tmp_app, to_delete, expected_index):
+        bm_config = config_from_client(tmp_app)
+
+        with bm_config.db_connection() as conn:
+            owner = User.create(conn, username='user', password='pass', is_admin=False)
+            objects = {
+                'project': Project.create(conn, name='project', owner=owner),
+                'sensor': Sensor.create(conn, name='sensor', secret='secret', owner=owner),
+            }
+
+        with bm_config.db_connection() as conn:
+            obj = objects[to_delete]
+            plans = query_plans(conn, lambda: obj.delete(conn))
+        self.check_plans([p for p in plans if 'Datapoint' in p], expected_index)
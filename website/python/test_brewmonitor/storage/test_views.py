@@ -0,0 +1,188 @@
+import sqlite3
+from datetime import datetime
+from http import HTTPStatus
+
+import pytest
+from brewmonitor.storage import access
+from brewmonitor.storage.tables import Datapoint, Project, Sensor
+from flask import url_for
+from make_dummy_data import make_dummy_data
+from test_brewmonitor.utils import config_from_client, find_sensor, find_user
+
+
+@pytest.fixture
+def ingest(tmp_app):
+    bm_config = config_from_client(tmp_app)
+    make_dummy_data(bm_config, 'admin')
+
+    with tmp_app.test_request_context():
+        with tmp_app.test_client() as client:
+            yield client
+
+
+def _sensor_ids(client):
+    bm_config = config_from_client(client.application)
+    with bm_config.db_connection() as conn:
+        green = find_sensor(conn, 'green sensor')  # attached to project 1
+        sad = find_sensor(conn, 'sad sensor')  # not attached
+    return green.id, sad.id
+
+
+def _count(client, sensor_id: int) -> int:
+    bm_config = config_from_client(client.application)
+    with bm_config.db_connection() as conn:
+        return len(Datapoint.get_all(conn, sensor_id=sensor_id))
+
+
+def _entry(sensor_id: int, secret: str = 'secret', **kwargs):
+    return dict(sensor_id=sensor_id, angle=14.3, temperature=20.3, battery=2.6, secret=secret, **kwargs)
+
+
+def test_add_one(ingest):
+    green, _ = _sensor_ids(ingest)
+    before = _count(ingest, green)
+
+    resp = ingest.post(url_for('storage.add_data'), json=_entry(green))
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json['created'][0]['project_id'] == 1
+    assert resp.headers['project_id'] == '1'
+    assert _count(ingest, green) == before + 1
+
+
+@pytest.mark.parametrize('entry, status', (
+    ({'sensor_id': 1, 'angle': 1, 'temperature': 1, 'battery': 1}, HTTPStatus.BAD_REQUEST),
+    ({'sensor_id': 1, 'secret': 'secret'}, HTTPStatus.BAD_REQUEST),
+    (_entry(42), HTTPStatus.NOT_FOUND),
+    (_entry(1, secret='wrong'), HTTPStatus.NOT_FOUND),
+))
+def test_add_one_invalid(ingest, entry, status):
+    resp = ingest.post(url_for('storage.add_data'), json=entry)
+
+    assert resp.status_code == status
+    assert resp.json['errors']
+
+
+def test_add_iso_timestamp(ingest):
+    green, _ = _sensor_ids(ingest)
+    bm_config = config_from_client(ingest.application)
+
+    resp = ingest.post(url_for('storage.add_data'), json=_entry(green, timestamp='2021-11-26T10:00:00'))
+    assert resp.status_code == HTTPStatus.OK
+
+    with bm_config.db_connection() as conn:
+        assert datetime(2021, 11, 26, 10) in [d.timestamp for d in Datapoint.get_all(conn, sensor_id=green)]
+
+    resp = ingest.post(url_for('storage.add_data'), json=[
+        _entry(green, timestamp='yesterday'),
+        _entry(green, timestamp=[1]),
+        _entry(green, timestamp='2021-11-26 10:05:00'),
+    ])
+    assert resp.status_code == HTTPStatus.OK
+    assert [r['status'] for r in resp.json['results']] == [
+        HTTPStatus.BAD_REQUEST,
+        HTTPStatus.BAD_REQUEST,
+        HTTPStatus.CREATED,
+    ]
+
+
+def test_add_many(ingest):
+    green, sad = _sensor_ids(ingest)
+    green_before = _count(ingest, green)
+    sad_before = _count(ingest, sad)
+
+    resp = ingest.post(url_for('storage.add_data'), json=[
+        _entry(green, timestamp=1638262800),
+        _entry(sad),
+        _entry(green, timestamp=1638263400),
+        _entry(green, secret='wrong'),
+        _entry(42),
+        {'sensor_id': green},
+        'not an entry',
+    ])
+
+    assert resp.status_code == HTTPStatus.OK
+    assert [r['status'] for r in resp.json['results']] == [
+        HTTPStatus.CREATED,
+        HTTPStatus.CREATED,
+        HTTPStatus.CREATED,
+        HTTPStatus.NOT_FOUND,
+        HTTPStatus.NOT_FOUND,
+        HTTPStatus.BAD_REQUEST,
+        HTTPStatus.BAD_REQUEST,
+    ]
+    assert [d['project_id'] for d in resp.json['created']] == [1, None, 1]
+    assert _count(ingest, green) == green_before + 2
+    assert _count(ingest, sad) == sad_before + 1
+
+
+def test_add_many_checks_sensor_once(ingest, monkeypatch):
+    green, _ = _sensor_ids(ingest)
+    calls = []
+    credentials = Sensor.credentials
+
+    def _counting(db_conn, sensor_id):
+        calls.append(sensor_id)
+        return credentials(db_conn, sensor_id)
+
+    monkeypatch.setattr(Sensor, 'credentials', _counting)
+
+    resp = ingest.post(url_for('storage.add_data'), json=[_entry(green, timestamp=i) for i in range(50)])
+    assert resp.status_code == HTTPStatus.OK
+    assert len(resp.json['created']) == 50
+    assert calls == [green]
+
+    resp = ingest.post(url_for('storage.add_data'), json=_entry(green))
+    assert resp.status_code == HTTPStatus.OK
+    assert calls == [green], 'should be cached'
+
+
+@pytest.mark.parametrize('many', [False, True])
+def test_add_db_error(ingest, monkeypatch, many):
+    green, _ = _sensor_ids(ingest)
+
+    def locked(sensor_id):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(access, 'get_sensor_credentials', locked)
+    monkeypatch.setitem(ingest.application.config, 'PROPAGATE_EXCEPTIONS', False)
+
+    entry = _entry(green)
+    resp = ingest.post(url_for('storage.add_data'), json=[entry, entry] if many else entry)
+    assert resp.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def test_cache_invalidated(ingest):
+    green, sad = _sensor_ids(ingest)
+    bm_config = config_from_client(ingest.application)
+
+    resp = ingest.post(url_for('storage.add_data'), json=[_entry(green), _entry(sad)])
+    assert [d['project_id'] for d in resp.json['created']] == [1, None]
+
+    with bm_config.db_connection() as conn:
+        sensor = Sensor.find(conn, green)
+        owner = find_user(conn, sensor.owner)
+        project = Project.find(conn, project_id=2)
+    with ingest.application.test_request_context(method='POST'):
+        access.edit_sensor(sensor, sensor.name, 'new secret', owner, sensor.max_battery, sensor.min_battery)
+        access.update_project_sensor(project, sad)
+
+    resp = ingest.post(url_for('storage.add_data'), json=[_entry(green), _entry(green, 'new secret'), _entry(sad)])
+    assert [r['status'] for r in resp.json['results']] == [
+        HTTPStatus.NOT_FOUND,
+        HTTPStatus.CREATED,
+        HTTPStatus.CREATED,
+    ]
+    assert [d['project_id'] for d in resp.json['created']] == [1, 2]
+
+    with ingest.application.test_request_context(method='POST'):
+        access.remove_sensor(access.get_sensor(sad))
+
+    resp = ingest.post(url_for('storage.add_data'), json=_entry(sad))
+    assert resp.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_add_many_empty(ingest):
+    resp = ingest.post(url_for('storage.add_data'), json=[])
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
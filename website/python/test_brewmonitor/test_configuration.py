@@ -0,0 +1,78 @@
+import threading
+from tempfile import NamedTemporaryFile
+
+import pytest
+from brewmonitor.configuration import Configuration, ConnectionPool
+
+
+@pytest.fixture
+def bm_config():
+    with NamedTemporaryFile() as db_file:
+        bm_config = Configuration({'sqlite file': db_file.name})
+        yield bm_config
+        bm_config.db_pool.close()
+
+
+def test_reuse_connection_in_thread(bm_config):
+    conn = bm_config.db_connection()
+
+    assert bm_config.db_connection() is conn
+    assert bm_config.db_pool.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_connection_per_thread(bm_config):
+    conn = bm_config.db_connection()
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(bm_config.db_connection()))
+    thread.start()
+    thread.join()
+
+    assert other[0] is not conn
+    assert bm_config.db_pool.stats() == {'hits': 0, 'misses': 2}
+
+
+def test_close(bm_config):
+    conn = bm_config.db_connection()
+    bm_config.db_pool.close()
+
+    assert bm_config.db_connection() is not conn
+    with pytest.raises(Exception):
+        conn.execute('select 1;')
+
+
+def test_default_pragmas(bm_config):
+    conn = bm_config.db_connection()
+
+    assert conn.execute('pragma journal_mode;').fetchone() == ('wal',)
+    assert conn.execute('pragma busy_timeout;').fetchone() == (5000,)
+    assert conn.execute('pragma synchronous;').fetchone() == (1,)  # normal
+    assert conn.execute('pragma foreign_keys;').fetchone() == (0,)
+
+
+def test_pragmas_from_config():
+    with NamedTemporaryFile() as db_file, NamedTemporaryFile('w') as config_file:
+        config_file.write(f"""
+sqlite file: {db_file.name}
+sqlite pragmas:
+  cache_size: -2000
+  foreign_keys: on
+""")
+        config_file.flush()
+
+        bm_config = Configuration.load(config_file.name)
+        conn = bm_config.db_connection()
+
+        assert conn.execute('pragma cache_size;').fetchone() == (-2000,)
+        assert conn.execute('pragma foreign_keys;').fetchone() == (1,)
+        assert conn.execute('pragma journal_mode;').fetchone() == ('wal',), 'should keep the defaults'
+        bm_config.db_pool.close()
+
+
+@pytest.mark.parametrize('pragmas', (
+    {'journal_mode; drop table User': 'wal'},
+    {'journal_mode': 'wal; drop table User'},
+))
+def test_invalid_pragmas(pragmas):
+    with pytest.raises(ValueError):
+        ConnectionPool(':memory:', pragmas)
@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta
+
+from brewmonitor.storage.tables import Datapoint, Project
+from make_synthetic_data import make_synthetic_data, plan_brews, sensor_datapoints
+from test_brewmonitor.utils import config_from_client
+
+
+when = datetime(2021, 11, 30)
+
+
+def test_make_synthetic_data(tmp_app):
+    bm_config = config_from_client(tmp_app)
+
+    with tmp_app.app_context():
+        total, seed = make_synthetic_data(
+            bm_config,
+            'admin',
+            sensors=3,
+            projects=4,
+            days=20,
+            interval=timedelta(minutes=30),
+            gap_rate=0.01,
+            chunk_size=500,
+            when=when,
+            seed=1,
+        )
+
+    assert seed == 1
+    conn = bm_config.db_connection()
+    assert conn.execute('select count(*) from Datapoint;').fetchone() == (total,)
+    assert 3 * 20 * 48 * 0.5 < total < 3 * 20 * 48, 'should have gaps'
+    assert conn.execute('select count(*) from User;').fetchone() == (2,)
+
+    # Sensor 1 brews projects 1 and 4, the last one is still going.
+    assert {p.id: p.active_sensor for p in Project.get_all(conn)} == {1: None, 2: 2, 3: 3, 4: 1}
+    assert Datapoint.distinct_ids(conn, 'project_id', sensor_id=1) == {1, 4}
+    assert conn.execute('select count(*) from Datapoint where project_id is null;').fetchone()[0] > 0
+
+    first, last = conn.execute(
+        """
+        select min(timestamp), max(timestamp) from Datapoint where project_id=1;
+        """,
+    ).fetchone()
+    angles = [d.angle for d in Datapoint.get_all(conn, project_id=1)]
+    assert 45 < angles[0] < 75, 'original gravity'
+    assert angles[-1] < angles[0] - 10, 'should have fermented'
+    assert last - first > 5 * 24 * 3600
+
+
+def test_sensor_datapoints_same_seed():
+    def _make(seed: int):
+        rng = random.Random(seed)
+        brews = plan_brews(rng, [1, 2], when - timedelta(days=4), when)
+        return list(sensor_datapoints(rng, 1, brews, when - timedelta(days=4), when, timedelta(minutes=15), 0.01))
+
+    assert _make(7) == _make(7)
+    assert _make(7) != _make(8)
@@ -0,0 +1,81 @@
+import math
+import time
+from datetime import date, datetime, timedelta
+
+import attr
+import pytest
+from brewmonitor import json, serialize
+from brewmonitor.storage.tables import Datapoint
+
+
+def _datapoints(count: int):
+    start = datetime(2021, 11, 30)
+    return [
+        Datapoint(
+            1,
+            i % 3 or None,
+            start + timedelta(minutes=i, microseconds=i % 2),
+            20 + i % 50 / 7,
+            None if i % 5 else 18.25,
+            3.3 + i % 9 / 13,
+            id=i + 1,
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize('obj', (
+    [],
+    {},
+    [{}, {}],
+    [1.5, None, math.nan, math.inf, -math.inf, 2],
+    [math.nan, math.inf],
+    [True, False, None, 0, 1],
+    ['é', '"quoted"', 'back\\slash', '\n'],
+    {'100%': [1, 2], '%s': 'a'},
+    [{'a': 1, 'b': datetime(2021, 11, 30)}, {'a': 2, 'b': None}],
+    [{'a': 1}, {'b': 2}],
+    {1: 'int key', 'b': [datetime(2021, 11, 30)]},
+    [{1: datetime(2021, 11, 30)}],
+    {'nested': {'dates': [date(2021, 11, 30), datetime(2021, 11, 30, 10, 1, 2, 3)]}},
+    (datetime(2021, 11, 30), (1, 2)),
+    [attr.asdict(d) for d in _datapoints(10)],
+    datetime(2021, 11, 30),
+    'plain',
+    None,
+))
+def test_encode_column_same_as_json(obj):
+    assert serialize.encode_column([obj]) == [json.dumps(obj)]
+    assert serialize.encode_column([obj, obj]) == [json.dumps(obj)] * 2
+
+
+def test_encode_column_unknown_type():
+    with pytest.raises(TypeError):
+        serialize.encode_column([[object()]])
+
+
+def test_encode_objects_same_as_json():
+    datapoints = _datapoints(50)
+
+    assert serialize.encode_objects(datapoints, Datapoint) == [json.dumps(attr.asdict(d)) for d in datapoints]
+    assert serialize.encode_objects([], Datapoint) == []
+
+
+def _best_of(func, repeat: int = 3) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+@pytest.mark.benchmark
+def test_encode_objects_faster():
+    # The exports used to encode each object with json.dumps.
+    datapoints = _datapoints(20000)
+
+    encoded = _best_of(lambda: serialize.encode_objects(datapoints, Datapoint))
+    dumped = _best_of(lambda: [json.dumps(attr.asdict(d)) for d in datapoints])
+
+    assert encoded < dumped, f'{encoded=:.3f}s {dumped=:.3f}s'
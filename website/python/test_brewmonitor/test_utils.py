@@ -0,0 +1,114 @@
+import csv
+import io
+from datetime import datetime
+from http import HTTPStatus
+
+import attr
+import pytest
+from brewmonitor import json, utils
+from brewmonitor.storage.tables import Datapoint
+from brewmonitor.utils import not_modified, stream_export, with_etag
+from flask import Flask, Response
+
+
+def _datapoints(count: int):
+    for i in range(count):
+        yield Datapoint(1, 1, datetime(2021, 11, 30, 10, i % 60), i, 20.5, None, id=i + 1)
+
+
+class TestStreamExport:
+    def test_json_same_as_dumps(self):
+        resp = stream_export('out.json', 'json', _datapoints(3), Datapoint)
+
+        assert resp.is_streamed
+        assert resp.mimetype == 'application/json'
+        assert resp.headers['Content-Disposition'] == 'attachment; filename=out.json'
+        assert resp.get_data(as_text=True) == json.dumps([attr.asdict(d) for d in _datapoints(3)])
+
+    def test_json_empty(self):
+        resp = stream_export('out.json', 'json', iter([]), Datapoint)
+
+        assert resp.get_data(as_text=True) == '[]'
+
+    def test_ndjson(self):
+        resp = stream_export('out.ndjson', 'ndjson', _datapoints(3), Datapoint)
+
+        assert resp.get_data(as_text=True).splitlines() == [json.dumps(attr.asdict(d)) for d in _datapoints(3)]
+
+    def test_csv(self):
+        resp = stream_export('out.csv', 'csv', _datapoints(3), Datapoint)
+
+        assert resp.mimetype == 'text/csv'
+        reader = csv.reader(io.StringIO(resp.get_data(as_text=True)))
+        header = next(reader)
+        assert header == [f.name for f in attr.fields(Datapoint)]
+        rows = [dict(zip(header, row)) for row in reader]
+        assert len(rows) == 3
+        assert rows[2] == {
+            'sensor_id': '1',
+            'project_id': '1',
+            'timestamp': '2021-11-30 10:02:00',
+            'angle': '2',
+            'temperature': '20.5',
+            'battery': '',
+            'id': '3',
+        }
+
+    def test_csv_header_only_when_empty(self):
+        resp = stream_export('out.csv', 'csv', iter([]), Datapoint)
+
+        assert resp.get_data(as_text=True) == 'sensor_id,project_id,timestamp,angle,temperature,battery,id\r\n'
+
+    def test_invalid_format(self):
+        resp = stream_export('out.xls', 'xls', _datapoints(3), Datapoint)
+
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.parametrize('_format', ('csv', 'json', 'ndjson'))
+    def test_chunks(self, monkeypatch, _format):
+        monkeypatch.setattr(utils, 'export_chunk_size', 10)
+        consumed = []
+
+        def _data():
+            for d in _datapoints(25):
+                consumed.append(d.id)
+                yield d
+
+        resp = stream_export(f'out.{_format}', _format, _data(), Datapoint)
+        chunks = resp.response
+        next(chunks)
+        assert len(consumed) < 25, 'should not read everything for the first chunk'
+        assert len(list(chunks)) == 2
+        assert len(consumed) == 25
+
+
+class TestValidators:
+    @pytest.mark.parametrize('headers, expected', (
+        ({}, False),
+        ({'If-None-Match': '"abc"'}, True),
+        ({'If-None-Match': '"def"'}, False),
+        # There is no Last-Modified to compare with.
+        ({'If-Modified-Since': 'Tue, 30 Nov 2021 10:00:00 GMT'}, False),
+        ({'If-None-Match': '"abc"', 'If-Modified-Since': 'Tue, 30 Nov 2021 10:00:00 GMT'}, True),
+    ))
+    def test_not_modified(self, headers, expected):
+        with Flask(__name__).test_request_context(headers=headers):
+            resp = not_modified('abc')
+
+        if expected:
+            assert resp.status_code == HTTPStatus.NOT_MODIFIED
+            assert resp.headers['ETag'] == '"abc"'
+        else:
+            assert resp is None
+
+    def test_with_etag(self):
+        resp = with_etag(Response('content'), 'abc')
+
+        assert resp.headers['ETag'] == '"abc"'
+        assert 'Last-Modified' not in resp.headers
+        assert resp.headers['Cache-Control'] == 'no-cache'
+
+    def test_with_etag_error(self):
+        resp = with_etag(Response('Invalid format', status=HTTPStatus.BAD_REQUEST), 'abc')
+
+        assert 'ETag' not in resp.headers
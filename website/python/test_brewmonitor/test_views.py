@@ -0,0 +1,16 @@
+from http import HTTPStatus
+
+from brewmonitor.storage import access
+from brewmonitor.storage.passwords import PasswordHasherBusy
+from flask import url_for
+
+
+def test_login_busy(public_client, monkeypatch):
+    def _busy(username, password):
+        raise PasswordHasherBusy()
+
+    monkeypatch.setattr(access, 'verify_user', _busy)
+
+    resp = public_client.post(url_for('home.check_login'), data={'username': 'toto', 'password': 'admin'})
+    assert resp.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert b'Too many logins' in resp.data
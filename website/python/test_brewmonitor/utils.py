@@ -2,7 +2,7 @@ import abc
 import os
 from copy import deepcopy
 from tempfile import NamedTemporaryFile
-from typing import Optional
+from typing import Callable, Dict, List, Optional
 
 import yaml
 from brewmonitor.app import make_app
@@ -81,9 +81,29 @@ def find_project(db_conn, project_name: str) -> Optional[Project]:
     return None
 
 
-def make_clean_client(config_file: NamedTemporaryFile, db_file: NamedTemporaryFile) -> Flask:
+def query_plans(db_conn, func: Callable) -> List[str]:
+    """Run func and return the query plan of each statement it executed."""
+    statements = []
+    db_conn.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        db_conn.set_trace_callback(None)
+
+    return [
+        '\n'.join(row[3] for row in db_conn.execute(f'explain query plan {statement}'))
+        for statement in statements
+    ]
+
+
+def make_clean_client(
+    config_file: NamedTemporaryFile,
+    db_file: NamedTemporaryFile,
+    extra_config: Optional[Dict] = None,
+) -> Flask:
     apply_config = deepcopy(test_config)
     apply_config['sqlite file'] = db_file.name
+    apply_config.update(extra_config or {})
 
     yaml.dump(apply_config, config_file.file, encoding='utf-8')
 
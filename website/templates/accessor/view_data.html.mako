@@ -12,7 +12,7 @@
 
 <h2>Data</h2>
 
-% if datatable:
+% if datatable['recordsTotal']:
 ## Do not show if we have no data
 <div class="row">
     <div class="col-12">
@@ -21,7 +21,13 @@
 </div>
 <script type="text/javascript">
     $(document).ready(function () {
-        Plotly.newPlot('${elem_id}_plot', ${json.dumps(plot['data'])}, ${json.dumps(plot['layout'])});
+        $.getJSON(${json.dumps(plot_url)}, function (plot) {
+            ## Compact traces have seconds since Epoch, plotly wants milliseconds.
+            plot.data.forEach(function (trace) {
+                trace.x = trace.x.map(function (t) { return t * 1000; });
+            });
+            Plotly.newPlot('${elem_id}_plot', plot.data, plot.layout);
+        });
     });
 </script>
 % endif
@@ -32,14 +38,28 @@
 
         <script type="text/javascript">
             $(document).ready(function () {
+                ## The compact pages only have numbers, see compact_datatable.
                 function renderDatetime(data, disp_type, row, meta) {
-                    if (!data) {
+                    if (data === null) {
                         return '-';
                     }
                     if (disp_type === 'display') {
-                        return data.label;
+                        ## Like Datapoint.format_timestamp, in UTC.
+                        return new Date(data * 1000).toISOString().slice(0, 19);
                     }
-                    return data.timestamp;
+                    return data;
+                }
+
+                function renderNumber(digits) {
+                    return function (data, disp_type, row, meta) {
+                        if (data === null) {
+                            return '-';
+                        }
+                        if (disp_type === 'display') {
+                            return data.toFixed(digits);
+                        }
+                        return data;
+                    };
                 }
 
                 function renderActions(data, disp_type, row, meta) {
@@ -60,20 +80,53 @@
                     "<'row'<'col-12'tr>>" +
                     "<'row'<'col-sm-12 col-md-5'i><'col-sm-12 col-md-7'p>>";
             
+                ## Only the first page comes with the page, the others are requested when needed.
+                ## TODO(tr) js dump that protects " and <, > etc
+                var firstPage = ${json.dumps(datatable)};
+
+                function toRows(page) {
+                    ## __id__ is DATAPOINT_ID_PLACEHOLDER.
+                    var columns = page.columns;
+                    page.data = columns.id.map(function (id, i) {
+                        return {
+                            when: columns.timestamp[i],
+                            angle: columns.angle[i],
+                            temperature: columns.temperature[i],
+                            battery: columns.battery[i],
+                            delete_link: page.delete_url ? page.delete_url.replace('__id__', id) : null
+                        };
+                    });
+                    return page;
+                }
+
+                function getPage(request, callback, settings) {
+                    if (firstPage !== null) {
+                        var page = firstPage;
+                        firstPage = null;
+                        page.draw = request.draw;
+                        callback(toRows(page));
+                        return;
+                    }
+                    $.getJSON(${json.dumps(datatable_url)}, request, function (page) {
+                        callback(toRows(page));
+                    });
+                }
+
                 var dt = $('#${elem_id}_table').DataTable({
                     searching: false,
                     dom: dom,
+                    serverSide: true,
+                    ajax: getPage,
                     columns: [
                         {data: 'when', title: 'When', render: renderDatetime},
-                        ##{data: 'gravity', title: 'Gravity', type: 'num'},
-                        {data: 'angle', title: 'Angle (&deg;)', type: 'num'},
-                        {data: 'temperature', title: 'Temperature (C)', type: 'num'},
-                        {data: 'battery', title: 'Battery (V)', type: 'num-fmt'},
-                        {data: 'delete_link', title: '-', render: renderActions, sortable: false, searchable: false, visible: ${'true' if allow_delete_datapoints else 'false'}}
+                        ##{data: 'gravity', title: 'Gravity', type: 'num', orderable: false},
+                        {data: 'angle', title: 'Angle (&deg;)', type: 'num', render: renderNumber(1), orderable: false},
+                        {data: 'temperature', title: 'Temperature (C)', type: 'num', render: renderNumber(1), orderable: false},
+                        {data: 'battery', title: 'Battery (V)', type: 'num', render: renderNumber(2), orderable: false},
+                        {data: 'delete_link', title: '-', render: renderActions, orderable: false, searchable: false, visible: ${'true' if allow_delete_datapoints else 'false'}}
                     ],
-                    order: [0, 'desc'],
-                    ## TODO(tr) js dump that protects " and <, > etc
-                    data: ${json.dumps(datatable)}
+                    ## Only the timestamp can be ordered, see get_datatable_args.
+                    order: [0, 'desc']
                 });
 
                 ## Populate the links